@@ -0,0 +1,174 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from app.configs.tariffs import CompiledPlan, compile_tariffs, load_tariffs
+from app.managers.instrumentation import collect_timings
+from app.managers.tariff_manager import (
+    calculate_usage_metrics,
+    project_from_metrics,
+    recommend_from_metrics,
+)
+
+# compiled once per worker process by init_worker
+_PLANS: Optional[List[CompiledPlan]] = None
+# usage files picked up from a directory; the format itself is sniffed from the content
+USAGE_FILE_EXTENSIONS = (".csv", ".csv.gz", ".csv.zst", ".parquet", ".arrow", ".arrows")
+
+
+def init_worker(tariffs_path: str) -> None:
+    global _PLANS
+    _PLANS = compile_tariffs(load_tariffs(tariffs_path))
+
+
+def score_file(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Score one usage file, returning a JSON serializable result record."""
+    started = time.perf_counter()
+    record: Dict[str, Any] = {"id": job["id"], "path": job["path"]}
+    try:
+        # the parser counts the readings it parses, whatever the file's compression or format
+        with open(job["path"], "rb") as f, collect_timings() as timings:
+            metrics, months_order = calculate_usage_metrics(
+                f, job["considerGeneration"], job.get("engine"), _PLANS
+            )
+        if job["mode"] == "projected":
+            result = project_from_metrics(metrics, job["allowPlanSwitching"])
+        else:
+            result = recommend_from_metrics(metrics, months_order, job["allowPlanSwitching"])
+        if not job.get("includeMetrics"):
+            result.pop("metrics", None)
+        record["result"] = result
+        record["rows"] = int(timings.counts.get("rows", 0))
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        record["rows"] = 0
+    record["seconds"] = round(time.perf_counter() - started, 4)
+    return record
+
+
+def iter_jobs(source: str, defaults: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Yield jobs from a directory of usage files or a JSONL manifest."""
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            if name.lower().endswith(USAGE_FILE_EXTENSIONS):
+                yield {**defaults, "id": name, "path": os.path.join(source, name)}
+        return
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            path = entry["path"] if os.path.isabs(entry["path"]) else os.path.join(base, entry["path"])
+            yield {**defaults, **entry, "id": entry.get("id", entry["path"]), "path": path}
+
+
+def completed_ids(output: str) -> Set[str]:
+    """Read ids already scored successfully in output, dropping a line torn by a crash.
+
+    Ids whose record holds an "error" are left out, so a resumed run retries them.
+    """
+    done: Set[str] = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+            data = data[: data.rfind(b"\n") + 1]
+    for line in data.splitlines():
+        try:
+            record = json.loads(line)
+            if "error" not in record:
+                done.add(record["id"])
+        except (ValueError, KeyError, TypeError):
+            continue
+    return done
+
+
+def run(
+    source: str,
+    output: str,
+    workers: int,
+    tariffs_path: str,
+    defaults: Dict[str, Any],
+    log=sys.stderr,
+) -> Dict[str, float]:
+    """Score every job not yet present in output and return throughput stats."""
+    done = completed_ids(output)
+    jobs = (job for job in iter_jobs(source, defaults) if job["id"] not in done)
+    stats = {"files": 0, "errors": 0, "rows": 0, "skipped": len(done)}
+    started = time.perf_counter()
+
+    def report(final: bool = False) -> None:
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        stats["seconds"] = round(elapsed, 3)
+        stats["files_per_s"] = round(stats["files"] / elapsed, 2)
+        stats["rows_per_s"] = round(stats["rows"] / elapsed, 1)
+        print(
+            f"{'done' if final else 'progress'}: {stats['files']} files "
+            f"({stats['errors']} errors, {stats['skipped']} skipped), {stats['rows']} rows, "
+            f"{stats['files_per_s']} files/s, {stats['rows_per_s']} rows/s",
+            file=log,
+        )
+
+    with open(output, "a") as out:
+        def write(record: Dict[str, Any]) -> None:
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            stats["files"] += 1
+            stats["rows"] += record["rows"]
+            stats["errors"] += "error" in record
+            if stats["files"] % 100 == 0:
+                report()
+
+        if workers <= 0:
+            init_worker(tariffs_path)
+            for job in jobs:
+                write(score_file(job))
+        else:
+            with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(tariffs_path,)) as pool:
+                pending: Set[Future] = set()
+                for job in jobs:
+                    pending.add(pool.submit(score_file, job))
+                    if len(pending) >= workers * 4:
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            write(future.result())
+                for future in wait(pending).done:
+                    write(future.result())
+
+    report(final=True)
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Score many usage files against the tariff catalog.")
+    parser.add_argument("source", help="directory of usage files or a JSONL manifest of {id, path, ...}")
+    parser.add_argument("-o", "--output", required=True, help="JSONL results file, also used to resume")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="0 runs in process")
+    parser.add_argument("--tariffs", default="tariffs.json")
+    parser.add_argument("--mode", choices=["recommend", "projected"], default="recommend")
+    parser.add_argument("--engine", choices=["python", "numpy"], default=None)
+    parser.add_argument("--ignore-generation", action="store_true")
+    parser.add_argument("--no-switching", action="store_true")
+    parser.add_argument("--include-metrics", action="store_true")
+    args = parser.parse_args(argv)
+
+    defaults = {
+        "mode": args.mode,
+        "engine": args.engine,
+        "considerGeneration": not args.ignore_generation,
+        "allowPlanSwitching": not args.no_switching,
+        "includeMetrics": args.include_metrics,
+    }
+    stats = run(args.source, args.output, args.workers, args.tariffs, defaults)
+    return 1 if stats["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
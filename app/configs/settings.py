@@ -0,0 +1,79 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "python" charges row by row, "numpy" uses the vectorized engine
+METRICS_ENGINE: str = os.getenv("METRICS_ENGINE", "python")
+
+# Worker processes for metrics computation, 0 runs jobs in a thread instead
+WORKER_POOL_SIZE: int = int(os.getenv("WORKER_POOL_SIZE", "2"))
+# Jobs allowed to be queued or running before requests are rejected with 503
+WORKER_QUEUE_SIZE: int = int(os.getenv("WORKER_QUEUE_SIZE", "16"))
+WORKER_TIMEOUT: float = float(os.getenv("WORKER_TIMEOUT", "60"))
+WORKER_RETRY_AFTER: int = int(os.getenv("WORKER_RETRY_AFTER", "5"))
+# Threads parsing streamed uploads while they arrive; further streams get a 503. Parsing
+# runs in the server process and holds the GIL, so each one slows the event loop down
+STREAM_WORKERS: int = int(os.getenv("STREAM_WORKERS", "1"))
+# Request body chunks buffered between receiving a streamed upload and parsing it
+STREAM_BUFFER_CHUNKS: int = int(os.getenv("STREAM_BUFFER_CHUNKS", "16"))
+
+# In-memory metrics cache size, 0 disables caching
+METRICS_CACHE_MAX_BYTES: int = int(os.getenv("METRICS_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Optional directory for a cache tier shared by every worker on the host
+METRICS_CACHE_DIR: str = os.getenv("METRICS_CACHE_DIR", "")
+METRICS_CACHE_DISK_MAX_BYTES: int = int(os.getenv("METRICS_CACHE_DISK_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+LLM_MODEL: str = os.getenv("LLM_MODEL", "gpt-4o")
+# Completions allowed in flight at once against the OpenAI API
+LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+# Seconds to wait for a free slot, and for each upstream attempt
+LLM_TIMEOUT: float = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_RETRIES: int = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BACKOFF: float = float(os.getenv("LLM_RETRY_BACKOFF", "0.5"))
+
+# Approximate token budget for the analysis sent to the LLM, 0 means unlimited
+EXPLAIN_TOKEN_BUDGET: int = int(os.getenv("EXPLAIN_TOKEN_BUDGET", "1500"))
+
+# SQLite file holding per-customer monthly aggregates, empty disables the store
+USAGE_STORE_PATH: str = os.getenv("USAGE_STORE_PATH", "")
+
+# Live meter feed sessions held at once, and seconds without readings before one is dropped
+LIVE_MAX_SESSIONS: int = int(os.getenv("LIVE_MAX_SESSIONS", "1000"))
+LIVE_SESSION_IDLE_SECONDS: float = float(os.getenv("LIVE_SESSION_IDLE_SECONDS", "900"))
+# Readings accepted in one request to a live session; larger bodies get a 413
+LIVE_MAX_READINGS_PER_REQUEST: int = int(os.getenv("LIVE_MAX_READINGS_PER_REQUEST", "10000"))
+# Updates buffered for a subscriber of a live session before its stream is ended
+LIVE_SUBSCRIBER_BUFFER: int = int(os.getenv("LIVE_SUBSCRIBER_BUFFER", "256"))
+
+# Token expected in the X-Admin-Token header of admin requests, empty disables them
+ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN", "")
+
+TARIFFS_PATH: str = os.getenv("TARIFFS_PATH", "tariffs.json")
+# Seconds between checks of the tariff file for changes, 0 disables hot reload
+TARIFFS_CHECK_INTERVAL: float = float(os.getenv("TARIFFS_CHECK_INTERVAL", "5"))
+
+# Subsystems initialized before the server accepts requests, comma separated: tariffs, pool, llm.
+# Anything not listed is initialized on first use.
+STARTUP_WARMUP: str = os.getenv("STARTUP_WARMUP", "tariffs")
+
+# Per-stage request timing for Server-Timing headers and /metrics
+TIMING_ENABLED: bool = os.getenv("TIMING_ENABLED", "1") not in ("0", "false", "")
+# Directory for sampling profiles of requests sent with "X-Profile: 1", empty disables profiling
+PROFILE_DIR: str = os.getenv("PROFILE_DIR", "")
+PROFILE_INTERVAL: float = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+
+# JSON responses at least this large are gzip/brotli compressed when accepted, 0 disables
+COMPRESS_MIN_BYTES: int = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+
+# Largest decompressed size of a gzip or zstd upload, 0 for no limit
+UPLOAD_MAX_DECOMPRESSED_BYTES: int = int(os.getenv("UPLOAD_MAX_DECOMPRESSED_BYTES", str(1024 * 1024 * 1024)))
+
+# Merge readings per clock hour in time order before charging, which also accepts unsorted
+# and multi-meter files; when off, rows must be sorted by time
+HOURLY_AGGREGATION: bool = os.getenv("HOURLY_AGGREGATION", "1") not in ("0", "false", "")
+# What to do when a reading does not start where the previous one ended: ignore, warn or reject
+USAGE_GAP_POLICY: str = os.getenv("USAGE_GAP_POLICY", "warn")
+# Hours of merged readings held in memory before sorted runs are spilled to temporary files
+USAGE_SORT_BUFFER_HOURS: int = int(os.getenv("USAGE_SORT_BUFFER_HOURS", "100000"))
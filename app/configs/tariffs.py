@@ -1,6 +1,16 @@
+import hashlib
 import json
+import logging
 import os
-from typing import Any, Dict, List
+import threading
+import time
+from bisect import bisect_right
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.configs.settings import TARIFFS_CHECK_INTERVAL, TARIFFS_PATH
+
+logger = logging.getLogger(__name__)
+
 
 class HourlyConfig:
     def __init__(self, data: Dict[str, Any]):
@@ -9,6 +19,11 @@ class HourlyConfig:
         self.threshold = data.get("billedAfterUsage") or 0.0
         self.cost = data["cost"]
 
+    @property
+    def key(self) -> str:
+        """Breakdown key identifying this config within a plan."""
+        return f"h{self.start}_{self.end}_t{self.threshold}"
+
     def matches_hour(self, hour: int) -> bool:
         if self.start is None and self.end is None:
             return True
@@ -17,6 +32,22 @@ class HourlyConfig:
         return start <= hour < end
 
 
+def describe_config(cfg: HourlyConfig) -> str:
+    """Return a human friendly description of a config."""
+    if cfg.start is None and cfg.end is None:
+        hour_desc = "All hours of the day"
+    else:
+        start = cfg.start if cfg.start is not None else 0
+        end = cfg.end if cfg.end is not None else 24
+        hour_desc = f"Hours {start}-{end}"
+
+    if cfg.threshold:
+        thr_desc = f"applied after {cfg.threshold} kWh"
+    else:
+        thr_desc = "applied from the first kWh"
+    return f"{hour_desc}, {thr_desc}"
+
+
 def select_config(configs: List[HourlyConfig], hour: int, usage: float) -> HourlyConfig:
     """Select the config that applies for the given hour and cumulative usage."""
     applicable = [c for c in configs if c.matches_hour(hour) and usage >= c.threshold]
@@ -27,6 +58,90 @@ def select_config(configs: List[HourlyConfig], hour: int, usage: float) -> Hourl
     return max(applicable, key=lambda c: c.threshold)
 
 
+# (threshold, cost per kWh, component id)
+Tier = Tuple[float, float, int]
+
+
+class CompiledPlan:
+    """A tariff plan reduced to 24 per-hour tier tables.
+
+    Each hour holds the configs that apply to it sorted by threshold, so that
+    charging a reading is a table lookup plus a bisect instead of a scan over
+    every config. Configs sharing a breakdown key share a component id.
+    """
+
+    __slots__ = ("name", "base_fee", "configs", "keys", "descriptions", "hours", "thresholds", "pricing", "segments")
+
+    def __init__(self, plan: Dict[str, Any]):
+        self.name: str = plan["name"]
+        self.base_fee: float = plan.get("baseFee", 0.0)
+        self.configs = [HourlyConfig(c) for c in plan.get("hourlyConfigs", [])]
+        self.keys: List[str] = []
+        self.descriptions: List[str] = []
+
+        ids: Dict[str, int] = {}
+        config_ids: List[int] = []
+        for cfg in self.configs:
+            key = cfg.key
+            if key not in ids:
+                ids[key] = len(self.keys)
+                self.keys.append(key)
+                self.descriptions.append(describe_config(cfg))
+            config_ids.append(ids[key])
+
+        self.hours: List[Tuple[Tier, ...]] = []
+        self.thresholds: List[Tuple[float, ...]] = []
+        for hour in range(24):
+            # on equal thresholds the first config wins, as in select_config
+            tiers: Dict[float, Tier] = {}
+            for cfg, cid in zip(self.configs, config_ids):
+                if cfg.matches_hour(hour) and cfg.threshold not in tiers:
+                    tiers[cfg.threshold] = (cfg.threshold, cfg.cost, cid)
+            ordered = tuple(sorted(tiers.values(), key=lambda t: t[0]))
+            self.hours.append(ordered)
+            self.thresholds.append(tuple(t[0] for t in ordered))
+
+        self.pricing = self._classify()
+        # usage segment arrays of the numpy engine, built on first use
+        self.segments: Optional[Tuple[Any, ...]] = None
+
+    def _classify(self) -> str:
+        """How much of the data the monthly cost of this plan depends on.
+
+        "hourly": one rate per hour, so only kWh per hour of day matter.
+        "total": the same tiers at every hour, so only the monthly total matters.
+        "sequential": thresholds differ between hours, so reading order matters.
+        """
+        if all(len(tiers) <= 1 for tiers in self.hours):
+            return "hourly"
+        if all(tiers == self.hours[0] for tiers in self.hours):
+            return "total"
+        return "sequential"
+
+    def tier_at(self, hour: int, usage: float) -> Tuple[int, float]:
+        """Return (tier index, next threshold) for cumulative usage at an hour.
+
+        Mirrors select_config: below the lowest threshold the highest tier applies.
+        """
+        thresholds = self.thresholds[hour]
+        if not thresholds:
+            raise ValueError("No tariff config applies to hour")
+        idx = bisect_right(thresholds, usage)
+        next_threshold = thresholds[idx] if idx < len(thresholds) else float("inf")
+        return (idx - 1 if idx else len(thresholds) - 1), next_threshold
+
+
+def compile_tariffs(tariffs: List[Dict[str, Any]]) -> List[CompiledPlan]:
+    """Compile every plan of a tariff catalog."""
+    return [CompiledPlan(p) for p in tariffs]
+
+
+def tariffs_fingerprint(tariffs: List[Dict[str, Any]]) -> str:
+    """Return a content hash identifying a tariff catalog."""
+    canonical = json.dumps(tariffs, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()[:16]
+
+
 def load_tariffs(path: str = "tariffs.json") -> List[Dict[str, Any]]:
     if not os.path.exists(path):
         raise FileNotFoundError(f"Tariff config {path} not found")
@@ -34,4 +149,117 @@ def load_tariffs(path: str = "tariffs.json") -> List[Dict[str, Any]]:
         return json.load(f)
 
 
-TARIFFS: List[Dict[str, Any]] = load_tariffs()
+def _is_number(value: Any) -> bool:
+    # bool is an int subclass, but true is not a price
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def validate_tariffs(tariffs: Any) -> List[Dict[str, Any]]:
+    """Check the structure of a tariff catalog, raising ValueError on the first problem."""
+    if not isinstance(tariffs, list):
+        raise ValueError("Tariff catalog must be a list of plans")
+    names = set()
+    for plan in tariffs:
+        if not isinstance(plan, dict) or not isinstance(plan.get("name"), str):
+            raise ValueError("Every tariff plan needs a name")
+        name = plan["name"]
+        if name in names:
+            raise ValueError(f"Duplicate tariff plan {name}")
+        names.add(name)
+        if not _is_number(plan.get("baseFee", 0)) or plan.get("baseFee", 0) < 0:
+            raise ValueError(f"Plan {name}: baseFee must be a non-negative number")
+        configs = plan.get("hourlyConfigs", [])
+        if not isinstance(configs, list):
+            raise ValueError(f"Plan {name}: hourlyConfigs must be a list")
+        for cfg in configs:
+            if not isinstance(cfg, dict) or not _is_number(cfg.get("cost")):
+                raise ValueError(f"Plan {name}: every hourly config needs a numeric cost")
+            start, end = cfg.get("startHour"), cfg.get("endHour")
+            for hour in (start, end):
+                if hour is not None and (not isinstance(hour, int) or isinstance(hour, bool) or not 0 <= hour <= 24):
+                    raise ValueError(f"Plan {name}: hours must be integers between 0 and 24")
+            if start is not None and end is not None and start >= end:
+                raise ValueError(f"Plan {name}: startHour must be before endHour")
+            threshold = cfg.get("billedAfterUsage")
+            if threshold is not None and (not _is_number(threshold) or threshold < 0):
+                raise ValueError(f"Plan {name}: billedAfterUsage must be a non-negative number")
+    return tariffs
+
+
+class TariffCatalog:
+    """An immutable, validated and compiled snapshot of the tariff file."""
+
+    __slots__ = ("tariffs", "plans", "version")
+
+    def __init__(self, tariffs: List[Dict[str, Any]]):
+        self.tariffs = validate_tariffs(tariffs)
+        self.plans = compile_tariffs(tariffs)
+        self.version = tariffs_fingerprint(tariffs)
+
+
+class TariffRegistry:
+    """Holds the current TariffCatalog and swaps it when the file changes.
+
+    A snapshot is replaced atomically, so requests that already took one keep
+    using it until they finish. A catalog that fails to load or validate
+    leaves the current snapshot in place.
+    """
+
+    def __init__(self, path: str, check_interval: float):
+        self.path = path
+        self.check_interval = check_interval
+        self._catalog: Optional[TariffCatalog] = None
+        self._stat: Optional[Tuple[int, int]] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _file_stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def current(self) -> TariffCatalog:
+        """Return the current snapshot, reloading first if the file changed."""
+        catalog = self._catalog
+        if catalog is None:
+            return self.reload()
+        if self.check_interval and time.monotonic() - self._checked_at >= self.check_interval:
+            self._checked_at = time.monotonic()
+            if self._file_stat() != self._stat:
+                try:
+                    return self.reload()
+                except (OSError, ValueError) as e:
+                    logger.error("Keeping tariff catalog %s: %s", catalog.version, e)
+        return catalog
+
+    def reload(self) -> TariffCatalog:
+        """Load, validate and compile the file, then swap it in."""
+        with self._lock:
+            stat = self._file_stat()
+            catalog = TariffCatalog(load_tariffs(self.path))
+            if self._catalog is None or catalog.version != self._catalog.version:
+                logger.info("Loaded tariff catalog %s with %d plans", catalog.version, len(catalog.plans))
+                self._catalog = catalog
+            self._stat = stat
+            self._checked_at = time.monotonic()
+            return self._catalog
+
+
+TARIFF_REGISTRY = TariffRegistry(TARIFFS_PATH, TARIFFS_CHECK_INTERVAL)
+
+
+def __getattr__(name: str) -> Any:
+    """Module attributes of the catalog before it was reloadable, now read from the registry.
+
+    Each access returns the current snapshot, so code that keeps the value
+    holds on to that catalog.
+    """
+    if name == "TARIFFS":
+        return TARIFF_REGISTRY.current().tariffs
+    if name == "COMPILED_PLANS":
+        return TARIFF_REGISTRY.current().plans
+    if name == "TARIFFS_FINGERPRINT":
+        return TARIFF_REGISTRY.current().version
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,54 @@
+import hmac
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from app.configs.settings import ADMIN_TOKEN
+from app.configs.tariffs import TARIFF_REGISTRY
+from app.managers.instrumentation import METRICS
+from app.managers.result_cache import METRICS_CACHE
+
+router = APIRouter()
+
+
+def is_admin(token: Optional[str]) -> bool:
+    """Whether a request token matches ADMIN_TOKEN; always false when no token is configured."""
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """Reject requests without the configured X-Admin-Token header."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled, ADMIN_TOKEN is not set")
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+@router.get("/cache/stats")
+async def cache_stats():
+    """Return hit and miss counts of the metrics cache."""
+    return METRICS_CACHE.stats()
+
+
+@router.get("/metrics")
+async def metrics():
+    """Request and stage durations in Prometheus text format."""
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/admin/tariffs")
+async def tariffs_version():
+    """Return the version of the tariff catalog currently in use."""
+    catalog = TARIFF_REGISTRY.current()
+    return {"version": catalog.version, "plans": len(catalog.plans)}
+
+
+@router.post("/admin/tariffs/reload", dependencies=[Depends(require_admin)])
+async def reload_tariffs():
+    """Reload the tariff file now; an invalid file keeps the current catalog."""
+    try:
+        catalog = TARIFF_REGISTRY.reload()
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid tariff catalog: {e}")
+    return {"version": catalog.version, "plans": len(catalog.plans)}
@@ -0,0 +1,122 @@
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict, List
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
+
+from app.configs.settings import LIVE_MAX_READINGS_PER_REQUEST, WORKER_RETRY_AFTER
+from app.managers.live_sessions import LIVE_SESSIONS, LiveSession, SessionLimitError
+
+router = APIRouter(prefix="/live")
+
+NDJSON = "application/x-ndjson"
+# body bytes allowed per reading a request may carry
+MAX_READING_BYTES = 1024
+# readings applied between giving other requests a turn on the event loop
+READINGS_PER_YIELD = 256
+
+
+def ndjson_line(value: Dict[str, Any]) -> bytes:
+    return json.dumps(value, separators=(",", ":")).encode() + b"\n"
+
+
+def get_session(session_id: str) -> LiveSession:
+    session = LIVE_SESSIONS.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired live session")
+    return session
+
+
+async def read_lines(request: Request, max_readings: int) -> List[bytes]:
+    """Read an NDJSON body, rejecting it with 413 before any reading is applied when it is too large."""
+    too_large = HTTPException(status_code=413, detail=f"At most {max_readings} readings per request")
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > max_readings * MAX_READING_BYTES:
+            raise too_large
+    lines = bytes(body).splitlines()
+    if sum(1 for line in lines if line.strip()) > max_readings:
+        raise too_large
+    return lines
+
+
+@router.post("/sessions")
+async def create_session(considerGeneration: bool = Query(True)):
+    """Open a live session pricing readings against the current tariff catalog."""
+    try:
+        session = LIVE_SESSIONS.create(considerGeneration)
+    except SessionLimitError:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many live sessions, please retry later",
+            headers={"Retry-After": str(WORKER_RETRY_AFTER)},
+        )
+    return {"session": session.id, "tariffVersion": session.version, "plans": len(session.names)}
+
+
+@router.post("/sessions/{session_id}/readings")
+async def add_readings(session_id: str, request: Request):
+    """Apply readings sent as NDJSON, one object with the CSV columns per line.
+
+    Returns one NDJSON line per reading: the running costs after it, or an
+    "error" for a reading that was rejected; later readings still apply.
+    A request carries at most LIVE_MAX_READINGS_PER_REQUEST readings, and
+    other requests get the event loop every READINGS_PER_YIELD readings.
+    """
+    session = get_session(session_id)
+    body = await read_lines(request, LIVE_MAX_READINGS_PER_REQUEST)
+    lines = []
+    async with session.lock:
+        for number, line in enumerate(body, 1):
+            if not line.strip():
+                continue
+            try:
+                reading = json.loads(line)
+                if not isinstance(reading, dict):
+                    raise ValueError("Reading must be a JSON object")
+                lines.append(ndjson_line(session.apply(reading)))
+            except ValueError as e:
+                lines.append(ndjson_line({"error": str(e), "line": number}))
+            if len(lines) % READINGS_PER_YIELD == 0:
+                await asyncio.sleep(0)
+    return Response(b"".join(lines), media_type=NDJSON)
+
+
+@router.get("/sessions/{session_id}/events")
+async def session_events(session_id: str):
+    """Stream the session's running costs as NDJSON, starting with the current state.
+
+    The stream ends when the session is closed or evicted, or when the
+    client falls too far behind.
+    """
+    session = get_session(session_id)
+    queue = session.subscribe()
+
+    async def events() -> AsyncIterator[bytes]:
+        try:
+            yield ndjson_line(session.current())
+            while True:
+                update = await queue.get()
+                if update is None:
+                    return
+                yield ndjson_line(update)
+        finally:
+            session.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type=NDJSON)
+
+
+@router.get("/sessions/{session_id}")
+async def session_summary(session_id: str):
+    """Month-to-date costs and the cheapest plan of every closed month."""
+    return get_session(session_id).summary()
+
+
+@router.delete("/sessions/{session_id}")
+async def close_session(session_id: str):
+    """Close a session, returning its final summary."""
+    session = get_session(session_id)
+    LIVE_SESSIONS.close(session_id)
+    return session.summary()
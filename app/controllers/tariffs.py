@@ -1,20 +1,113 @@
-from fastapi import APIRouter, UploadFile, File, Query
-from fastapi.responses import JSONResponse
-from dotenv import load_dotenv
+from fastapi import APIRouter, Depends, UploadFile, File, Form, Header, Query, HTTPException, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
+import asyncio
 import json
-import os
-import openai
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Dict, Literal, Optional
 
+from app.configs.settings import USAGE_STORE_PATH, WORKER_RETRY_AFTER
+from app.controllers.admin import require_admin
+from app.managers.instrumentation import stage
+from app.managers.llm_client import LLMBusyError
+from app.managers.metrics_table import MetricsTable
+from app.managers.plan_search import top_k_plans_async
+from app.managers.scenarios import recommend_scenarios, scenario_metrics_async, validate_scenarios
 from app.managers.tariff_manager import (
-    calculate_from_csv,
-    get_analysis_projected,
-    get_analysis_email
+    calculate_customer_metrics_async,
+    calculate_usage_metrics_async,
+    calculate_usage_metrics_stream,
+    calculate_usage_metrics_variants_async,
+    explain_analysis,
+    project_from_table,
+    recommend_from_table,
+    recommend_variants,
+    shape_result,
+    stream_explanation,
 )
-from app.configs.tariffs import load_tariffs
+from app.managers.upload_stream import SavedUpload, UploadError, save_upload, upload_chunks
+from app.managers.usage_parser import UsageDataError
+from app.managers.worker_pool import PoolSaturatedError
 
 router = APIRouter()
 
-load_dotenv()
+Detail = Literal["summary", "recommended", "full"]
+Engine = Literal["python", "numpy"]
+
+
+async def offload(awaitable: Awaitable[Any]) -> Any:
+    """Await work submitted to the worker pool, mapping pool errors to HTTP errors."""
+    try:
+        return await awaitable
+    except PoolSaturatedError:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, please retry later",
+            headers={"Retry-After": str(WORKER_RETRY_AFTER)},
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Usage analysis timed out")
+    except UsageDataError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@asynccontextmanager
+async def read_upload(usageData: UploadFile) -> AsyncIterator[SavedUpload]:
+    """Save an upload to a temporary file for the worker pool, removing it when the request is done."""
+    with stage("upload"):
+        upload = await save_upload(usageData)
+    try:
+        yield upload
+    finally:
+        upload.remove()
+
+
+def customer_id(
+    customerId: Optional[str] = Query(None), x_admin_token: Optional[str] = Header(None)
+) -> Optional[str]:
+    """The customer whose stored history an upload reads and extends, if any.
+
+    Anyone knowing a customer id could read or overwrite that history, so
+    these requests need the usage store and the admin token.
+    """
+    if customerId is None:
+        return None
+    if not USAGE_STORE_PATH:
+        raise HTTPException(status_code=400, detail="Customer usage store is not configured")
+    require_admin(x_admin_token)
+    return customerId
+
+
+def json_response(result: Dict[str, Any]) -> ORJSONResponse:
+    """Serialize a result with orjson, timing the rendering as its own stage."""
+    with stage("serialize"):
+        return ORJSONResponse(result)
+
+
+async def compute_metrics(
+    usageData: UploadFile,
+    considerGeneration: bool,
+    engine: Optional[str],
+    customerId: Optional[str] = None,
+) -> MetricsTable:
+    """Run the metrics computation off the event loop."""
+    async with read_upload(usageData) as upload:
+        if customerId is not None:
+            return await offload(calculate_customer_metrics_async(upload, considerGeneration, customerId, engine))
+        return await offload(calculate_usage_metrics_async(upload, considerGeneration, engine))
+
+
+async def stream_metrics(
+    request: Request,
+    considerGeneration: bool,
+    engine: Optional[str],
+    customerId: Optional[str] = None,
+) -> MetricsTable:
+    """Compute metrics while the request body is still arriving."""
+    chunks = upload_chunks(request.stream(), request.headers.get("content-type", ""))
+    try:
+        return await offload(calculate_usage_metrics_stream(chunks, considerGeneration, engine, customerId))
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.post("/recommend")
@@ -22,9 +115,14 @@ async def recommend(
     usageData: UploadFile = File(...),
     considerGeneration: bool = Query(True),
     allowPlanSwitching: bool = Query(True),
+    engine: Optional[Engine] = Query(None),
+    customerId: Optional[str] = Depends(customer_id),
+    detail: Detail = Query("full"),
 ):
-    result = calculate_from_csv(usageData.file, considerGeneration, allowPlanSwitching)
-    return JSONResponse(result)
+    table = await compute_metrics(usageData, considerGeneration, engine, customerId)
+    with stage("recommend"):
+        result = recommend_from_table(table, allowPlanSwitching)
+    return json_response(shape_result(result, detail))
 
 
 @router.post("/v2/recommend")
@@ -32,10 +130,92 @@ async def recommend_v2(
     usageData: UploadFile = File(...),
     considerGeneration: bool = Query(True),
     allowPlanSwitching: bool = Query(True),
+    engine: Optional[Engine] = Query(None),
+    customerId: Optional[str] = Depends(customer_id),
+    detail: Detail = Query("full"),
 ):
     """Recommend tariff plans based on averaged usage patterns."""
-    result = get_analysis_projected(usageData.file, considerGeneration, allowPlanSwitching)
-    return JSONResponse(result)
+    table = await compute_metrics(usageData, considerGeneration, engine, customerId)
+    result = project_from_table(table, allowPlanSwitching)
+    return json_response(shape_result(result, detail))
+
+
+@router.post("/recommend/stream")
+async def recommend_stream(
+    request: Request,
+    considerGeneration: bool = Query(True),
+    allowPlanSwitching: bool = Query(True),
+    engine: Optional[Engine] = Query(None),
+    customerId: Optional[str] = Depends(customer_id),
+    detail: Detail = Query("full"),
+):
+    """/recommend for a multipart or raw upload parsed while it is received."""
+    table = await stream_metrics(request, considerGeneration, engine, customerId)
+    with stage("recommend"):
+        result = recommend_from_table(table, allowPlanSwitching)
+    return json_response(shape_result(result, detail))
+
+
+@router.post("/v2/recommend/stream")
+async def recommend_v2_stream(
+    request: Request,
+    considerGeneration: bool = Query(True),
+    allowPlanSwitching: bool = Query(True),
+    engine: Optional[Engine] = Query(None),
+    customerId: Optional[str] = Depends(customer_id),
+    detail: Detail = Query("full"),
+):
+    """/v2/recommend for a multipart or raw upload parsed while it is received."""
+    table = await stream_metrics(request, considerGeneration, engine, customerId)
+    result = project_from_table(table, allowPlanSwitching)
+    return json_response(shape_result(result, detail))
+
+
+@router.post("/recommend/variants")
+async def recommend_variants_endpoint(
+    usageData: UploadFile = File(...),
+    projected: bool = Query(False),
+    engine: Optional[Engine] = Query(None),
+    detail: Detail = Query("full"),
+):
+    """Recommend plans for every considerGeneration and allowPlanSwitching combination at once."""
+    async with read_upload(usageData) as upload:
+        variants = await offload(calculate_usage_metrics_variants_async(upload, engine))
+    return json_response(recommend_variants(variants, projected, detail))
+
+
+@router.post("/recommend/top")
+async def recommend_top(
+    usageData: UploadFile = File(...),
+    considerGeneration: bool = Query(True),
+    k: int = Query(5, ge=1),
+    metrics: bool = Query(False),
+    engine: Optional[Engine] = Query(None),
+):
+    """Return the k cheapest plans without switching, pruning plans that cannot make the cut."""
+    async with read_upload(usageData) as upload:
+        result = await offload(top_k_plans_async(upload, considerGeneration, k, engine, metrics))
+    return json_response(result)
+
+
+@router.post("/recommend/scenarios")
+async def recommend_scenarios_endpoint(
+    usageData: UploadFile = File(...),
+    scenarios: str = Form(...),
+    considerGeneration: bool = Query(True),
+    allowPlanSwitching: bool = Query(True),
+    detail: Detail = Query("full"),
+):
+    """Recommend plans for the uploaded usage and for each what-if scenario, from one read of the file."""
+    try:
+        parsed = validate_scenarios(json.loads(scenarios))
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid scenarios: {exc}")
+    async with read_upload(usageData) as upload:
+        results = await offload(scenario_metrics_async(upload, parsed, considerGeneration))
+    with stage("recommend"):
+        result = recommend_scenarios(results, allowPlanSwitching, detail)
+    return json_response(result)
 
 
 @router.post("/explain")
@@ -43,8 +223,23 @@ async def explain(
     usageData: UploadFile = File(...),
     considerGeneration: bool = Query(True),
     allowPlanSwitching: bool = Query(True),
+    engine: Optional[Engine] = Query(None),
+    customerId: Optional[str] = Depends(customer_id),
+    stream: bool = Query(False),
 ):
     """Return an LLM generated explanation of the best tariff option."""
-    result = await get_analysis_email(usageData.file, considerGeneration, allowPlanSwitching)
-    return JSONResponse(result)
+    table = await compute_metrics(usageData, considerGeneration, engine, customerId)
+    analysis = project_from_table(table, allowPlanSwitching)
+    try:
+        if stream:
+            email = await stream_explanation(analysis, allowPlanSwitching)
+            return StreamingResponse(email, media_type="text/plain; charset=utf-8")
+        result = await explain_analysis(analysis, allowPlanSwitching)
+    except LLMBusyError:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many explanations in progress, please retry later",
+            headers={"Retry-After": str(WORKER_RETRY_AFTER)},
+        )
+    return json_response(result)
     # We simple return response but this could trigger the email by publishing message or api call to our email provider service
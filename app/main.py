@@ -1,9 +1,99 @@
-from fastapi import FastAPI
+import time
 
-from app.controllers import tariffs
+IMPORT_STARTED = time.perf_counter()
 
-app = FastAPI()
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
+
+from app.compression import CompressionMiddleware
+from app.configs.settings import (
+    COMPRESS_MIN_BYTES,
+    PROFILE_DIR,
+    PROFILE_INTERVAL,
+    STARTUP_WARMUP,
+    TIMING_ENABLED,
+)
+from app.controllers import admin, live, tariffs
+from app.controllers.admin import is_admin
+from app.managers.instrumentation import METRICS, SamplingProfiler, collect_timings, write_profile
+from app.managers.warmup import parse_steps, warm_up
+from app.managers.worker_pool import STREAM_RUNNER, WORKER_POOL
+
+
+class FirstResponseMiddleware:
+    """Records the time from import to the end of the first response, then only passes requests on.
+
+    Used when TIMING_ENABLED is off, so the startup metric is kept without timing every request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.recorded = False
+
+    async def __call__(self, scope, receive, send):
+        if self.recorded or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        await self.app(scope, receive, send)
+        self.recorded = True
+        METRICS.record_startup("first_response", time.perf_counter() - IMPORT_STARTED)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run the STARTUP_WARMUP steps before serving; everything else starts on first use."""
+    await warm_up(parse_steps(STARTUP_WARMUP))
+    yield
+    WORKER_POOL.shutdown()
+    STREAM_RUNNER.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(tariffs.router)
+app.include_router(admin.router)
+app.include_router(live.router)
+
+if TIMING_ENABLED:
+
+    @app.middleware("http")
+    async def server_timing(request: Request, call_next):
+        """Time each request by stage, report it in Server-Timing and /metrics.
+
+        Requests sent with "X-Profile: 1" and the admin token are also
+        sampled by a stack profiler when PROFILE_DIR is set; the profile
+        file name is returned in the X-Profile header.
+        """
+        profile = (
+            bool(PROFILE_DIR)
+            and request.headers.get("x-profile") == "1"
+            and is_admin(request.headers.get("x-admin-token"))
+        )
+        started = time.perf_counter()
+        with collect_timings(profile) as timings:
+            if profile:
+                with SamplingProfiler(PROFILE_INTERVAL) as profiler:
+                    response = await call_next(request)
+                timings.samples.update(profiler.samples)
+            else:
+                response = await call_next(request)
+        elapsed = time.perf_counter() - started
+        route = request.scope.get("route")
+        route_path = route.path if route is not None else "unmatched"
+        METRICS.observe_request(route_path, elapsed, timings)
+        METRICS.record_startup("first_response", time.perf_counter() - IMPORT_STARTED)
+        header = timings.server_timing()
+        response.headers["Server-Timing"] = (header + ", " if header else "") + f"total;dur={elapsed * 1000:.1f}"
+        if profile:
+            response.headers["X-Profile"] = write_profile(timings.samples, route_path)
+        return response
+
+else:
+    app.add_middleware(FirstResponseMiddleware)
+
+if COMPRESS_MIN_BYTES:
+    app.add_middleware(CompressionMiddleware, minimum_size=COMPRESS_MIN_BYTES)
+
+METRICS.record_startup("import", time.perf_counter() - IMPORT_STARTED)
 
 if __name__ == "__main__":
     import uvicorn
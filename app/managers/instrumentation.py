@@ -0,0 +1,244 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from app.configs.settings import PROFILE_DIR, PROFILE_INTERVAL
+
+
+class RequestTimings:
+    """Stage durations and counts collected while serving one request."""
+
+    __slots__ = ("stages", "counts", "profile", "samples")
+
+    def __init__(self, profile: bool = False):
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, float] = {}
+        self.profile = profile
+        # folded stack -> samples, when profiling
+        self.samples: Counter = Counter()
+
+    def add(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def merge(self, stages: Dict[str, float], counts: Dict[str, float], samples: Dict[str, int]) -> None:
+        for name, seconds in stages.items():
+            self.add(name, seconds)
+        for name, value in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + value
+        self.samples.update(samples)
+
+    def server_timing(self) -> str:
+        """Render the stages as a Server-Timing header value, durations in ms."""
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items())
+
+
+# None outside instrumented requests, which makes stage() and count() no-ops
+_TIMINGS: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def current_timings() -> Optional[RequestTimings]:
+    return _TIMINGS.get()
+
+
+@contextmanager
+def collect_timings(profile: bool = False) -> Iterator[RequestTimings]:
+    """Collect stage timings for the code run inside the block."""
+    timings = RequestTimings(profile)
+    token = _TIMINGS.set(timings)
+    try:
+        yield timings
+    finally:
+        _TIMINGS.reset(token)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a block as a named stage of the current request."""
+    timings = _TIMINGS.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+
+def add_stage(name: str, seconds: float) -> None:
+    """Add a duration measured by the caller, for stages interleaved with others."""
+    timings = _TIMINGS.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+def timed_iter(iterable: Iterable[Any], name: str) -> Iterator[Any]:
+    """Yield from iterable, timing the work done producing each item as a stage."""
+    iterator = iter(iterable)
+    if _TIMINGS.get() is None:
+        return iterator
+    return _timed(iterator, name)
+
+
+def _timed(iterator: Iterator[Any], name: str) -> Iterator[Any]:
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            add_stage(name, time.perf_counter() - started)
+            return
+        add_stage(name, time.perf_counter() - started)
+        yield item
+
+
+def count(name: str, value: float) -> None:
+    """Record a size of the current request, e.g. rows parsed or prompt bytes."""
+    timings = _TIMINGS.get()
+    if timings is not None:
+        timings.counts[name] = timings.counts.get(name, 0) + value
+
+
+class SamplingProfiler:
+    """Samples the stack of the thread that created it at a fixed interval.
+
+    Other threads, such as those serving concurrent requests, are left out.
+    Samples are aggregated as folded stacks ("outer;inner count" lines), the
+    input format of flamegraph tools.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._target = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+    def __enter__(self) -> "SamplingProfiler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def run_instrumented(
+    fn: Callable[..., Any], args: Sequence[Any], profile: bool
+) -> Tuple[Any, Dict[str, float], Dict[str, float], Dict[str, int]]:
+    """Run a pool job collecting its stage timings so they can be sent back to the request."""
+    with collect_timings(profile) as timings:
+        if profile:
+            with SamplingProfiler(PROFILE_INTERVAL) as profiler:
+                result = fn(*args)
+            timings.samples.update(profiler.samples)
+        else:
+            result = fn(*args)
+    return result, timings.stages, timings.counts, dict(timings.samples)
+
+
+def write_profile(samples: Dict[str, int], label: str) -> str:
+    """Write folded stacks to PROFILE_DIR and return the file name."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{label.strip('/').replace('/', '_') or 'root'}-{os.getpid()}.folded"
+    with open(os.path.join(PROFILE_DIR, name), "w") as f:
+        for stack, samples_count in sorted(samples.items()):
+            f.write(f"{stack} {samples_count}\n")
+    return name
+
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Prometheus histogram with one label."""
+
+    def __init__(self, name: str, help_text: str, label: str, buckets: Sequence[float]):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._series: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, value: float) -> None:
+        with self._lock:
+            # bucket counts, then sum and count
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_value, series in sorted(self._series.items()):
+                label = f'{self.label}="{label_value}"'
+                for bound, value in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {value:g}')
+                lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {series[-1]:g}')
+                lines.append(f"{self.name}_sum{{{label}}} {series[-2]:g}")
+                lines.append(f"{self.name}_count{{{label}}} {series[-1]:g}")
+        return lines
+
+
+class MetricsRegistry:
+    """Process wide request and stage metrics rendered in Prometheus text format."""
+
+    def __init__(self):
+        self.requests = Histogram(
+            "http_request_duration_seconds", "Time to produce the response, by route.", "route", DURATION_BUCKETS
+        )
+        self.stages = Histogram(
+            "stage_duration_seconds", "Time spent per request in each processing stage.", "stage", DURATION_BUCKETS
+        )
+        self.sizes = Histogram(
+            "stage_items",
+            "Rows, months, plans and prompt bytes handled per request.",
+            "item",
+            (1, 10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000),
+        )
+        self.startup: Dict[str, float] = {}
+
+    def record_startup(self, phase: str, seconds: float) -> None:
+        """Record a one-off startup duration: import, a warm-up step or the first response."""
+        self.startup.setdefault(phase, seconds)
+
+    def observe_request(self, route: str, seconds: float, timings: RequestTimings) -> None:
+        self.requests.observe(route, seconds)
+        for name, value in timings.stages.items():
+            self.stages.observe(name, value)
+        for name, value in timings.counts.items():
+            self.sizes.observe(name, value)
+
+    def render(self) -> str:
+        lines = self.requests.render() + self.stages.render() + self.sizes.render()
+        lines += [
+            "# HELP app_startup_seconds Import time, warm-up steps and time from import to the first response.",
+            "# TYPE app_startup_seconds gauge",
+        ]
+        lines += [f'app_startup_seconds{{phase="{phase}"}} {seconds:g}' for phase, seconds in self.startup.items()]
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
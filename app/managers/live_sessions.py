@@ -0,0 +1,175 @@
+import asyncio
+import secrets
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set
+
+from app.configs.settings import LIVE_MAX_SESSIONS, LIVE_SESSION_IDLE_SECONDS, LIVE_SUBSCRIBER_BUFFER
+from app.configs.tariffs import TARIFF_REGISTRY, CompiledPlan
+from app.managers.tariff_manager import MetricsAccumulator, choose_from_table, prepare_consumption
+
+
+class SessionLimitError(Exception):
+    """Raised when the maximum number of live sessions is already open."""
+
+
+class LiveSession:
+    """Month-to-date cost of every plan for one meter feed, updated reading by reading.
+
+    Readings are charged to every plan as they arrive, so each one costs
+    O(plans). They must come in time order across months; a reading for a
+    month before the open one is rejected. Sessions keep the plans they were
+    created with when the tariff catalog is reloaded.
+    """
+
+    def __init__(self, session_id: str, plans: List[CompiledPlan], consider_generation: bool, version: str):
+        self.id = session_id
+        self.version = version
+        self.consider_generation = consider_generation
+        self.accumulator = MetricsAccumulator(plans, incremental=True)
+        self.names = [p.name for p in plans]
+        self.base_fees = [p.base_fee for p in plans]
+        self.month_kwh = 0.0
+        self.readings = 0
+        self.last_seen = time.monotonic()
+        self.subscribers: Set["asyncio.Queue[Optional[Dict[str, Any]]]"] = set()
+        # held while a request applies its readings, so requests do not interleave
+        self.lock = asyncio.Lock()
+
+    def apply(self, reading: Dict[str, Any]) -> Dict[str, Any]:
+        """Charge one reading and return the update sent to subscribers.
+
+        The update has the month-to-date usage and cost per plan, base fee
+        included, and the cheapest plan so far. When the reading opens a new
+        month, "closed" holds the final costs of the previous one.
+        """
+        try:
+            dt, cons = prepare_consumption(reading, self.consider_generation)
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Invalid reading: {e}")
+        month = dt.strftime("%Y-%m")
+        accumulator = self.accumulator
+        update: Dict[str, Any] = {}
+        if accumulator.current_month is not None and month != accumulator.current_month:
+            if month < accumulator.current_month:
+                raise ValueError(f"Reading for {month} arrived after {accumulator.current_month} started")
+            closed = accumulator.current_month
+            accumulator.finalize()
+            update["closed"] = {
+                "month": closed,
+                "costs": dict(zip(self.names, accumulator.table().plan_cost[-1].tolist())),
+            }
+            self.month_kwh = 0.0
+        accumulator.add_rows(((month, dt.hour, cons),))
+        self.month_kwh += cons
+        self.readings += 1
+        self.last_seen = time.monotonic()
+        update.update(self.current())
+        self.publish(update)
+        return update
+
+    def current(self) -> Dict[str, Any]:
+        """Month-to-date usage and costs of the open month."""
+        month = self.accumulator.current_month
+        if month is None:
+            return {"month": None, "usage": 0.0, "costs": {}, "best": None}
+        costs = [cost + fee for cost, fee in zip(self.accumulator.month_cost, self.base_fees)]
+        best = min(range(len(costs)), key=costs.__getitem__) if costs else None
+        return {
+            "month": month,
+            "usage": self.month_kwh,
+            "costs": dict(zip(self.names, costs)),
+            "best": self.names[best] if best is not None else None,
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        """The open month plus the cheapest plan of every closed month."""
+        closed = choose_from_table(self.accumulator.table(), True)["months"]
+        return {
+            "session": self.id,
+            "tariffVersion": self.version,
+            "readings": self.readings,
+            "current": self.current(),
+            "closed": closed,
+        }
+
+    def subscribe(self) -> "asyncio.Queue[Optional[Dict[str, Any]]]":
+        queue: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue(LIVE_SUBSCRIBER_BUFFER)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: "asyncio.Queue[Optional[Dict[str, Any]]]") -> None:
+        self.subscribers.discard(queue)
+
+    def publish(self, update: Optional[Dict[str, Any]]) -> None:
+        """Queue an update for every subscriber; None ends their streams.
+
+        A subscriber that falls LIVE_SUBSCRIBER_BUFFER updates behind is
+        dropped and its stream ended, rather than holding updates for it.
+        """
+        for queue in list(self.subscribers):
+            if update is not None and not queue.full():
+                queue.put_nowait(update)
+                continue
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+            self.subscribers.discard(queue)
+
+    def close(self) -> None:
+        self.publish(None)
+
+
+class SessionRegistry:
+    """Open live sessions, least recently used first.
+
+    Sessions without readings or requests for ``idle_seconds`` are evicted
+    whenever the registry is used, ending their subscribers' streams.
+    """
+
+    def __init__(self, max_sessions: int, idle_seconds: float):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.evicted = 0
+        self._sessions: "OrderedDict[str, LiveSession]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def create(self, consider_generation: bool) -> LiveSession:
+        self.evict_idle()
+        if len(self._sessions) >= self.max_sessions:
+            raise SessionLimitError("Too many live sessions")
+        catalog = TARIFF_REGISTRY.current()
+        session = LiveSession(secrets.token_urlsafe(16), catalog.plans, consider_generation, catalog.version)
+        self._sessions[session.id] = session
+        return session
+
+    def get(self, session_id: str) -> Optional[LiveSession]:
+        self.evict_idle()
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.last_seen = time.monotonic()
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def close(self, session_id: str) -> Optional[LiveSession]:
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            session.close()
+        return session
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        now = time.monotonic() if now is None else now
+        evicted = 0
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_seen <= self.idle_seconds:
+                break
+            self.close(session.id)
+            evicted += 1
+        self.evicted += evicted
+        return evicted
+
+
+LIVE_SESSIONS = SessionRegistry(LIVE_MAX_SESSIONS, LIVE_SESSION_IDLE_SECONDS)
@@ -0,0 +1,188 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Optional, Set, Tuple, Type
+
+from app.configs.settings import (
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_RETRIES,
+    LLM_MODEL,
+    LLM_RETRY_BACKOFF,
+    LLM_TIMEOUT,
+)
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+
+@lru_cache(maxsize=1)
+def retryable_errors() -> Tuple[Type[BaseException], ...]:
+    """OpenAI errors worth retrying; the SDK is imported on first use."""
+    import openai
+
+    return (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+
+def default_openai_client() -> "AsyncOpenAI":
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+
+
+class LLMBusyError(Exception):
+    """Raised when no completion slot frees up within the timeout."""
+
+
+class SharedCompletion:
+    """One upstream streaming completion that any number of callers can follow."""
+
+    def __init__(self) -> None:
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Condition()
+
+    async def publish(self, chunk: Optional[str] = None, error: Optional[BaseException] = None) -> None:
+        async with self.changed:
+            if chunk is not None:
+                self.chunks.append(chunk)
+            else:
+                self.done = True
+                self.error = error
+            self.changed.notify_all()
+
+    async def follow(self) -> AsyncIterator[str]:
+        """Yield every chunk from the start, then new ones as they arrive."""
+        index = 0
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: index < len(self.chunks) or self.done)
+                pending = self.chunks[index:]
+                finished, error = self.done, self.error
+            for chunk in pending:
+                yield chunk
+            index += len(pending)
+            if finished and index == len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+class LLMClient:
+    """Chat completion client with coalescing, a concurrency cap and retries.
+
+    Concurrent requests with identical messages share one upstream streaming
+    completion. At most ``max_concurrency`` completions run at once; callers
+    wait up to ``timeout`` for a slot. Connection errors, rate limits and
+    server errors are retried with exponential backoff as long as no token
+    has been forwarded yet.
+
+    Without ``client`` the OpenAI SDK is only imported, and the API key only
+    required, when the first completion is requested.
+    """
+
+    def __init__(
+        self,
+        client: Optional["AsyncOpenAI"],
+        model: str,
+        max_concurrency: int,
+        timeout: float,
+        max_retries: int,
+        backoff: float,
+    ):
+        self._client = client
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.upstream_calls = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._inflight: Dict[str, SharedCompletion] = {}
+        self._tasks: Set["asyncio.Task[None]"] = set()
+
+    @property
+    def client(self) -> "AsyncOpenAI":
+        if self._client is None:
+            self._client = default_openai_client()
+        return self._client
+
+    def _bind_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._inflight = {}
+
+    async def stream(self, messages: List[Dict[str, Any]]) -> AsyncIterator[str]:
+        """Yield completion text as it arrives, sharing identical in-flight calls."""
+        self._bind_loop()
+        key = hashlib.sha256(
+            json.dumps([self.model, messages], sort_keys=True).encode()
+        ).hexdigest()
+        shared = self._inflight.get(key)
+        if shared is None:
+            shared = self._inflight[key] = SharedCompletion()
+            task = asyncio.create_task(self._produce(key, shared, messages))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        async for chunk in shared.follow():
+            yield chunk
+
+    async def complete(self, messages: List[Dict[str, Any]]) -> str:
+        """Return the full completion text."""
+        return "".join([chunk async for chunk in self.stream(messages)])
+
+    async def _produce(self, key: str, shared: SharedCompletion, messages: List[Dict[str, Any]]) -> None:
+        try:
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                raise LLMBusyError("Too many explanations in progress")
+            try:
+                await self._stream_with_retries(shared, messages)
+            finally:
+                self._slots.release()
+        except BaseException as e:
+            await shared.publish(error=e)
+            if not isinstance(e, Exception):
+                raise
+        else:
+            await shared.publish()
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _stream_with_retries(self, shared: SharedCompletion, messages: List[Dict[str, Any]]) -> None:
+        attempt = 0
+        while True:
+            try:
+                self.upstream_calls += 1
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    stream=True,
+                    timeout=self.timeout,
+                )
+                async for event in response:
+                    if event.choices and event.choices[0].delta.content:
+                        await shared.publish(event.choices[0].delta.content)
+                return
+            except retryable_errors():
+                if shared.chunks or attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(self.backoff * (2 ** attempt) * (1 + random.random()))
+                attempt += 1
+
+
+LLM_CLIENT = LLMClient(
+    None,
+    LLM_MODEL,
+    LLM_MAX_CONCURRENCY,
+    LLM_TIMEOUT,
+    LLM_MAX_RETRIES,
+    LLM_RETRY_BACKOFF,
+)
@@ -0,0 +1,177 @@
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from app.configs.tariffs import CompiledPlan
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+def component_layout(plans: List[CompiledPlan]) -> Tuple[List[int], List[str], List[str]]:
+    """Return (offsets, keys, descriptions) numbering the components of every plan.
+
+    Component cid of plan p has index offsets[p] + cid; offsets[-1] is the total.
+    """
+    offsets = [0]
+    keys: List[str] = []
+    descriptions: List[str] = []
+    for plan in plans:
+        keys.extend(plan.keys)
+        descriptions.extend(plan.descriptions)
+        offsets.append(len(keys))
+    return offsets, keys, descriptions
+
+
+class MetricsTable:
+    """Monthly metrics of every plan as arrays indexed by month, plan and component.
+
+    usage and cost have one row per month and one column per component;
+    plan_usage and plan_cost hold each plan's monthly totals, base fee
+    included in the cost. to_metrics builds the public nested dict shape,
+    which is only needed at the response boundary.
+    """
+
+    __slots__ = ("plans", "offsets", "keys", "descriptions", "months", "usage", "cost", "plan_usage", "plan_cost")
+
+    def __init__(
+        self,
+        plans: List[str],
+        offsets: List[int],
+        keys: List[str],
+        descriptions: List[str],
+        months: List[str],
+        usage: "np.ndarray",
+        cost: "np.ndarray",
+        plan_usage: "np.ndarray",
+        plan_cost: "np.ndarray",
+    ):
+        self.plans = plans
+        self.offsets = offsets
+        self.keys = keys
+        self.descriptions = descriptions
+        self.months = months
+        self.usage = usage
+        self.cost = cost
+        self.plan_usage = plan_usage
+        self.plan_cost = plan_cost
+
+    @classmethod
+    def empty(cls, plans: List[CompiledPlan]) -> "MetricsTable":
+        import numpy as np
+
+        offsets, keys, descriptions = component_layout(plans)
+        return cls(
+            [p.name for p in plans],
+            offsets,
+            keys,
+            descriptions,
+            [],
+            np.zeros((0, len(keys))),
+            np.zeros((0, len(keys))),
+            np.zeros((0, len(plans))),
+            np.zeros((0, len(plans))),
+        )
+
+    @classmethod
+    def from_metrics(cls, metrics: Dict[str, Any], months: Optional[List[str]] = None) -> "MetricsTable":
+        """Build a table from the public metrics shape, numbering components by first appearance."""
+        import numpy as np
+
+        plans = list(metrics)
+        if months is None:
+            months = list(next(iter(metrics.values()))["months"]) if metrics else []
+        offsets = [0]
+        keys: List[str] = []
+        descriptions: List[str] = []
+        index: Dict[Tuple[int, str], int] = {}
+        for p, name in enumerate(plans):
+            for values in metrics[name]["months"].values():
+                for key, entry in values["breakdown"].items():
+                    if (p, key) not in index:
+                        index[p, key] = len(keys)
+                        keys.append(key)
+                        descriptions.append(entry.get("description"))
+            offsets.append(len(keys))
+
+        usage = np.zeros((len(months), len(keys)))
+        cost = np.zeros((len(months), len(keys)))
+        plan_usage = np.zeros((len(months), len(plans)))
+        plan_cost = np.zeros((len(months), len(plans)))
+        for p, name in enumerate(plans):
+            plan_months = metrics[name]["months"]
+            for m, month in enumerate(months):
+                values = plan_months[month]
+                plan_usage[m, p] = values["usage"]
+                plan_cost[m, p] = values["cost"]
+                for key, entry in values["breakdown"].items():
+                    usage[m, index[p, key]] = entry["usage"]
+                    cost[m, index[p, key]] = entry["cost"]
+        return cls(plans, offsets, keys, descriptions, list(months), usage, cost, plan_usage, plan_cost)
+
+    def totals(self) -> List[float]:
+        """Total cost per plan, summed month by month."""
+        totals = [0.0] * len(self.plans)
+        for row in self.plan_cost.tolist():
+            for p, value in enumerate(row):
+                totals[p] += value
+        return totals
+
+    def select(self, start: int, stop: int) -> "MetricsTable":
+        """A table with months start to stop only."""
+        rows = slice(start, stop)
+        return MetricsTable(
+            self.plans,
+            self.offsets,
+            self.keys,
+            self.descriptions,
+            self.months[rows],
+            self.usage[rows],
+            self.cost[rows],
+            self.plan_usage[rows],
+            self.plan_cost[rows],
+        )
+
+    def average(self) -> "MetricsTable":
+        """Average months sharing a calendar month across years, keyed "MM" in first seen order."""
+        import numpy as np
+
+        groups: Dict[str, int] = {}
+        group_ids = [groups.setdefault(month[5:], len(groups)) for month in self.months]
+        counts = np.bincount(group_ids, minlength=len(groups)).astype(float)[:, None]
+        arrays = []
+        for values in (self.usage, self.cost, self.plan_usage, self.plan_cost):
+            summed = np.zeros((len(groups), values.shape[1]))
+            # accumulates rows in month order, like summing the dicts year by year
+            np.add.at(summed, group_ids, values)
+            arrays.append(summed / counts if len(groups) else summed)
+        return MetricsTable(self.plans, self.offsets, self.keys, self.descriptions, list(groups), *arrays)
+
+    def to_metrics(self) -> Dict[str, Any]:
+        """The public metrics shape: plan -> months -> cost, usage and breakdown."""
+        usage = self.usage.tolist()
+        cost = self.cost.tolist()
+        plan_usage = self.plan_usage.tolist()
+        plan_cost = self.plan_cost.tolist()
+        metrics: Dict[str, Any] = {}
+        for p, name in enumerate(self.plans):
+            components = range(self.offsets[p], self.offsets[p + 1])
+            months: Dict[str, Any] = {}
+            total = 0.0
+            for m, month in enumerate(self.months):
+                row_usage = usage[m]
+                row_cost = cost[m]
+                months[month] = {
+                    "cost": plan_cost[m][p],
+                    "usage": plan_usage[m][p],
+                    "breakdown": {
+                        self.keys[c]: {
+                            "usage": row_usage[c],
+                            "cost": row_cost[c],
+                            "description": self.descriptions[c],
+                        }
+                        for c in components
+                        if row_usage[c] > 0
+                    },
+                }
+                total += plan_cost[m][p]
+            metrics[name] = {"months": months, "total_cost": total}
+        return metrics
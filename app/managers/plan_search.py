@@ -0,0 +1,196 @@
+from array import array
+from itertools import chain, groupby, repeat
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.configs.settings import METRICS_ENGINE
+from app.configs.tariffs import CompiledPlan, TARIFF_REGISTRY
+from app.managers.tariff_manager import MetricsAccumulator, catalog_version
+from app.managers.upload_stream import SavedUpload
+from app.managers.usage_parser import iter_hourly_batches
+from app.managers.worker_pool import WORKER_POOL
+
+Pricer = Callable[[List[CompiledPlan]], Tuple[Dict[str, Any], List[str]]]
+
+
+def pricing_signature(plan: CompiledPlan) -> Tuple:
+    """Everything except the base fee that determines what a plan charges."""
+    return tuple(
+        tuple((threshold, rate, plan.keys[cid]) for threshold, rate, cid in tiers)
+        for tiers in plan.hours
+    )
+
+
+def dedupe_plans(plans: List[CompiledPlan]) -> List[List[CompiledPlan]]:
+    """Group plans with identical hourly configs, keeping catalog order."""
+    groups: Dict[Tuple, List[CompiledPlan]] = {}
+    for plan in plans:
+        groups.setdefault(pricing_signature(plan), []).append(plan)
+    return list(groups.values())
+
+
+def energy_lower_bound(plan: CompiledPlan, hourly_usage: List[float]) -> float:
+    """Cheapest possible energy cost: every kWh billed at the lowest rate of its hour."""
+    bound = 0.0
+    for tiers, kwh in zip(plan.hours, hourly_usage):
+        if tiers and kwh > 0:
+            bound += kwh * min(rate for _, rate, _ in tiers)
+    return bound
+
+
+def load_usage(file_obj, consider_generation: bool, engine: str) -> Tuple[Pricer, List[float], int]:
+    """Parse an upload once, returning a pricing function, kWh per hour of day and the month count."""
+    if engine == "numpy":
+        import numpy as np
+
+        from app.managers.vectorized_engine import load_columns, metrics_from_columns
+
+        columns = load_columns(file_obj, consider_generation)
+        hourly = np.bincount(
+            columns.hours, weights=np.maximum(columns.consumption, 0.0), minlength=24
+        ).tolist()
+        return (lambda plans: metrics_from_columns(columns, plans)), hourly, len(columns.months)
+    if engine != "python":
+        raise ValueError(f"Unknown metrics engine {engine}")
+
+    # one entry per hour of usage, with the months kept as runs
+    month_runs: List[Tuple[str, int]] = []
+    hours = array("b")
+    consumption = array("d")
+    hourly = [0.0] * 24
+    for batch in iter_hourly_batches(file_obj, consider_generation):
+        for hour, cons in zip(batch.hours, batch.consumption):
+            if cons > 0:
+                hourly[hour] += cons
+        for month, run in groupby(batch.months):
+            size = sum(1 for _ in run)
+            if month_runs and month_runs[-1][0] == month:
+                size += month_runs.pop()[1]
+            month_runs.append((month, size))
+        hours.extend(batch.hours)
+        consumption.extend(batch.consumption)
+    months = len({month for month, _ in month_runs})
+
+    def price(plans: List[CompiledPlan]) -> Tuple[Dict[str, Any], List[str]]:
+        accumulator = MetricsAccumulator(plans)
+        row_months = chain.from_iterable(repeat(month, size) for month, size in month_runs)
+        accumulator.add_rows(zip(row_months, hours, consumption))
+        return accumulator.finish()
+
+    return price, hourly, months
+
+
+def member_metrics(data: Dict[str, Any], fee_delta: float) -> Dict[str, Any]:
+    """Metrics of a plan sharing the hourly configs of `data` with a different base fee."""
+    if not fee_delta:
+        return data
+    months = {month: dict(values, cost=values["cost"] + fee_delta) for month, values in data["months"].items()}
+    return {"months": months, "total_cost": data["total_cost"] + fee_delta * len(months)}
+
+
+def top_k_plans(
+    file_obj,
+    consider_generation: bool,
+    k: int,
+    engine: Optional[str] = None,
+    compiled_plans: Optional[List[CompiledPlan]] = None,
+    include_metrics: bool = False,
+) -> Dict[str, Any]:
+    """Return the k cheapest plans for the whole period without plan switching.
+
+    Plans with identical hourly configs are priced once. Order independent
+    plans are priced exactly from hour-of-day sums; sequential plans are
+    priced in bound order and skipped once their lower bound exceeds the
+    k-th best exact cost. With include_metrics every plan is priced and the
+    full metrics are returned as well.
+    """
+    compiled_plans = TARIFF_REGISTRY.current().plans if compiled_plans is None else compiled_plans
+    if k < 1:
+        raise ValueError("k must be at least 1")
+    price, hourly, n_months = load_usage(file_obj, consider_generation, engine or METRICS_ENGINE)
+    groups = dedupe_plans(compiled_plans)
+    order = {plan.name: i for i, plan in enumerate(compiled_plans)}
+
+    priced: Dict[int, Dict[str, Any]] = {}
+
+    def price_groups(indices: List[int]) -> None:
+        metrics, _ = price([groups[i][0] for i in indices])
+        for i in indices:
+            priced[i] = metrics[groups[i][0].name]
+
+    if include_metrics:
+        price_groups(list(range(len(groups))))
+    else:
+        price_groups([i for i, group in enumerate(groups) if group[0].pricing != "sequential"])
+        bounds = sorted(
+            (energy_lower_bound(group[0], hourly) + min(p.base_fee for p in group) * n_months, i)
+            for i, group in enumerate(groups)
+            if i not in priced
+        )
+        while bounds:
+            costs = sorted(
+                priced[i]["total_cost"] + (plan.base_fee - groups[i][0].base_fee) * n_months
+                for i in priced
+                for plan in groups[i]
+            )
+            kth = costs[k - 1] if len(costs) >= k else float("inf")
+            # small tolerance so float rounding never prunes a tied plan
+            cutoff = kth + 1e-9 * max(1.0, abs(kth))
+            bounds = [(bound, i) for bound, i in bounds if bound <= cutoff]
+            if not bounds:
+                break
+            price_groups([i for _, i in bounds[:k]])
+            bounds = bounds[k:]
+
+    metrics: Dict[str, Any] = {}
+    for i, data in priced.items():
+        rep = groups[i][0]
+        for plan in groups[i]:
+            metrics[plan.name] = member_metrics(data, plan.base_fee - rep.base_fee)
+    ranked = sorted(metrics, key=lambda name: (metrics[name]["total_cost"], order[name]))[:k]
+
+    result: Dict[str, Any] = {
+        "plan": ranked[0] if ranked else None,
+        "cost": metrics[ranked[0]]["total_cost"] if ranked else None,
+        "top": [{"plan": name, "cost": metrics[name]["total_cost"]} for name in ranked],
+        "stats": {
+            "plans": len(compiled_plans),
+            "unique": len(groups),
+            "priced": len(priced),
+        },
+    }
+    if include_metrics:
+        result["metrics"] = {p.name: metrics[p.name] for p in compiled_plans}
+    return result
+
+
+def top_k_from_file(
+    path: str,
+    consider_generation: bool,
+    k: int,
+    engine: Optional[str] = None,
+    include_metrics: bool = False,
+    version: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Picklable entry point for top_k_plans on an upload saved to a file."""
+    catalog = catalog_version(version)
+    with open(path, "rb") as f:
+        return top_k_plans(f, consider_generation, k, engine, catalog.plans, include_metrics)
+
+
+async def top_k_plans_async(
+    upload: SavedUpload,
+    consider_generation: bool,
+    k: int,
+    engine: Optional[str] = None,
+    include_metrics: bool = False,
+) -> Dict[str, Any]:
+    """Run top_k_plans in the worker pool."""
+    return await WORKER_POOL.run(
+        top_k_from_file,
+        upload.path,
+        consider_generation,
+        k,
+        engine,
+        include_metrics,
+        TARIFF_REGISTRY.current().version,
+    )
@@ -0,0 +1,145 @@
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# most drivers listed per plan and decision before the budget trims them
+MAX_DRIVERS = 3
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for English and JSON text (about 4 characters per token)."""
+    return (len(text) + 3) // 4
+
+
+def prompt_size(messages: List[Dict[str, str]]) -> Dict[str, int]:
+    """Return the size of chat messages in characters, bytes and estimated tokens."""
+    text = "".join(m["content"] for m in messages)
+    return {
+        "chars": len(text),
+        "bytes": len(text.encode()),
+        "tokens": estimate_tokens(text),
+    }
+
+
+def _round(value: float) -> float:
+    return round(value, 2)
+
+
+class _Legend:
+    """Assigns short ids to breakdown descriptions so each is sent once."""
+
+    def __init__(self) -> None:
+        self.ids: Dict[str, str] = {}
+
+    def ref(self, description: Optional[str]) -> str:
+        description = description or ""
+        if description not in self.ids:
+            self.ids[description] = f"c{len(self.ids)}"
+        return self.ids[description]
+
+    def as_dict(self) -> Dict[str, str]:
+        return {ref: description for description, ref in self.ids.items()}
+
+
+def _totals(months: List[Dict[str, Any]]) -> Tuple[float, float, Dict[str, Dict[str, Any]]]:
+    cost = sum(m["cost"] for m in months)
+    usage = sum(m["usage"] for m in months)
+    breakdown: Dict[str, Dict[str, Any]] = {}
+    for m in months:
+        for key, entry in m["breakdown"].items():
+            total = breakdown.setdefault(
+                key, {"usage": 0.0, "cost": 0.0, "description": entry.get("description")}
+            )
+            total["usage"] += entry["usage"]
+            total["cost"] += entry["cost"]
+    return cost, usage, breakdown
+
+
+def _plan_entry(
+    plan: str, cost: float, breakdown: Dict[str, Dict[str, Any]], drivers: int, legend: _Legend
+) -> Dict[str, Any]:
+    components = sorted(breakdown.values(), key=lambda e: e["cost"], reverse=True)
+    entry: Dict[str, Any] = {
+        "plan": plan,
+        "cost": _round(cost),
+        "fees": _round(cost - sum(e["cost"] for e in components)),
+    }
+    if drivers:
+        entry["drivers"] = [
+            [legend.ref(e["description"]), _round(e["usage"]), _round(e["cost"])]
+            for e in components[:drivers]
+        ]
+    return entry
+
+
+def _decision(
+    metrics: Dict[str, Any], months: Optional[List[str]], drivers: int, legend: _Legend, runner_up: bool = True
+) -> Dict[str, Any]:
+    """Compare the cheapest plan with the runner-up over the given months (all when None)."""
+    totals = []
+    for plan, data in metrics.items():
+        selected = [data["months"][m] for m in (months if months is not None else data["months"])]
+        cost, _, breakdown = _totals(selected)
+        totals.append((cost, plan, breakdown))
+    totals.sort(key=lambda t: t[0])
+    best = _plan_entry(totals[0][1], totals[0][0], totals[0][2], drivers, legend)
+    decision: Dict[str, Any] = {"best": best}
+    if len(totals) > 1:
+        if runner_up:
+            decision["runnerUp"] = _plan_entry(totals[1][1], totals[1][0], totals[1][2], drivers, legend)
+        else:
+            decision["runnerUp"] = {"plan": totals[1][1]}
+        decision["delta"] = _round(totals[1][0] - totals[0][0])
+    return decision
+
+
+def _compact(analysis: Dict[str, Any], drivers: int, runner_up: bool = True) -> Dict[str, Any]:
+    metrics = analysis.get("metrics", {})
+    legend = _Legend()
+    compact: Dict[str, Any] = {"unit": "cents, kWh", "driverFields": ["component", "usage", "cost"]}
+    if not metrics:
+        return compact
+    if "months" in analysis:
+        compact["months"] = {
+            month: _decision(metrics, [month], drivers, legend, runner_up) for month in analysis["months"]
+        }
+    else:
+        compact["overall"] = _decision(metrics, None, drivers, legend, runner_up)
+    if legend.ids:
+        compact["legend"] = legend.as_dict()
+    return compact
+
+
+def compact_analysis(analysis: Dict[str, Any], token_budget: int = 0) -> Dict[str, Any]:
+    """Summarize a recommendation for the LLM within an approximate token budget.
+
+    Only the winning plan and the runner-up of each decision are kept, with
+    the cost delta between them and the breakdown components that cost the
+    most. Component descriptions are sent once in a legend. To fit the
+    budget, drivers are trimmed first, then the runner-up is cut down to its
+    name, then the last months are left out and listed in "omittedMonths".
+    A summary that still does not fit is returned with a warning.
+    """
+    for drivers in range(MAX_DRIVERS, -1, -1):
+        compact = _compact(analysis, drivers)
+        if _fits(compact, token_budget):
+            return compact
+    compact = _compact(analysis, 0, runner_up=False)
+    months = compact.get("months", {})
+    omitted: List[str] = []
+    while not _fits(compact, token_budget) and months:
+        omitted.insert(0, months.popitem()[0])
+        compact["omittedMonths"] = omitted
+    if not _fits(compact, token_budget):
+        logger.warning(
+            "Explain summary of %d tokens exceeds the budget of %d tokens",
+            estimate_tokens(json.dumps(compact, separators=(",", ":"))),
+            token_budget,
+        )
+    return compact
+
+
+def _fits(compact: Dict[str, Any], token_budget: int) -> bool:
+    return not token_budget or estimate_tokens(json.dumps(compact, separators=(",", ":"))) <= token_budget
@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.configs.settings import (
+    METRICS_CACHE_DIR,
+    METRICS_CACHE_DISK_MAX_BYTES,
+    METRICS_CACHE_MAX_BYTES,
+)
+
+logger = logging.getLogger(__name__)
+
+# version of the cached values; bump it when MetricsTable or how uploads are
+# charged changes, so entries written by an older release are not read back
+CACHE_FORMAT = 1
+
+
+def metrics_cache_key(data: bytes, consider_generation: bool, fingerprint: str) -> str:
+    """Key an upload by its content, the generation flag and the tariff catalog."""
+    return digest_cache_key(hashlib.sha256(data).hexdigest(), consider_generation, fingerprint)
+
+
+def digest_cache_key(digest: str, consider_generation: bool, fingerprint: str) -> str:
+    """metrics_cache_key for an upload whose sha256 hex digest was computed while it streamed."""
+    return f"v{CACHE_FORMAT}-{digest}-{int(consider_generation)}-{fingerprint}"
+
+
+class MetricsCache:
+    """Two tier cache for computed metrics tables.
+
+    Values are stored pickled, so every hit returns a private copy and the
+    memory tier can evict least recently used entries by size. The optional
+    disk tier lets several server processes on one host share results; the
+    async methods do its file I/O in a thread. The directory is only listed
+    at start and when the bytes written since push it over its cap, and an
+    entry that fails to unpickle is deleted and counts as a miss.
+    """
+
+    def __init__(self, max_bytes: int, directory: str = "", disk_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self.size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        # bytes in the disk tier, as of the last listing plus what this process wrote since
+        self.disk_size = 0
+        self._disk_lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._evict_disk()
+
+    def get(self, key: str) -> Optional[Any]:
+        blob = self._entries.get(key)
+        if blob is not None:
+            return self._memory_hit(key, blob)
+        return self._disk_result(key, self._read_disk(key))
+
+    async def get_async(self, key: str) -> Optional[Any]:
+        """get, reading the disk tier in a thread."""
+        blob = self._entries.get(key)
+        if blob is not None:
+            return self._memory_hit(key, blob)
+        if not self.directory:
+            return self._disk_result(key, None)
+        return self._disk_result(key, await asyncio.to_thread(self._read_disk, key))
+
+    def put(self, key: str, value: Any) -> None:
+        blob = self._pickle(key, value)
+        if blob is not None:
+            self._write_disk(key, blob)
+
+    async def put_async(self, key: str, value: Any) -> None:
+        """put, writing the disk tier in a thread."""
+        blob = self._pickle(key, value)
+        if blob is not None and self.directory:
+            await asyncio.to_thread(self._write_disk, key, blob)
+
+    def _pickle(self, key: str, value: Any) -> Optional[bytes]:
+        """Pickle a value and keep it in the memory tier, None when caching is off."""
+        if not self.max_bytes and not self.directory:
+            return None
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._store(key, blob)
+        return blob
+
+    def _memory_hit(self, key: str, blob: bytes) -> Any:
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return pickle.loads(blob)
+
+    def _disk_result(self, key: str, entry: Optional[Tuple[bytes, Any]]) -> Optional[Any]:
+        if entry is None:
+            self.misses += 1
+            return None
+        blob, value = entry
+        self.disk_hits += 1
+        self._store(key, blob)
+        return value
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+        }
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0
+
+    def _store(self, key: str, blob: bytes) -> None:
+        if len(blob) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous)
+        self._entries[key] = blob
+        self.size += len(blob)
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pickle")
+
+    def _read_disk(self, key: str) -> Optional[Tuple[bytes, Any]]:
+        """Return (blob, value) of a disk entry, deleting entries that do not unpickle."""
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                blob = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            return blob, pickle.loads(blob)
+        except Exception as e:  # truncated or corrupt file, or classes that no longer exist
+            logger.warning("Dropping unreadable metrics cache entry %s: %s", path, e)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return None
+
+    def _write_disk(self, key: str, blob: bytes) -> None:
+        if not self.directory or len(blob) > self.disk_max_bytes:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(blob)
+        # atomic so concurrent readers never see a partial entry
+        os.replace(tmp_path, self._path(key))
+        with self._disk_lock:
+            self.disk_size += len(blob)
+            over = self.disk_size > self.disk_max_bytes
+        if over:
+            self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        """List the directory, deleting the oldest entries until it fits disk_max_bytes."""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".pickle"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        for _, size, path in sorted(entries):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        with self._disk_lock:
+            self.disk_size = total
+
+
+METRICS_CACHE = MetricsCache(METRICS_CACHE_MAX_BYTES, METRICS_CACHE_DIR, METRICS_CACHE_DISK_MAX_BYTES)
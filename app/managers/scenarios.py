@@ -0,0 +1,261 @@
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from app.configs.tariffs import CompiledPlan, TARIFF_REGISTRY
+from app.managers.instrumentation import count, stage
+from app.managers.metrics_table import MetricsTable
+from app.managers.tariff_manager import catalog_version, recommend_from_table, shape_result
+from app.managers.upload_stream import SavedUpload
+from app.managers.usage_parser import iter_hourly_batches
+from app.managers.worker_pool import WORKER_POOL
+
+if TYPE_CHECKING:
+    import numpy as np
+
+TRANSFORM_TYPES = ("scale", "shift", "generation", "add")
+MAX_SCENARIOS = 32
+
+
+def _hour_window(transform: Dict[str, Any], start_key: str, end_key: str, label: str) -> Tuple[int, int]:
+    start = transform.get(start_key, 0)
+    end = transform.get(end_key, 24)
+    for hour in (start, end):
+        if not isinstance(hour, int) or isinstance(hour, bool) or not 0 <= hour <= 24:
+            raise ValueError(f"{label}: hours must be integers between 0 and 24")
+    if start >= end:
+        raise ValueError(f"{label}: {start_key} must be before {end_key}")
+    return start, end
+
+
+def _number(transform: Dict[str, Any], key: str, label: str, minimum: Optional[float] = None) -> float:
+    value = transform.get(key)
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        raise ValueError(f"{label}: {key} must be a number")
+    if minimum is not None and value < minimum:
+        raise ValueError(f"{label}: {key} must be at least {minimum}")
+    return float(value)
+
+
+def validate_scenarios(scenarios: Any) -> List[Dict[str, Any]]:
+    """Check the structure of a scenario list, raising ValueError on the first problem.
+
+    Every scenario has a name and a list of transforms applied in order:
+
+    - ``{"type": "scale", "factor": 1.1, "startHour": 17, "endHour": 21}`` scales consumption
+    - ``{"type": "shift", "fraction": 0.2, "fromStartHour": 17, "fromEndHour": 21,
+      "toStartHour": 0, "toEndHour": 6}`` moves a share of each day's consumption
+      between hour windows, spread evenly over the target hours
+    - ``{"type": "generation", "factor": 2}`` scales generation
+    - ``{"type": "add", "kwh": 0.5, "target": "consumption"}`` adds a flat amount to
+      every hour, of consumption or generation
+
+    Hour windows default to the whole day.
+    """
+    if not isinstance(scenarios, list) or not scenarios:
+        raise ValueError("Scenarios must be a non-empty list")
+    if len(scenarios) > MAX_SCENARIOS:
+        raise ValueError(f"At most {MAX_SCENARIOS} scenarios are allowed")
+    names = {"baseline"}
+    for scenario in scenarios:
+        if not isinstance(scenario, dict) or not isinstance(scenario.get("name"), str):
+            raise ValueError("Every scenario needs a name")
+        name = scenario["name"]
+        if name in names:
+            raise ValueError(f"Duplicate scenario {name}")
+        names.add(name)
+        transforms = scenario.get("transforms", [])
+        if not isinstance(transforms, list):
+            raise ValueError(f"Scenario {name}: transforms must be a list")
+        for transform in transforms:
+            label = f"Scenario {name}"
+            if not isinstance(transform, dict) or transform.get("type") not in TRANSFORM_TYPES:
+                raise ValueError(f"{label}: transform type must be one of {', '.join(TRANSFORM_TYPES)}")
+            kind = transform["type"]
+            if kind in ("scale", "generation"):
+                _number(transform, "factor", label, 0)
+                _hour_window(transform, "startHour", "endHour", label)
+            elif kind == "shift":
+                if not 0 <= _number(transform, "fraction", label, 0) <= 1:
+                    raise ValueError(f"{label}: fraction must be between 0 and 1")
+                _hour_window(transform, "fromStartHour", "fromEndHour", label)
+                _hour_window(transform, "toStartHour", "toEndHour", label)
+            else:
+                _number(transform, "kwh", label)
+                if transform.get("target", "consumption") not in ("consumption", "generation"):
+                    raise ValueError(f"{label}: target must be consumption or generation")
+                _hour_window(transform, "startHour", "endHour", label)
+    return scenarios
+
+
+class DailyUsage:
+    """Hourly consumption and generation on a (days, 24) grid, with the month of each day.
+
+    net is consumption less generation netted per reading, as /recommend
+    charges it.
+    """
+
+    __slots__ = ("months", "day_months", "consumption", "generation", "net")
+
+    def __init__(
+        self,
+        months: List[str],
+        day_months: "np.ndarray",
+        consumption: "np.ndarray",
+        generation: "np.ndarray",
+        net: "np.ndarray",
+    ):
+        self.months = months
+        self.day_months = day_months
+        self.consumption = consumption
+        self.generation = generation
+        self.net = net
+
+
+def load_daily_usage(file_obj) -> DailyUsage:
+    """Parse an upload once into per day and hour consumption and generation totals."""
+    import numpy as np
+
+    days: Dict[str, int] = {}
+    months: List[str] = []
+    day_months: List[int] = []
+    cells: List[int] = []
+    consumption: List[float] = []
+    generation: List[float] = []
+    net: List[float] = []
+    for batch in iter_hourly_batches(file_obj, True, keep_gross=True):
+        for ts, month, hour in zip(batch.timestamps, batch.months, batch.hours):
+            day = days.get(ts[:10])
+            if day is None:
+                day = days[ts[:10]] = len(days)
+                if not months or months[-1] != month:
+                    months.append(month)
+                day_months.append(len(months) - 1)
+            cells.append(day * 24 + hour)
+        consumption.extend(batch.gross)
+        generation.extend(batch.generation)
+        net.extend(batch.consumption)
+    grids = [
+        np.bincount(cells, weights=values, minlength=len(days) * 24).reshape(-1, 24)
+        for values in (consumption, generation, net)
+    ]
+    return DailyUsage(months, np.asarray(day_months, dtype=np.int64), *grids)
+
+
+def apply_transforms(
+    consumption: "np.ndarray", generation: "np.ndarray", transforms: List[Dict[str, Any]]
+) -> Tuple["np.ndarray", "np.ndarray"]:
+    """Return consumption and generation grids with a scenario's transforms applied."""
+    consumption = consumption.copy()
+    generation = generation.copy()
+    for transform in transforms:
+        kind = transform["type"]
+        if kind == "shift":
+            source = slice(transform.get("fromStartHour", 0), transform.get("fromEndHour", 24))
+            target = slice(transform.get("toStartHour", 0), transform.get("toEndHour", 24))
+            moved = consumption[:, source] * transform["fraction"]
+            consumption[:, source] -= moved
+            target_hours = target.stop - target.start
+            consumption[:, target] += moved.sum(axis=1, keepdims=True) / target_hours
+            continue
+        window = slice(transform.get("startHour", 0), transform.get("endHour", 24))
+        if kind == "scale":
+            consumption[:, window] *= transform["factor"]
+        elif kind == "generation":
+            generation[:, window] *= transform["factor"]
+        elif transform.get("target", "consumption") == "generation":
+            generation[:, window] += transform["kwh"]
+        else:
+            consumption[:, window] += transform["kwh"]
+    return consumption, generation
+
+
+def scenario_metrics(
+    file_obj,
+    scenarios: List[Dict[str, Any]],
+    consider_generation: bool,
+    compiled_plans: Optional[List[CompiledPlan]] = None,
+) -> Dict[str, MetricsTable]:
+    """Metrics tables for the unchanged usage and each scenario, from one read of the file.
+
+    Transforms work on hourly totals, so a scenario that has any nets
+    consumption and generation per hour rather than per reading. The
+    "baseline" entry, and any scenario without transforms, uses usage netted
+    per reading and costs the same as /recommend. All scenarios are priced
+    together, each scenario and month being one run of the vectorized engine.
+    """
+    import numpy as np
+
+    from app.managers.vectorized_engine import UsageColumns, table_from_columns
+
+    compiled_plans = TARIFF_REGISTRY.current().plans if compiled_plans is None else compiled_plans
+    scenarios = [{"name": "baseline", "transforms": []}] + validate_scenarios(scenarios)
+    with stage("parse"):
+        usage = load_daily_usage(file_obj)
+
+    with stage("charge"):
+        n_days = len(usage.day_months)
+        n_months = len(usage.months)
+        hours = np.tile(np.arange(24, dtype=np.int64), n_days)
+        month_runs = np.repeat(usage.day_months, 24)
+        run_ids: List["np.ndarray"] = []
+        hour_cols: List["np.ndarray"] = []
+        consumption: List["np.ndarray"] = []
+        for index, scenario in enumerate(scenarios):
+            if not scenario["transforms"]:
+                cons = usage.net if consider_generation else usage.consumption
+            else:
+                cons, gen = apply_transforms(usage.consumption, usage.generation, scenario["transforms"])
+                if consider_generation:
+                    cons = np.maximum(cons - gen, 0.0)
+            cons = cons.ravel()
+            used = cons != 0
+            run_ids.append(month_runs[used] + index * n_months)
+            hour_cols.append(hours[used])
+            consumption.append(cons[used])
+        columns = UsageColumns(
+            usage.months * len(scenarios),
+            np.concatenate(run_ids),
+            np.concatenate(hour_cols),
+            np.concatenate(consumption),
+        )
+        table = table_from_columns(columns, compiled_plans)
+
+    count("months", n_months)
+    count("plans", len(compiled_plans))
+    count("scenarios", len(scenarios))
+    return {
+        scenario["name"]: table.select(index * n_months, (index + 1) * n_months)
+        for index, scenario in enumerate(scenarios)
+    }
+
+
+def recommend_scenarios(results: Dict[str, MetricsTable], allow_switch: bool, detail: str = "full") -> Dict[str, Any]:
+    """recommend_from_table results per scenario, trimmed to `detail` as in shape_result."""
+    return {
+        name: shape_result(recommend_from_table(table, allow_switch), detail)
+        for name, table in results.items()
+    }
+
+
+def scenario_metrics_from_file(
+    path: str,
+    scenarios: List[Dict[str, Any]],
+    consider_generation: bool,
+    version: Optional[str] = None,
+) -> Dict[str, MetricsTable]:
+    """Picklable entry point for scenario_metrics on an upload saved to a file."""
+    catalog = catalog_version(version)
+    with open(path, "rb") as f:
+        return scenario_metrics(f, scenarios, consider_generation, catalog.plans)
+
+
+async def scenario_metrics_async(
+    upload: SavedUpload, scenarios: List[Dict[str, Any]], consider_generation: bool
+) -> Dict[str, MetricsTable]:
+    """Run scenario_metrics in the worker pool."""
+    return await WORKER_POOL.run(
+        scenario_metrics_from_file,
+        upload.path,
+        scenarios,
+        consider_generation,
+        TARIFF_REGISTRY.current().version,
+    )
@@ -1,30 +1,28 @@
 import csv
-import os
+import hashlib
 import json
-from openai import AsyncOpenAI
+import math
 from datetime import datetime
-from typing import Any, Dict, List, Tuple, Iterable, Optional
-from app.configs.tariffs import HourlyConfig, select_config, TARIFFS, load_tariffs
-from dotenv import load_dotenv
-
-load_dotenv()
-open_ai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-
-def describe_config(cfg: HourlyConfig) -> str:
-    """Return a human friendly description of a config."""
-    if cfg.start is None and cfg.end is None:
-        hour_desc = "All hours of the day"
-    else:
-        start = cfg.start if cfg.start is not None else 0
-        end = cfg.end if cfg.end is not None else 24
-        hour_desc = f"Hours {start}-{end}"
-
-    if cfg.threshold:
-        thr_desc = f"applied after {cfg.threshold} kWh"
-    else:
-        thr_desc = "applied from the first kWh"
-    return f"{hour_desc}, {thr_desc}"
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, List, Tuple, Iterable, Optional
+
+from app.configs.tariffs import CompiledPlan, TariffCatalog, TARIFF_REGISTRY
+from app.configs.settings import EXPLAIN_TOKEN_BUDGET, METRICS_ENGINE, USAGE_STORE_PATH
+from app.managers.instrumentation import count, stage, timed_iter
+from app.managers.metrics_table import MetricsTable, component_layout
+from app.managers.usage_parser import (
+    UsageBatch,
+    UsageDataError,
+    aggregate_hourly,
+    iter_hourly_batches,
+    iter_usage_batches,
+)
+from app.managers.usage_store import UsageStore
+from app.managers.llm_client import LLM_CLIENT
+from app.managers.prompt_summary import compact_analysis, prompt_size
+from app.managers.result_cache import METRICS_CACHE, digest_cache_key
+from app.managers.upload_stream import SavedUpload
+from app.managers.worker_pool import STREAM_RUNNER, WORKER_POOL
 
 
 def iterate_rows(file_obj: Iterable[str]) -> Iterable[Dict[str, str]]:
@@ -42,6 +40,8 @@ def prepare_consumption(row: Dict[str, str], consider_generation: bool) -> Tuple
     unit = row["unit"].lower()
     cons = float(row["consumption"])
     gen = float(row.get("generation", 0))
+    if not (math.isfinite(cons) and math.isfinite(gen)):
+        raise UsageDataError("Consumption and generation must be finite numbers")
     if consider_generation:
         cons -= gen
         if cons < 0:
@@ -50,7 +50,7 @@ def prepare_consumption(row: Dict[str, str], consider_generation: bool) -> Tuple
     if unit == "wh":
         cons /= 1000.0
     elif unit != "kwh":
-        raise ValueError(f"Unsupported unit {unit}")
+        raise UsageDataError(f"Unsupported unit {unit}")
 
     return dt, cons
 
@@ -58,114 +58,398 @@ def prepare_consumption(row: Dict[str, str], consider_generation: bool) -> Tuple
 def charge_usage(
     consumption: float,
     hour: int,
-    configs: List[HourlyConfig],
+    plan: CompiledPlan,
     usage_so_far: float,
-    detail: Dict[str, Dict[str, Any]],
+    component_usage: List[float],
+    component_cost: List[float],
+    offset: int = 0,
 ) -> Tuple[float, float]:
-    """Apply consumption to a tariff plan returning new usage and added cost."""
+    """Apply consumption to a tariff plan returning new usage and added cost.
+
+    Usage and cost are also added per component, at index offset + component id.
+    """
+    tiers = plan.hours[hour]
     remaining = consumption
     added_cost = 0.0
     while remaining > 0:
-        config = select_config(configs, hour, usage_so_far)
-        higher = [c.threshold for c in configs if c.matches_hour(hour) and c.threshold > usage_so_far]
-        next_threshold = min(higher) if higher else float("inf")
+        idx, next_threshold = plan.tier_at(hour, usage_so_far)
+        _, rate, cid = tiers[idx]
         portion = min(remaining, next_threshold - usage_so_far)
-        cost = portion * config.cost
+        cost = portion * rate
         usage_so_far += portion
         added_cost += cost
-        key = f"h{config.start}_{config.end}_t{config.threshold}"
-        entry = detail.setdefault(
-            key,
-            {"usage": 0.0, "cost": 0.0, "description": describe_config(config)},
-        )
-        entry["usage"] += portion
-        entry["cost"] += cost
+        component_usage[offset + cid] += portion
+        component_cost[offset + cid] += cost
         remaining -= portion
 
     return usage_so_far, added_cost
 
 
-def finalize_month(
-    month: str,
-    plan_names: Iterable[str],
-    base_fees: Dict[str, float],
-    metrics: Dict[str, Any],
-    month_usage: Dict[str, float],
-    month_cost: Dict[str, float],
-    month_detail: Dict[str, Dict[str, Dict[str, Any]]],
-    months_order: List[str],
-) -> None:
-    """Finalize metrics for a month and reset temp counters."""
-    for plan_name in plan_names:
-        month_cost[plan_name] += base_fees[plan_name]
-        metrics[plan_name]["months"][month] = {
-            "cost": month_cost[plan_name],
-            "usage": month_usage[plan_name],
-            "breakdown": month_detail[plan_name],
+def charge_histogram(
+    hourly_usage: List[float],
+    plan: CompiledPlan,
+    component_usage: List[float],
+    component_cost: List[float],
+    offset: int = 0,
+) -> Tuple[float, float]:
+    """Charge a month of usage summed per hour of day to an order independent plan.
+
+    Returns (usage, cost). Only valid for plans whose pricing is "hourly" or "total".
+    """
+    if plan.pricing == "total":
+        return charge_usage(sum(hourly_usage), 0, plan, 0.0, component_usage, component_cost, offset)
+
+    usage = 0.0
+    cost = 0.0
+    for hour, kwh in enumerate(hourly_usage):
+        if kwh <= 0:
+            continue
+        tiers = plan.hours[hour]
+        if not tiers:
+            raise ValueError("No tariff config applies to hour")
+        _, rate, cid = tiers[0]
+        component_usage[offset + cid] += kwh
+        component_cost[offset + cid] += kwh * rate
+        usage += kwh
+        cost += kwh * rate
+    return usage, cost
+
+
+# version of the open month state written by MetricsAccumulator.snapshot;
+# format 1 had no hourly sums because every plan was charged per reading
+SNAPSHOT_FORMAT = 2
+
+
+class MetricsAccumulator:
+    """Month by month metrics for every plan, fed with readings in file order.
+
+    Readings are summed per hour of day for the month. Plans whose cost does
+    not depend on reading order are priced from those sums when the month is
+    finalized; only "sequential" plans are charged reading by reading. The
+    open month lives in flat lists indexed by plan and component, and every
+    finalized month becomes one row of a MetricsTable.
+
+    With ``incremental`` every plan is charged reading by reading, so
+    month_cost is always up to date for the open month. So is a month
+    restored from a format 1 snapshot, which has no hourly sums to price
+    from.
+    """
+
+    def __init__(self, compiled_plans: List[CompiledPlan], incremental: bool = False):
+        self.plans = {p.name: p for p in compiled_plans}
+        self.plan_list = list(compiled_plans)
+        self.offsets, self.keys, self.descriptions = component_layout(self.plan_list)
+        self.sequential = [
+            (i, p, self.offsets[i])
+            for i, p in enumerate(self.plan_list)
+            if incremental or p.pricing == "sequential"
+        ]
+        self.by_histogram = [
+            (i, p, self.offsets[i])
+            for i, p in enumerate(self.plan_list)
+            if not incremental and p.pricing != "sequential"
+        ]
+        self.every_plan = [(i, p, self.offsets[i]) for i, p in enumerate(self.plan_list)]
+        # the open month came from a snapshot without hourly sums
+        self.charged_per_reading = False
+        self.base_fees = [p.base_fee for p in self.plan_list]
+        self.month_usage = [0.0] * len(self.plan_list)
+        self.month_cost = [0.0] * len(self.plan_list)
+        self.component_usage = [0.0] * len(self.keys)
+        self.component_cost = [0.0] * len(self.keys)
+        self.month_hist = [0.0] * 24
+        self.current_month: Optional[str] = None
+        self.months_order: List[str] = []
+        # finalized months as (component usage, component cost, plan usage, plan cost)
+        self._rows: List[Tuple[List[float], List[float], List[float], List[float]]] = []
+
+    def add_rows(self, rows: Iterable[Tuple[str, int, float]]) -> None:
+        """Charge (month, hour, consumption_kwh) readings to every plan."""
+        plans = self.every_plan if self.charged_per_reading else self.sequential
+        month_usage = self.month_usage
+        month_cost = self.month_cost
+        component_usage = self.component_usage
+        component_cost = self.component_cost
+        hist = self.month_hist
+        for month, hour, cons in rows:
+            if month != self.current_month:
+                self.finalize()
+                if month in self.months_order:
+                    raise UsageDataError(f"Usage rows are not sorted by time, {month} appears twice")
+                self.current_month = month
+                plans = self.sequential
+            if cons > 0:
+                hist[hour] += cons
+
+            for i, plan, offset in plans:
+                month_usage[i], added_cost = charge_usage(
+                    cons, hour, plan, month_usage[i], component_usage, component_cost, offset
+                )
+                month_cost[i] += added_cost
+
+    def finalize(self) -> None:
+        """Close the current month, if any."""
+        if self.current_month is not None:
+            with stage("finalize"):
+                self._finalize()
+
+    def _finalize(self) -> None:
+        for i, plan, offset in [] if self.charged_per_reading else self.by_histogram:
+            self.month_usage[i], self.month_cost[i] = charge_histogram(
+                self.month_hist, plan, self.component_usage, self.component_cost, offset
+            )
+        month_cost = [cost + fee for cost, fee in zip(self.month_cost, self.base_fees)]
+        self._rows.append((
+            list(self.component_usage),
+            list(self.component_cost),
+            list(self.month_usage),
+            month_cost,
+        ))
+        self.months_order.append(self.current_month)
+        self.month_usage[:] = [0.0] * len(self.plan_list)
+        self.month_cost[:] = [0.0] * len(self.plan_list)
+        self.component_usage[:] = [0.0] * len(self.keys)
+        self.component_cost[:] = [0.0] * len(self.keys)
+        self.month_hist[:] = [0.0] * 24
+        self.current_month = None
+        self.charged_per_reading = False
+
+    def add_table(self, table: MetricsTable) -> None:
+        """Close the open month and append months priced elsewhere, e.g. by the vectorized engine.
+
+        The table must cover this accumulator's plans, in the same order.
+        """
+        self.finalize()
+        for m, month in enumerate(table.months):
+            if month in self.months_order:
+                raise UsageDataError(f"Usage rows are not sorted by time, {month} appears twice")
+            self._rows.append((
+                table.usage[m].tolist(),
+                table.cost[m].tolist(),
+                table.plan_usage[m].tolist(),
+                table.plan_cost[m].tolist(),
+            ))
+            self.months_order.append(month)
+
+    def table(self) -> MetricsTable:
+        """The months finalized so far."""
+        import numpy as np
+
+        columns = [
+            np.array([row[i] for row in self._rows]).reshape(len(self._rows), width)
+            for i, width in enumerate((len(self.keys), len(self.keys), len(self.plan_list), len(self.plan_list)))
+        ]
+        return MetricsTable(
+            [p.name for p in self.plan_list],
+            self.offsets,
+            self.keys,
+            self.descriptions,
+            list(self.months_order),
+            *columns,
+        )
+
+    def finish_table(self) -> MetricsTable:
+        self.finalize()
+        return self.table()
+
+    def finish(self) -> Tuple[Dict[str, Any], List[str]]:
+        table = self.finish_table()
+        return table.to_metrics(), table.months
+
+    def snapshot(self) -> Optional[Dict[str, Any]]:
+        """JSON serializable state of the open month, None when no month is open."""
+        if self.current_month is None:
+            return None
+        detail: Dict[str, Dict[str, Any]] = {}
+        for i, plan in enumerate(self.plan_list):
+            detail[plan.name] = {
+                self.keys[c]: {
+                    "usage": self.component_usage[c],
+                    "cost": self.component_cost[c],
+                    "description": self.descriptions[c],
+                }
+                for c in range(self.offsets[i], self.offsets[i + 1])
+                if self.component_usage[c] > 0
+            }
+        return {
+            "format": SNAPSHOT_FORMAT,
+            "month": self.current_month,
+            "usage": {p.name: self.month_usage[i] for i, p in enumerate(self.plan_list)},
+            "cost": {p.name: self.month_cost[i] for i, p in enumerate(self.plan_list)},
+            "detail": detail,
+            "hist": self.month_hist,
         }
-        metrics[plan_name]["total_cost"] += month_cost[plan_name]
-        month_usage[plan_name] = 0.0
-        month_cost[plan_name] = 0.0
-        month_detail[plan_name] = {}
-    months_order.append(month)
+
+    def restore(self, state: Dict[str, Any]) -> None:
+        """Continue an open month saved with snapshot."""
+        self.current_month = state["month"]
+        for i, plan in enumerate(self.plan_list):
+            self.month_usage[i] = state["usage"].get(plan.name, 0.0)
+            self.month_cost[i] = state["cost"].get(plan.name, 0.0)
+            detail = state["detail"].get(plan.name, {})
+            for cid, key in enumerate(plan.keys):
+                if key in detail:
+                    self.component_usage[self.offsets[i] + cid] = detail[key]["usage"]
+                    self.component_cost[self.offsets[i] + cid] = detail[key]["cost"]
+        if state.get("format", 1) < 2:
+            # usage and cost cover every plan, so keep charging them per reading
+            self.charged_per_reading = True
+            self.month_hist[:] = [0.0] * 24
+        else:
+            self.month_hist[:] = state["hist"]
+
+
+def calculate_usage_table(
+    file_obj,
+    consider_generation: bool,
+    engine: Optional[str] = None,
+    compiled_plans: Optional[List[CompiledPlan]] = None,
+) -> MetricsTable:
+    """Return raw monthly metrics for each plan as a MetricsTable."""
+    compiled_plans = TARIFF_REGISTRY.current().plans if compiled_plans is None else compiled_plans
+    engine = engine or METRICS_ENGINE
+    if engine == "numpy":
+        from app.managers.vectorized_engine import calculate_usage_table_vectorized
+
+        return calculate_usage_table_vectorized(file_obj, consider_generation, compiled_plans)
+    if engine != "python":
+        raise ValueError(f"Unknown metrics engine {engine}")
+
+    accumulator = MetricsAccumulator(compiled_plans)
+    for batch in timed_iter(iter_hourly_batches(file_obj, consider_generation), "parse"):
+        with stage("charge"):
+            accumulator.add_rows(batch.rows())
+    table = accumulator.finish_table()
+    count("months", len(table.months))
+    count("plans", len(compiled_plans))
+    return table
 
 
 def calculate_usage_metrics(
-    file_obj, consider_generation: bool
+    file_obj,
+    consider_generation: bool,
+    engine: Optional[str] = None,
+    compiled_plans: Optional[List[CompiledPlan]] = None,
 ) -> Tuple[Dict[str, Any], List[str]]:
     """Return raw monthly metrics for each plan without selecting a winner."""
-    configs_by_plan = {
-        p["name"]: [HourlyConfig(c) for c in p.get("hourlyConfigs", [])] for p in TARIFFS
-    }
-    base_fees = {p["name"]: p.get("baseFee", 0.0) for p in TARIFFS}
-    metrics: Dict[str, Any] = {p["name"]: {"months": {}, "total_cost": 0.0} for p in TARIFFS}
-    month_usage = {p["name"]: 0.0 for p in TARIFFS}
-    month_cost = {p["name"]: 0.0 for p in TARIFFS}
-    month_detail: Dict[str, Dict[str, Dict[str, Any]]] = {p["name"]: {} for p in TARIFFS}
-
-    current_month: str | None = None
-    months_order: List[str] = []
-
-    for raw_row in iterate_rows(file_obj):
-        dt, cons = prepare_consumption(raw_row, consider_generation)
-        month = dt.strftime("%Y-%m")
-        if current_month is None:
-            current_month = month
-        elif month != current_month:
-            finalize_month(
-                current_month,
-                configs_by_plan.keys(),
-                base_fees,
-                metrics,
-                month_usage,
-                month_cost,
-                month_detail,
-                months_order,
-            )
-            current_month = month
-
-        hour = dt.hour
-        for plan_name, configs in configs_by_plan.items():
-            usage_so_far = month_usage[plan_name]
-            new_usage, added_cost = charge_usage(
-                cons, hour, configs, usage_so_far, month_detail[plan_name]
-            )
-            month_usage[plan_name] = new_usage
-            month_cost[plan_name] += added_cost
-
-    if current_month is not None:
-        finalize_month(
-            current_month,
-            configs_by_plan.keys(),
-            base_fees,
-            metrics,
-            month_usage,
-            month_cost,
-            month_detail,
-            months_order,
+    table = calculate_usage_table(file_obj, consider_generation, engine, compiled_plans)
+    return table.to_metrics(), table.months
+
+
+def calculate_customer_metrics(
+    file_obj,
+    consider_generation: bool,
+    customer_id: str,
+    store: UsageStore,
+    compiled_plans: Optional[List[CompiledPlan]] = None,
+    fingerprint: Optional[str] = None,
+    engine: Optional[str] = None,
+) -> Tuple[Dict[str, Any], List[str]]:
+    """Charge only readings newer than the customer's stored history and merge the results.
+
+    Timestamps are compared as ISO strings, so a customer's uploads must use
+    one timestamp format and UTC offset. The new readings are merged per hour
+    like any other upload. Stored months are dropped when the tariff
+    fingerprint changes. The store's write lock is held from loading the
+    history until the new one is saved, so uploads to one store are charged
+    one at a time.
+    """
+    catalog = TARIFF_REGISTRY.current()
+    compiled_plans = catalog.plans if compiled_plans is None else compiled_plans
+    fingerprint = catalog.version if fingerprint is None else fingerprint
+    engine = engine or METRICS_ENGINE
+    if engine not in ("python", "numpy"):
+        raise ValueError(f"Unknown metrics engine {engine}")
+    with store.transaction() as tx:
+        stored = tx.load(customer_id, consider_generation, fingerprint)
+        stored_until = stored.last_timestamp if stored else None
+        newest: List[str] = [stored_until] if stored_until is not None else []
+
+        def new_readings() -> Iterable[UsageBatch]:
+            for batch in iter_usage_batches(file_obj, consider_generation):
+                newest.append(max(batch.timestamps))
+                if stored_until is not None:
+                    batch = batch.take([i for i, ts in enumerate(batch.timestamps) if ts > stored_until])
+                if len(batch):
+                    yield batch
+
+        accumulator = MetricsAccumulator(compiled_plans)
+        if stored and stored.open_state:
+            accumulator.restore(stored.open_state)
+        hourly = aggregate_hourly(new_readings())
+        if engine == "numpy":
+            from app.managers.vectorized_engine import charge_accumulator
+
+            charge_accumulator(accumulator, hourly)
+        else:
+            for batch in timed_iter(hourly, "parse"):
+                with stage("charge"):
+                    accumulator.add_rows(batch.rows())
+        last_timestamp = max(newest) if newest else None
+
+        finalized_metrics = accumulator.table().to_metrics()
+        finalized = {
+            month: {name: data["months"][month] for name, data in finalized_metrics.items()}
+            for month in accumulator.months_order
+        }
+        tx.save(
+            customer_id,
+            consider_generation,
+            fingerprint,
+            finalized,
+            last_timestamp,
+            json.loads(json.dumps(accumulator.snapshot())),
         )
 
-    return metrics, months_order
+    months: Dict[str, Dict[str, Any]] = dict(stored.months) if stored else {}
+    metrics, months_order = accumulator.finish()
+    for month in months_order:
+        months[month] = {name: data["months"][month] for name, data in metrics.items()}
+    merged: Dict[str, Any] = {p.name: {"months": {}, "total_cost": 0.0} for p in compiled_plans}
+    for month in sorted(months):
+        for name, values in months[month].items():
+            if name in merged:
+                merged[name]["months"][month] = values
+                merged[name]["total_cost"] += values["cost"]
+    return merged, sorted(months)
+
+
+def calculate_usage_table_variants(
+    file_obj,
+    engine: Optional[str] = None,
+    compiled_plans: Optional[List[CompiledPlan]] = None,
+) -> Dict[bool, MetricsTable]:
+    """Return metrics tables with and without generation, keyed by consider_generation.
+
+    The file is read once; net and gross consumption are charged side by side.
+    """
+    compiled_plans = TARIFF_REGISTRY.current().plans if compiled_plans is None else compiled_plans
+    engine = engine or METRICS_ENGINE
+    if engine == "numpy":
+        from app.managers.vectorized_engine import calculate_usage_table_variants_vectorized
+
+        return calculate_usage_table_variants_vectorized(file_obj, compiled_plans)
+    if engine != "python":
+        raise ValueError(f"Unknown metrics engine {engine}")
+
+    net = MetricsAccumulator(compiled_plans)
+    gross = MetricsAccumulator(compiled_plans)
+    for batch in iter_hourly_batches(file_obj, True, keep_gross=True):
+        net.add_rows(batch.rows())
+        gross.add_rows(zip(batch.months, batch.hours, batch.gross))
+    return {True: net.finish_table(), False: gross.finish_table()}
+
+
+def calculate_usage_metrics_variants(
+    file_obj,
+    engine: Optional[str] = None,
+    compiled_plans: Optional[List[CompiledPlan]] = None,
+) -> Dict[bool, Tuple[Dict[str, Any], List[str]]]:
+    """Return metrics with and without generation, keyed by consider_generation."""
+    return {
+        flag: (table.to_metrics(), table.months)
+        for flag, table in calculate_usage_table_variants(file_obj, engine, compiled_plans).items()
+    }
 
 
 def recommend_from_metrics(
@@ -194,99 +478,431 @@ def recommend_from_metrics(
     return result
 
 
-def average_metrics(metrics: Dict[str, Any]) -> Dict[str, Any]:
-    """Average monthly metrics across years for forecasting."""
-    averaged: Dict[str, Any] = {}
-    for plan, data in metrics.items():
-        grouped: Dict[str, List[Dict[str, Any]]] = {}
+def choose_from_table(
+    table: MetricsTable, allow_switch: bool, months_order: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """The plan choices of recommend_from_metrics, without metrics, picked from the cost arrays.
+
+    months_order defaults to the table's month order.
+    """
+    months_order = table.months if months_order is None else months_order
+    if not table.plans:
+        result = recommend_from_metrics(table.to_metrics(), months_order, allow_switch)
+        del result["metrics"]
+        return result
+    result: Dict[str, Any] = {}
+    if allow_switch:
+        rows = {month: m for m, month in enumerate(table.months)}
+        # argmin keeps the first of equal costs, like a strict < scan
+        best = table.plan_cost.argmin(axis=1).tolist()
+        costs = table.plan_cost.tolist()
+        result["months"] = {}
+        for month in months_order:
+            m = rows[month]
+            result["months"][month] = {"plan": table.plans[best[m]], "cost": costs[m][best[m]]}
+    else:
+        totals = table.totals()
+        best_index = min(range(len(totals)), key=totals.__getitem__)
+        result["plan"] = table.plans[best_index]
+        result["cost"] = totals[best_index]
+    return result
+
+
+def recommend_from_table(
+    table: MetricsTable, allow_switch: bool, months_order: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """recommend_from_metrics for a MetricsTable."""
+    result = choose_from_table(table, allow_switch, months_order)
+    result["metrics"] = table.to_metrics()
+    return result
+
+
+def recommended_plans(result: Dict[str, Any]) -> List[str]:
+    """Names of the plans a recommendation picks, in order of first appearance."""
+    if "months" in result:
+        return list(dict.fromkeys(m["plan"] for m in result["months"].values()))
+    return [result["plan"]] if result.get("plan") is not None else []
+
+
+def lean_metrics(
+    metrics: Dict[str, Any], plan_names: Iterable[str], legend: Dict[str, str]
+) -> Dict[str, Any]:
+    """Metrics of the given plans with breakdown descriptions moved to a shared legend."""
+    lean: Dict[str, Any] = {}
+    for name in plan_names:
+        data = metrics[name]
+        months: Dict[str, Any] = {}
         for month, values in data["months"].items():
-            mm = month[5:]
-            grouped.setdefault(mm, []).append(values)
-
-        averaged[plan] = {"months": {}, "total_cost": 0.0}
-        for mm, vals in grouped.items():
-            count = len(vals)
-            cost = sum(v["cost"] for v in vals) / count
-            usage = sum(v["usage"] for v in vals) / count
-            breakdown: Dict[str, Dict[str, Any]] = {}
-            for v in vals:
-                for k, d in v["breakdown"].items():
-                    bd = breakdown.setdefault(k, {
-                        "usage": 0.0,
-                        "cost": 0.0,
-                        "description": d.get("description"),
-                    })
-                    bd["usage"] += d["usage"]
-                    bd["cost"] += d["cost"]
-            for d in breakdown.values():
-                d["usage"] /= count
-                d["cost"] /= count
-
-            averaged[plan]["months"][mm] = {
-                "cost": cost,
-                "usage": usage,
-                "breakdown": breakdown,
-            }
-            averaged[plan]["total_cost"] += cost
-    return averaged
+            breakdown: Dict[str, Any] = {}
+            for key, entry in values["breakdown"].items():
+                legend[key] = entry.get("description")
+                breakdown[key] = {"usage": entry["usage"], "cost": entry["cost"]}
+            months[month] = {"cost": values["cost"], "usage": values["usage"], "breakdown": breakdown}
+        lean[name] = {"months": months, "total_cost": data["total_cost"]}
+    return lean
+
+
+def shape_result(result: Dict[str, Any], detail: str) -> Dict[str, Any]:
+    """Trim a recommend_from_metrics result to a detail level.
+
+    "full" returns it unchanged, "summary" drops the metrics and
+    "recommended" keeps metrics for the recommended plans only, with
+    component descriptions in a "legend" keyed by component id.
+    """
+    if detail == "full":
+        return result
+    with stage("shape"):
+        shaped = {key: value for key, value in result.items() if key != "metrics"}
+        if detail == "recommended":
+            legend: Dict[str, str] = {}
+            shaped["metrics"] = lean_metrics(result["metrics"], recommended_plans(result), legend)
+            shaped["legend"] = legend
+        elif detail != "summary":
+            raise ValueError(f"Unknown detail level {detail}")
+    return shaped
 
 
+def average_metrics(metrics: Dict[str, Any]) -> Dict[str, Any]:
+    """Average monthly metrics across years for forecasting."""
+    return MetricsTable.from_metrics(metrics).average().to_metrics()
+
 
-def calculate_from_csv(file_obj, consider_generation: bool, allow_switch: bool) -> Dict[str, Any]:
+def calculate_from_csv(
+    file_obj, consider_generation: bool, allow_switch: bool, engine: Optional[str] = None
+) -> Dict[str, Any]:
     """Process uploaded CSV stream month by month without loading entire file."""
-    metrics, months_order = calculate_usage_metrics(file_obj, consider_generation)
+    metrics, months_order = calculate_usage_metrics(file_obj, consider_generation, engine)
     return recommend_from_metrics(metrics, months_order, allow_switch)
 
-def get_analysis_projected(file_obj, consider_generation: bool, allow_plan_switching: bool) -> Dict[str, Any]:
-    """Averages the usage metrics over the given data and projects out to make recommendations for the user for the upcoming year/months."""
-    metrics, _ = calculate_usage_metrics(file_obj, consider_generation)
-    avg_metrics = average_metrics(metrics)
+
+def catalog_version(version: Optional[str]) -> TariffCatalog:
+    """Return the current catalog, reloading when the caller expects a newer version."""
+    catalog = TARIFF_REGISTRY.current()
+    if version is not None and catalog.version != version:
+        try:
+            catalog = TARIFF_REGISTRY.reload()
+        except (OSError, ValueError):
+            pass
+    return catalog
+
+
+def worker_ready(version: Optional[str] = None) -> str:
+    """Picklable no-op job warming a worker: loads the tariff catalog and returns its version."""
+    return catalog_version(version).version
+
+
+def calculate_metrics_from_file(
+    path: str,
+    consider_generation: bool,
+    engine: Optional[str] = None,
+    version: Optional[str] = None,
+) -> Tuple[str, MetricsTable]:
+    """Picklable entry point computing metrics for an upload saved to a file.
+
+    Returns the tariff version used along with the metrics table.
+    """
+    catalog = catalog_version(version)
+    with open(path, "rb") as f:
+        result = calculate_usage_table(f, consider_generation, engine, catalog.plans)
+    return catalog.version, result
+
+
+async def calculate_usage_metrics_async(
+    upload: SavedUpload, consider_generation: bool, engine: Optional[str] = None
+) -> MetricsTable:
+    """Compute metrics in the worker pool so the event loop stays responsive.
+
+    The worker reads the upload from its file. Results are cached by upload
+    content, so re-uploads with other switching or projection options reuse
+    the same computation.
+    """
+    catalog = TARIFF_REGISTRY.current()
+    with stage("cache"):
+        key = digest_cache_key(upload.digest, consider_generation, catalog.version)
+        cached = await METRICS_CACHE.get_async(key)
+    if cached is not None:
+        return cached
+    version, result = await WORKER_POOL.run(
+        calculate_metrics_from_file, upload.path, consider_generation, engine, catalog.version
+    )
+    if version == catalog.version:
+        await METRICS_CACHE.put_async(key, result)
+    return result
+
+
+def calculate_stream_table(
+    chunks: Iterable[bytes],
+    consider_generation: bool,
+    engine: Optional[str],
+    customer_id: Optional[str],
+    catalog: TariffCatalog,
+) -> Tuple[MetricsTable, str]:
+    """Charge an upload read chunk by chunk, returning the table and the sha256 of the upload."""
+    digest = hashlib.sha256()
+
+    def hashed() -> Iterable[bytes]:
+        for chunk in chunks:
+            digest.update(chunk)
+            yield chunk
+
+    if customer_id is not None:
+        store = UsageStore(USAGE_STORE_PATH)
+        metrics, months_order = calculate_customer_metrics(
+            hashed(), consider_generation, customer_id, store, catalog.plans, catalog.version, engine
+        )
+        return MetricsTable.from_metrics(metrics, months_order), digest.hexdigest()
+    table = calculate_usage_table(hashed(), consider_generation, engine, catalog.plans)
+    return table, digest.hexdigest()
+
+
+async def calculate_usage_metrics_stream(
+    chunks: AsyncIterator[bytes],
+    consider_generation: bool,
+    engine: Optional[str] = None,
+    customer_id: Optional[str] = None,
+) -> MetricsTable:
+    """Compute metrics while the upload is still arriving.
+
+    Parsing and charging run in a stream thread fed from `chunks` through a
+    bounded buffer, so the upload is never held whole. The result is cached
+    like calculate_usage_metrics_async, keyed by a hash taken on the way.
+    """
+    catalog = TARIFF_REGISTRY.current()
+    table, digest = await STREAM_RUNNER.run(
+        chunks, calculate_stream_table, consider_generation, engine, customer_id, catalog
+    )
+    if customer_id is None:
+        await METRICS_CACHE.put_async(digest_cache_key(digest, consider_generation, catalog.version), table)
+    return table
+
+
+def calculate_customer_metrics_from_file(
+    path: str,
+    consider_generation: bool,
+    customer_id: str,
+    version: Optional[str] = None,
+    engine: Optional[str] = None,
+) -> MetricsTable:
+    """Picklable entry point for incremental uploads against the usage store."""
+    catalog = catalog_version(version)
+    store = UsageStore(USAGE_STORE_PATH)
+    with open(path, "rb") as f:
+        metrics, months_order = calculate_customer_metrics(
+            f, consider_generation, customer_id, store, catalog.plans, catalog.version, engine
+        )
+    return MetricsTable.from_metrics(metrics, months_order)
+
+
+async def calculate_customer_metrics_async(
+    upload: SavedUpload, consider_generation: bool, customer_id: str, engine: Optional[str] = None
+) -> MetricsTable:
+    """Incremental customer metrics via the worker pool; results depend on stored state so they are not cached."""
+    return await WORKER_POOL.run(
+        calculate_customer_metrics_from_file,
+        upload.path,
+        consider_generation,
+        customer_id,
+        TARIFF_REGISTRY.current().version,
+        engine,
+    )
+
+
+def calculate_variants_from_file(
+    path: str, engine: Optional[str] = None, version: Optional[str] = None
+) -> Tuple[str, Dict[bool, MetricsTable]]:
+    """Picklable entry point computing both generation variants for an upload saved to a file."""
+    catalog = catalog_version(version)
+    with open(path, "rb") as f:
+        return catalog.version, calculate_usage_table_variants(f, engine, catalog.plans)
+
+
+async def calculate_usage_metrics_variants_async(
+    upload: SavedUpload, engine: Optional[str] = None
+) -> Dict[bool, MetricsTable]:
+    """Both generation variants via the worker pool, sharing cache entries with single requests."""
+    catalog = TARIFF_REGISTRY.current()
+    keys = {flag: digest_cache_key(upload.digest, flag, catalog.version) for flag in (True, False)}
+    cached = {flag: await METRICS_CACHE.get_async(key) for flag, key in keys.items()}
+    if all(value is not None for value in cached.values()):
+        return cached
+    version, variants = await WORKER_POOL.run(
+        calculate_variants_from_file, upload.path, engine, catalog.version
+    )
+    if version == catalog.version:
+        for flag, key in keys.items():
+            await METRICS_CACHE.put_async(key, variants[flag])
+    return variants
+
+
+def project_table(table: MetricsTable) -> Tuple[MetricsTable, List[str]]:
+    """Average a table per calendar month, returning it with the months in numeric order."""
+    with stage("average"):
+        averaged = table.average()
     # order months numerically to keep response predictable
-    if avg_metrics:
-        months_order = sorted(next(iter(avg_metrics.values()))["months"].keys())
-    else:
-        months_order = []
-    return recommend_from_metrics(avg_metrics, months_order, allow_plan_switching)
+    return averaged, sorted(averaged.months)
+
+
+def project_metrics(metrics: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    """Average metrics per calendar month, returning them with the month order."""
+    averaged, months_order = project_table(MetricsTable.from_metrics(metrics))
+    return averaged.to_metrics(), months_order
+
+
+def project_from_table(table: MetricsTable, allow_plan_switching: bool) -> Dict[str, Any]:
+    """Average a table per calendar month and recommend plans for the upcoming year."""
+    averaged, months_order = project_table(table)
+    return recommend_from_table(averaged, allow_plan_switching, months_order)
+
+
+def project_from_metrics(metrics: Dict[str, Any], allow_plan_switching: bool) -> Dict[str, Any]:
+    """Average metrics per calendar month and recommend plans for the upcoming year."""
+    return project_from_table(MetricsTable.from_metrics(metrics), allow_plan_switching)
+
+
+def recommend_variants(
+    variants: Dict[bool, MetricsTable],
+    projected: bool = False,
+    detail: str = "full",
+) -> Dict[str, Any]:
+    """Build switching and fixed recommendations for each generation setting.
+
+    Metrics are included once per generation setting rather than per variant,
+    trimmed to `detail` as in shape_result.
+    """
+    result: Dict[str, Any] = {}
+    legend: Dict[str, str] = {}
+    for consider_generation, table in variants.items():
+        months_order = None
+        if projected:
+            table, months_order = project_table(table)
+        switching = choose_from_table(table, True, months_order)
+        fixed = choose_from_table(table, False, months_order)
+        key = "withGeneration" if consider_generation else "withoutGeneration"
+        result[key] = {"switching": switching, "fixed": fixed}
+        if detail == "full":
+            result[key]["metrics"] = table.to_metrics()
+        elif detail == "recommended":
+            names = dict.fromkeys(recommended_plans(switching) + recommended_plans(fixed))
+            result[key]["metrics"] = lean_metrics(table.to_metrics(), names, legend)
+        elif detail != "summary":
+            raise ValueError(f"Unknown detail level {detail}")
+    if detail == "recommended":
+        result["legend"] = legend
+    return result
+
+
+def get_all_variants(
+    file_obj, projected: bool = False, engine: Optional[str] = None
+) -> Dict[str, Any]:
+    """Every considerGeneration x allowPlanSwitching recommendation from one read of the file."""
+    return recommend_variants(calculate_usage_table_variants(file_obj, engine), projected)
 
-async def get_analysis_email(file_obj, consider_generation: bool, allow_plan_switching: bool, user_id: Optional[int] = None):
+
+def get_analysis_projected(
+    file_obj, consider_generation: bool, allow_plan_switching: bool, engine: Optional[str] = None
+) -> Dict[str, Any]:
+    """Averages the usage metrics over the given data and projects out to make recommendations for the user for the upcoming year/months."""
+    table = calculate_usage_table(file_obj, consider_generation, engine)
+    return project_from_table(table, allow_plan_switching)
+
+
+async def get_analysis_email(
+    file_obj,
+    consider_generation: bool,
+    allow_plan_switching: bool,
+    user_id: Optional[int] = None,
+    engine: Optional[str] = None,
+):
     """calls `get_analysis_projected` to get projected recommendations, and then crafts a user-friendly email to send out"""
-    analysis = get_analysis_projected(file_obj, consider_generation, allow_plan_switching)
-
-    system_prompt = EXPLAIN_SYSTEM_PROMPT
-    user_message = json.dumps(analysis, indent=2)
-    completion = await open_ai_client.chat.completions.create(
-        model="gpt-4o",
-        messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_message}],
-        stream=False
-    )
-    explanation = completion.choices[0].message.content
+    analysis = get_analysis_projected(file_obj, consider_generation, allow_plan_switching, engine)
+    return await explain_analysis(analysis, allow_plan_switching)
+
 
-    email = "Dear Customer,\n\nThank you for being a valued customer with us!"
+def explain_messages(analysis: Dict[str, Any]) -> List[Dict[str, str]]:
+    """Build the chat messages asking the LLM to explain an analysis."""
+    with stage("prompt"):
+        compact = compact_analysis(analysis, EXPLAIN_TOKEN_BUDGET)
+        messages = [
+            {"role": "system", "content": explain_system_prompt(TARIFF_REGISTRY.current())},
+            {"role": "user", "content": json.dumps(compact, separators=(",", ":"))},
+        ]
+    count("prompt_bytes", sum(len(m["content"]) for m in messages))
+    return messages
+
+
+def explain_prompt_sizes(analysis: Dict[str, Any]) -> Dict[str, Dict[str, int]]:
+    """Compare the prompt built from the full analysis with the compact one."""
+    full = [
+        {"role": "system", "content": explain_system_prompt(TARIFF_REGISTRY.current(), compact=False)},
+        {"role": "user", "content": json.dumps(analysis, indent=2)},
+    ]
+    return {"full": prompt_size(full), "compact": prompt_size(explain_messages(analysis))}
+
+
+def email_header(allow_plan_switching: bool) -> str:
+    header = "Dear Customer,\n\nThank you for being a valued customer with us!"
     if allow_plan_switching:
-        email += "Here is your tariff plan recommendations for the next year, split by month:\n\n"
+        header += "Here is your tariff plan recommendations for the next year, split by month:\n\n"
     else:
-        email += "Here is your tariff plan recommendations for the next year:\n\n"
-    email += (
-        f"{explanation}\n\n"
-        "Thank you again!\n"
-        "Sincerely, Light"
-    )
+        header += "Here is your tariff plan recommendations for the next year:\n\n"
+    return header
+
+
+EMAIL_FOOTER = (
+    "\n\n"
+    "Thank you again!\n"
+    "Sincerely, Light"
+)
+
+
+async def explain_analysis(analysis: Dict[str, Any], allow_plan_switching: bool) -> Dict[str, Any]:
+    """Craft the recommendation email for an already computed projected analysis."""
+    messages = explain_messages(analysis)
+    with stage("llm"):
+        explanation = await LLM_CLIENT.complete(messages)
+    email = email_header(allow_plan_switching) + explanation + EMAIL_FOOTER
     return {"email": email, "analysis": analysis}
     # We simply return the response, but this could integrate with an email provider, publish message to queue or make API call, etc.
 
-EXPLAIN_SYSTEM_PROMPT = f"""
+
+async def stream_explanation(analysis: Dict[str, Any], allow_plan_switching: bool) -> AsyncIterator[str]:
+    """Start the completion and return the recommendation email as an iterator of pieces.
+
+    Waits for the first piece of the LLM's text, so LLMBusyError and
+    upstream failures before it are raised here, while the caller can still
+    answer with an error status. Failures after it end the stream early.
+    """
+    chunks = LLM_CLIENT.stream(explain_messages(analysis)).__aiter__()
+    with stage("llm"):
+        try:
+            first = await chunks.__anext__()
+        except StopAsyncIteration:
+            first = ""
+
+    async def email() -> AsyncIterator[str]:
+        yield email_header(allow_plan_switching) + first
+        async for chunk in chunks:
+            yield chunk
+        yield EMAIL_FOOTER
+
+    return email()
+
+EXPLAIN_PROMPT_TEMPLATE = """
 You are a helpful expert energy consultant.
 Given a customer's energy usage data, we have generated an analysis of which tariff plan or plans will be cheapest for the upcoming year.
 Using the analysis provided as input, explain why those plan choices were recommended. Compare the options, and reference the usage breakdowns that most affected the decision.
 
 <tariff-plan-options>
 ## Tariff Plan Options:
-{json.dumps(load_tariffs(), indent=2)}
+{tariffs}
 </tariff-plan-options>
 
 ## Description of the Input Data
-The input will include the most cost-efficient plan option, the cost and usage metrics of each, as well 
-as a detailed breakdown of the cost + usage based on the different components of each given plan.
+The input contains one decision per month ("months", keyed by month number) or a single "overall" decision.
+Each decision has the cheapest plan ("best"), the next cheapest plan ("runnerUp") and "delta", how much more the runner-up would cost.
+For each plan you get its total "cost", the monthly base "fees" included in it, and the "drivers": the components
+of the plan that cost the most, as [component, usage, cost] lists. Component ids are explained in "legend". When the input is cut short, "omittedMonths" lists the months left out.
+Costs are in cents and usage in kWh.
 An example of a component is 'All hours of the day, applied after 100 kWh', meaning that component of the plan applies across all hours of the day, but only after the first 100 kWh.
 
 A single tariff plan consists of several elements:
@@ -301,3 +917,17 @@ A single tariff plan consists of several elements:
 ## Response
 Write a concise, professional explanation. If the analysis contains monthly plan recommendations, include a short explanation for each month (use month numbers rather than years). Otherwise provide one overall explanation.
 """
+
+
+@lru_cache(maxsize=8)
+def explain_system_prompt(catalog: TariffCatalog, compact: bool = True) -> str:
+    """Build the /explain system prompt once per tariff catalog snapshot.
+
+    compact=False reproduces the indented catalog used before prompt
+    compaction, for size comparisons.
+    """
+    if compact:
+        tariffs = json.dumps(catalog.tariffs, separators=(",", ":"))
+    else:
+        tariffs = json.dumps(catalog.tariffs, indent=2)
+    return EXPLAIN_PROMPT_TEMPLATE.format(tariffs=tariffs)
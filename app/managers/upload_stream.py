@@ -0,0 +1,223 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+from collections import deque
+from typing import Any, AsyncIterator, BinaryIO, Deque, Dict, Iterator, List, Optional
+
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+UPLOAD_FIELD = "usageData"
+# bytes read from an UploadFile at a time when saving it
+SAVE_CHUNK_SIZE = 1 << 20
+
+
+class UploadError(ValueError):
+    """Raised when a streamed request body does not contain a usable upload."""
+
+
+class ChunkChannel:
+    """Bounded hand-off of upload chunks from the event loop to a parsing thread.
+
+    The event loop awaits put, which waits while ``max_chunks`` chunks are
+    unread, so a slow parser slows down reading the request instead of
+    buffering it. The parsing thread iterates over the channel. close ends
+    the iteration, with an error when the upload failed; stop is called by
+    the consumer when it is done, so a failed parse releases the producer.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_chunks: int):
+        self._loop = loop
+        self._max_chunks = max(1, max_chunks)
+        self._chunks: Deque[bytes] = deque()
+        self._lock = threading.Condition()
+        self._space: Optional["asyncio.Future[None]"] = None
+        self._closed = False
+        self._error: Optional[BaseException] = None
+        self._stopped = False
+
+    async def put(self, chunk: bytes) -> bool:
+        """Queue a chunk, returning False when the consumer has stopped."""
+        while True:
+            with self._lock:
+                if self._stopped:
+                    return False
+                if len(self._chunks) < self._max_chunks:
+                    self._chunks.append(chunk)
+                    self._lock.notify()
+                    return True
+                self._space = space = self._loop.create_future()
+            await space
+
+    def close(self, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            self._closed = True
+            self._error = error
+            self._lock.notify()
+
+    def stop(self) -> None:
+        with self._lock:
+            self._stopped = True
+            self._chunks.clear()
+            self._wake_producer()
+
+    def _wake_producer(self) -> None:
+        if self._space is not None:
+            space, self._space = self._space, None
+            self._loop.call_soon_threadsafe(_resolve, space)
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            with self._lock:
+                while not self._chunks and not self._closed:
+                    self._lock.wait()
+                if self._chunks:
+                    chunk = self._chunks.popleft()
+                    self._wake_producer()
+                elif self._error is not None:
+                    raise self._error
+                else:
+                    return
+            yield chunk
+
+
+def _resolve(future: "asyncio.Future[None]") -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class MultipartExtractor:
+    """Incrementally pulls the content of one form field out of a multipart body."""
+
+    def __init__(self, content_type: str, field: str = UPLOAD_FIELD):
+        _, params = parse_options_header(content_type)
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise UploadError("Multipart body without boundary")
+        self.field = field
+        self.found = False
+        self._wanted = False
+        self._header_field = b""
+        self._header_value = b""
+        self._headers: Dict[bytes, bytes] = {}
+        self._out: List[bytes] = []
+        self._parser = MultipartParser(
+            boundary,
+            {
+                "on_part_begin": self._part_begin,
+                "on_header_field": self._header_field_data,
+                "on_header_value": self._header_value_data,
+                "on_header_end": self._header_end,
+                "on_headers_finished": self._headers_finished,
+                "on_part_data": self._part_data,
+                "on_part_end": self._part_end,
+            },
+        )
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """Parse more of the body, returning the field content it contained."""
+        try:
+            self._parser.write(data)
+        except MultipartParseError as e:
+            raise UploadError(f"Invalid multipart body: {e}")
+        out, self._out = self._out, []
+        return out
+
+    def finish(self) -> None:
+        self._parser.finalize()
+        if not self.found:
+            raise UploadError(f"Missing {self.field} file")
+
+    def _part_begin(self) -> None:
+        self._headers = {}
+        self._wanted = False
+
+    def _header_field_data(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _header_value_data(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def _headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._wanted = not self.found and options.get(b"name") == self.field.encode()
+
+    def _part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._wanted and end > start:
+            self._out.append(data[start:end])
+
+    def _part_end(self) -> None:
+        if self._wanted:
+            self.found = True
+            self._wanted = False
+
+
+async def upload_chunks(body: AsyncIterator[bytes], content_type: str) -> AsyncIterator[bytes]:
+    """Yield the uploaded file from a request body as it arrives.
+
+    Multipart form bodies yield the content of the usageData field; any
+    other body is the file itself.
+    """
+    if not content_type.lower().startswith("multipart/form-data"):
+        async for chunk in body:
+            if chunk:
+                yield chunk
+        return
+    extractor = MultipartExtractor(content_type)
+    async for chunk in body:
+        for data in extractor.feed(chunk):
+            yield data
+    extractor.finish()
+
+
+class SavedUpload:
+    """An upload copied to a named temporary file, so worker processes can open it by path.
+
+    ``digest`` is the sha256 hex digest of the content, taken while copying.
+    """
+
+    __slots__ = ("path", "digest", "size")
+
+    def __init__(self, path: str, digest: str, size: int):
+        self.path = path
+        self.digest = digest
+        self.size = size
+
+    def remove(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def _write_chunk(out: BinaryIO, digest: Any, chunk: bytes) -> None:
+    digest.update(chunk)
+    out.write(chunk)
+
+
+async def save_upload(upload: Any, chunk_size: int = SAVE_CHUNK_SIZE) -> SavedUpload:
+    """Copy an UploadFile to a named temporary file chunk by chunk, hashing it on the way.
+
+    At most one chunk is held in memory. The caller removes the file.
+    """
+    fd, path = tempfile.mkstemp(suffix=".upload")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+                await asyncio.to_thread(_write_chunk, out, digest, chunk)
+                size += len(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return SavedUpload(path, digest.hexdigest(), size)
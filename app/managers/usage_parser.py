@@ -0,0 +1,729 @@
+import codecs
+import csv
+import heapq
+import logging
+import math
+import pickle
+import tempfile
+import zlib
+from datetime import datetime
+from itertools import chain, compress, groupby
+from itertools import count as counter
+from operator import itemgetter, ne, or_
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from app.configs.settings import (
+    HOURLY_AGGREGATION,
+    UPLOAD_MAX_DECOMPRESSED_BYTES,
+    USAGE_GAP_POLICY,
+    USAGE_SORT_BUFFER_HOURS,
+)
+from app.managers.instrumentation import count
+
+logger = logging.getLogger(__name__)
+
+UNIT_DIVISORS = {"kwh": 1.0, "wh": 1000.0}
+CHUNK_SIZE = 1 << 20
+# compressed bytes handed to a decompressor that cannot cap its output at once;
+# a zstd block can inflate about 40000 times, so this bounds a call to ~40 MiB
+DECOMPRESS_INPUT_SLICE = 1 << 10
+# zlib decompressors take an output limit; zstandard's mimic their attributes but not that argument
+_ZLIB_DECOMPRESS = type(zlib.decompressobj())
+
+
+class UsageDataError(ValueError):
+    """Raised when an upload cannot be read as usage data; requests answer it with 400."""
+
+
+def usage_error(e: Exception) -> UsageDataError:
+    """Wrap a parsing failure, such as a malformed number or timestamp, as a UsageDataError."""
+    if isinstance(e, UsageDataError):
+        return e
+    return UsageDataError(f"Invalid usage data: {e}")
+
+
+class UsageBatch:
+    """Parsed rows of one chunk, stored column-wise."""
+
+    __slots__ = ("timestamps", "months", "hours", "consumption", "gross", "durations", "meters", "generation")
+
+    def __init__(
+        self,
+        timestamps: List[str],
+        months: List[str],
+        hours: List[int],
+        consumption: List[float],
+        gross: Optional[List[float]] = None,
+        durations: Optional[List[float]] = None,
+        meters: Optional[List[str]] = None,
+        generation: Optional[List[float]] = None,
+    ):
+        self.timestamps = timestamps
+        self.months = months
+        self.hours = hours
+        self.consumption = consumption
+        # consumption before subtracting generation, when requested
+        self.gross = gross
+        # reading length in seconds, when the upload has a duration column
+        self.durations = durations
+        # meter id per row, when the upload combines several meters
+        self.meters = meters
+        # generation in kWh, kept along with gross
+        self.generation = generation
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def rows(self) -> Iterator[Tuple[str, int, float]]:
+        """Yield (month, hour, consumption_kwh) per row."""
+        return zip(self.months, self.hours, self.consumption)
+
+    def take(self, indices: List[int]) -> "UsageBatch":
+        """A batch with the given rows only."""
+
+        def pick(values: Optional[List[Any]]) -> Optional[List[Any]]:
+            return None if values is None else [values[i] for i in indices]
+
+        return UsageBatch(
+            pick(self.timestamps),
+            pick(self.months),
+            pick(self.hours),
+            pick(self.consumption),
+            pick(self.gross),
+            pick(self.durations),
+            pick(self.meters),
+            pick(self.generation),
+        )
+
+
+def split_timestamp(ts: str) -> Tuple[str, int]:
+    """Return ("YYYY-MM", hour) reading fixed ISO offsets when possible.
+
+    Anything the fast path cannot vouch for, such as month 13, February 31
+    or hour 25, is left to datetime.fromisoformat, which rejects it with
+    ValueError. Days past the 28th always take that path.
+    """
+    if (
+        len(ts) >= 13
+        and ts[4] == "-"
+        and ts[7] == "-"
+        and ts[10] in "T "
+        and ts[:4].isdigit()
+        and ts[11:13].isdigit()
+    ):
+        month = ts[5:7]
+        day = ts[8:10]
+        hour = int(ts[11:13])
+        if month.isdigit() and "01" <= month <= "12" and day.isdigit() and "01" <= day <= "28" and hour < 24:
+            return ts[:7], hour
+    dt = datetime.fromisoformat(ts)
+    return dt.strftime("%Y-%m"), dt.hour
+
+
+def check_finite(values: List[float], column: str) -> None:
+    """Reject nan and infinite values, which float() accepts but no plan can charge."""
+    # the sum of finite values is finite unless it overflows, so one pass usually settles it
+    if not math.isfinite(sum(values)) and not all(map(math.isfinite, values)):
+        raise UsageDataError(f"Invalid usage data: {column} must be finite numbers")
+
+
+def split_timestamps(
+    timestamps: List[str], cache: Dict[str, Tuple[str, int]]
+) -> Tuple[List[str], List[int]]:
+    """Split a column of timestamps into months and hours."""
+    # readings within the same hour share the "YYYY-MM-DDTHH" prefix
+    if len(cache) > 1 << 16:
+        cache.clear()
+    months: List[str] = []
+    hours: List[int] = []
+    for ts in timestamps:
+        prefix = ts[:13]
+        split = cache.get(prefix)
+        if split is None:
+            split = split_timestamp(ts)
+            if len(ts) >= 13 and ts[:7] == split[0] and ts[11:13].isdigit():
+                cache[prefix] = split
+        months.append(split[0])
+        hours.append(split[1])
+    return months, hours
+
+
+class UsageParser:
+    """Incremental parser for the usage CSV schema.
+
+    Chunks of bytes or text are pushed with ``feed`` and come back as
+    UsageBatch objects. Column positions are resolved once from the header,
+    lines are split without building dicts and unit conversion is applied
+    once per run of rows sharing a unit.
+    """
+
+    def __init__(self, consider_generation: bool, encoding: str = "utf-8", keep_gross: bool = False):
+        self.consider_generation = consider_generation
+        self.keep_gross = keep_gross
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self._pending = ""
+        self._columns: Optional[Tuple[int, int, int, Optional[int], Optional[int], Optional[int]]] = None
+        self._divisors: Dict[str, float] = {}
+        self._hour_prefixes: Dict[str, Tuple[str, int]] = {}
+
+    def feed(self, chunk) -> List[UsageBatch]:
+        """Parse every complete line in chunk, keeping the trailing partial line."""
+        try:
+            text = self._decoder.decode(chunk) if isinstance(chunk, (bytes, bytearray)) else chunk
+            if not text:
+                return []
+            lines = (self._pending + text).split("\n")
+            self._pending = lines.pop()
+            return self._parse(lines)
+        except (ValueError, IndexError) as e:
+            raise usage_error(e)
+
+    def finish(self) -> List[UsageBatch]:
+        """Flush the last line once the input is exhausted."""
+        try:
+            tail = self._pending + self._decoder.decode(b"", final=True)
+            self._pending = ""
+            return self._parse([tail])
+        except (ValueError, IndexError) as e:
+            raise usage_error(e)
+
+    def _divisor(self, unit: str) -> float:
+        divisor = self._divisors.get(unit)
+        if divisor is None:
+            normalized = unit.strip().lower()
+            if normalized not in UNIT_DIVISORS:
+                raise UsageDataError(f"Unsupported unit {normalized}")
+            divisor = self._divisors[unit] = UNIT_DIVISORS[normalized]
+        return divisor
+
+    def _read_header(self, names: List[str]) -> None:
+        names = [n.strip() for n in names]
+        names[0] = names[0].lstrip("\ufeff")
+        positions = {name: i for i, name in enumerate(names)}
+        for required in ("datetime", "unit", "consumption"):
+            if required not in positions:
+                raise UsageDataError(f"Missing column {required}")
+        self._columns = (
+            positions["datetime"],
+            positions["unit"],
+            positions["consumption"],
+            positions.get("generation"),
+            positions.get("duration"),
+            positions.get("meter"),
+        )
+
+    def _parse(self, lines: List[str]) -> List[UsageBatch]:
+        if any('"' in line for line in lines):
+            rows = [r for r in csv.reader(lines) if r]
+        else:
+            rows = [line.rstrip("\r").split(",") for line in lines if line and line != "\r"]
+        if self._columns is None:
+            if not rows:
+                return []
+            self._read_header(rows.pop(0))
+        if not rows:
+            return []
+
+        i_dt, i_unit, i_cons, i_gen, i_dur, i_meter = self._columns
+        timestamps = [r[i_dt] for r in rows]
+        units = [r[i_unit] for r in rows]
+        consumption = list(map(float, [r[i_cons] for r in rows]))
+        check_finite(consumption, "consumption")
+        gen_column = list(map(float, [r[i_gen] for r in rows])) if i_gen is not None else None
+        if gen_column is not None:
+            check_finite(gen_column, "generation")
+        months, hours = split_timestamps(timestamps, self._hour_prefixes)
+
+        values: List[float] = []
+        gross: Optional[List[float]] = [] if self.keep_gross else None
+        generation: Optional[List[float]] = [] if self.keep_gross else None
+        start = 0
+        for unit, run in groupby(units):
+            end = start + sum(1 for _ in run)
+            divisor = self._divisor(unit)
+            raw = consumption[start:end]
+            cons = raw
+            if self.consider_generation and gen_column is not None:
+                cons = [c - g if c > g else 0.0 for c, g in zip(raw, gen_column[start:end])]
+            elif self.consider_generation:
+                cons = [c if c > 0 else 0.0 for c in raw]
+            if divisor != 1.0:
+                cons = [c / divisor for c in cons]
+            values.extend(cons)
+            if gross is not None:
+                gross.extend(raw if divisor == 1.0 else [c / divisor for c in raw])
+                if gen_column is not None:
+                    generation.extend(g / divisor for g in gen_column[start:end])
+                else:
+                    generation.extend([0.0] * (end - start))
+            start = end
+
+        durations = list(map(float, [r[i_dur] for r in rows])) if i_dur is not None else None
+        if durations is not None:
+            check_finite(durations, "duration")
+        meters = [r[i_meter] for r in rows] if i_meter is not None else None
+        return [UsageBatch(timestamps, months, hours, values, gross, durations, meters, generation)]
+
+
+# leading bytes identifying compressed and columnar uploads
+MAGIC_BYTES = (
+    (b"\x1f\x8b", "gzip"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+    (b"PAR1", "parquet"),
+    (b"ARROW1", "arrow"),
+    (b"\xff\xff\xff\xff", "arrow-stream"),
+)
+SNIFF_BYTES = 6
+# rows per record batch when reading columnar uploads
+COLUMNAR_BATCH_ROWS = 1 << 16
+
+
+def sniff_format(head: bytes) -> str:
+    """Return the upload format given its first bytes, "csv" when nothing matches."""
+    for magic, name in MAGIC_BYTES:
+        if head.startswith(magic):
+            return name
+    return "csv"
+
+
+def iter_chunks(file_obj, chunk_size: int) -> Iterator:
+    """Yield chunks from a file object, or items from any other iterable."""
+    if hasattr(file_obj, "read"):
+        while True:
+            chunk = file_obj.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        yield from file_obj
+
+
+def _decompress_some(decompressor: Any, data: bytes) -> Tuple[bytes, bytes]:
+    """Decompress part of data, returning the output and the input still to feed."""
+    if isinstance(decompressor, _ZLIB_DECOMPRESS):
+        out = decompressor.decompress(data, CHUNK_SIZE)
+        return out, decompressor.unconsumed_tail
+    return decompressor.decompress(data[:DECOMPRESS_INPUT_SLICE]), data[DECOMPRESS_INPUT_SLICE:]
+
+
+def decompress_chunks(
+    chunks: Iterator[bytes],
+    new_decompressor: Callable[[], Any],
+    max_bytes: Optional[int] = None,
+) -> Iterator[bytes]:
+    """Stream-decompress chunks, continuing across concatenated members/frames.
+
+    Output is produced in pieces of about CHUNK_SIZE, so a small, highly
+    compressed upload cannot inflate into memory at once; past max_bytes of
+    output (UPLOAD_MAX_DECOMPRESSED_BYTES by default, 0 for no limit) the
+    upload is rejected.
+    """
+    max_bytes = UPLOAD_MAX_DECOMPRESSED_BYTES if max_bytes is None else max_bytes
+    decompressor = new_decompressor()
+    # the current member has received input but not reached its end
+    pending = False
+    total = 0
+    for chunk in chunks:
+        data = chunk
+        while True:
+            pending = pending or bool(data)
+            try:
+                out, data = _decompress_some(decompressor, data)
+            except zlib.error as e:
+                raise UsageDataError(f"Invalid compressed upload: {e}")
+            if out:
+                total += len(out)
+                if max_bytes and total > max_bytes:
+                    raise UsageDataError(f"Decompressed upload is larger than {max_bytes} bytes")
+                yield out
+            if decompressor.eof:
+                data = decompressor.unused_data + data
+                decompressor = new_decompressor()
+                pending = False
+            # a full piece may leave output buffered in the decompressor
+            if not data and len(out) < CHUNK_SIZE:
+                break
+    if pending:
+        raise UsageDataError("Compressed upload is truncated")
+
+
+def gzip_decompressor() -> Any:
+    return zlib.decompressobj(wbits=31)
+
+
+def zstd_decompressor() -> Any:
+    try:
+        import zstandard
+    except ImportError:
+        raise UsageDataError("zstd compressed uploads need the zstandard package")
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+def record_batches(data: bytes, fmt: str) -> Iterator[Any]:
+    """Yield pyarrow record batches from a Parquet or Arrow IPC upload."""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise UsageDataError("Parquet and Arrow uploads need the pyarrow package")
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        yield from pq.ParquetFile(pa.BufferReader(data)).iter_batches(batch_size=COLUMNAR_BATCH_ROWS)
+    elif fmt == "arrow":
+        reader = pa.ipc.open_file(pa.BufferReader(data))
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i)
+    else:
+        yield from pa.ipc.open_stream(pa.BufferReader(data))
+
+
+def columnar_batch(
+    record_batch: Any,
+    consider_generation: bool,
+    keep_gross: bool,
+    cache: Dict[str, Tuple[str, int]],
+) -> UsageBatch:
+    """Convert a record batch with the CSV column names into a UsageBatch.
+
+    Timestamp columns are split with Arrow kernels; string timestamps take
+    the same path as CSV text. Units are resolved once per distinct value.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    names = record_batch.schema.names
+    for required in ("datetime", "unit", "consumption"):
+        if required not in names:
+            raise UsageDataError(f"Missing column {required}")
+
+    ts = record_batch.column("datetime")
+    if pa.types.is_timestamp(ts.type):
+        timestamps = pc.strftime(ts, format="%Y-%m-%dT%H:%M:%S").to_pylist()
+        months = pc.strftime(ts, format="%Y-%m").to_pylist()
+        hours = pc.hour(ts).to_pylist()
+    else:
+        timestamps = pc.cast(ts, pa.string()).to_pylist()
+        months, hours = split_timestamps(timestamps, cache)
+
+    units = pc.utf8_lower(pc.utf8_trim_whitespace(pc.cast(record_batch.column("unit"), pa.string())))
+    known = pa.array(list(UNIT_DIVISORS))
+    index = pc.index_in(units, value_set=known)
+    if index.null_count:
+        unknown = pc.filter(units, pc.is_null(index)).unique().to_pylist()
+        raise UsageDataError(f"Unsupported unit {unknown[0]}")
+    divisor = pa.array(list(UNIT_DIVISORS.values())).take(index)
+
+    raw = pc.cast(record_batch.column("consumption"), pa.float64())
+    gen = None
+    if "generation" in names:
+        gen = pc.fill_null(pc.cast(record_batch.column("generation"), pa.float64()), 0.0)
+    for column, values in (("consumption", raw), ("generation", gen)):
+        if values is not None and not pc.all(pc.is_finite(values)).as_py():
+            raise UsageDataError(f"Invalid usage data: {column} must be finite numbers")
+    cons = raw
+    if consider_generation:
+        if gen is not None:
+            cons = pc.subtract(raw, gen)
+        cons = pc.max_element_wise(cons, 0.0)
+    values = pc.divide(cons, divisor).to_pylist()
+    gross = pc.divide(raw, divisor).to_pylist() if keep_gross else None
+    generation = None
+    if keep_gross:
+        generation = [0.0] * len(gross)
+        if gen is not None:
+            generation = pc.divide(gen, divisor).to_pylist()
+    durations = None
+    if "duration" in names:
+        durations = pc.cast(record_batch.column("duration"), pa.float64()).to_pylist()
+    meters = None
+    if "meter" in names:
+        meters = pc.cast(record_batch.column("meter"), pa.string()).to_pylist()
+    return UsageBatch(timestamps, months, hours, values, gross, durations, meters, generation)
+
+
+def iter_usage_batches(
+    file_obj, consider_generation: bool, chunk_size: int = CHUNK_SIZE, keep_gross: bool = False
+) -> Iterator[UsageBatch]:
+    """Parse a file object (binary or text) in large chunks.
+
+    Binary uploads are sniffed: gzip and zstd CSV is decompressed as it is
+    read, Parquet and Arrow IPC files are read column-wise.
+    """
+    chunks = iter_chunks(file_obj, chunk_size)
+    head = next(chunks, None)
+    if isinstance(head, (bytes, bytearray)):
+        while len(head) < SNIFF_BYTES:
+            more = next(chunks, None)
+            if more is None:
+                break
+            head += more
+        fmt = sniff_format(bytes(head))
+        chunks = chain([head], chunks)
+        if fmt in ("parquet", "arrow", "arrow-stream"):
+            cache: Dict[str, Tuple[str, int]] = {}
+            data = b"".join(chunks)
+            try:
+                for record_batch in record_batches(data, fmt):
+                    if record_batch.num_rows:
+                        yield columnar_batch(record_batch, consider_generation, keep_gross, cache)
+            except (ValueError, IndexError) as e:
+                raise usage_error(e)
+            return
+        if fmt == "gzip":
+            chunks = decompress_chunks(chunks, gzip_decompressor)
+        elif fmt == "zstd":
+            chunks = decompress_chunks(chunks, zstd_decompressor)
+    elif head is not None:
+        chunks = chain([head], chunks)
+
+    parser = UsageParser(consider_generation, keep_gross=keep_gross)
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.finish()
+
+
+EPOCH = datetime(1970, 1, 1)
+# seconds of slack before consecutive readings count as a gap or overlap
+CONTINUITY_TOLERANCE = 1.0
+# "MM:SS" -> seconds into the hour, cheaper than parsing the whole timestamp
+_SECONDS_INTO_HOUR = {f"{m:02d}:{s:02d}": m * 60 + s for m in range(60) for s in range(60)}
+_HOUR_PREFIX = itemgetter(slice(0, 13))
+# merged hours per UsageBatch handed to the charging code
+OUTPUT_BATCH_HOURS = 1 << 16
+
+
+def _wall_seconds(ts: str) -> float:
+    """Seconds since the epoch of a timestamp's wall clock time, ignoring any UTC offset."""
+    try:
+        return (datetime.fromisoformat(ts).replace(tzinfo=None) - EPOCH).total_seconds()
+    except ValueError as e:
+        raise usage_error(e)
+
+
+def _charged_sum(values: List[float]) -> float:
+    """Sum of the readings charge_usage would charge; negative ones must not cancel the others."""
+    return sum(filter((0.0).__lt__, values))
+
+
+class HourlyAggregator:
+    """Sums readings per clock hour, in any order and across meters.
+
+    Hours are keyed by their "YYYY-MM-DDTHH" prefix, whichever separator the
+    timestamp uses, and come out of finish()
+    in time order. charge_usage splits a reading where it crosses a tier
+    threshold, so charging an hour's sum splits at the same points as
+    charging its readings in time order and every plan's cost stays the
+    same, sequential plans included. Readings are charged at the hour they
+    start in; negative ones are left out of the sums, as charge_usage skips
+    them.
+
+    At most ``max_hours`` hours are held in memory; beyond that they are
+    spilled to temporary files as sorted runs and merged in finish(), so
+    memory stays bounded for files of any size or time span.
+
+    With a duration column continuity is checked per meter and hour in file
+    order: an hour's durations must add up to the time until the meter's
+    next reading. Gaps and overlaps are counted and, with policy "reject",
+    raise UsageDataError. Readings that go back in time start a new check.
+    """
+
+    def __init__(self, policy: str = "warn", max_hours: int = 100_000):
+        if policy not in ("ignore", "warn", "reject"):
+            raise ValueError(f"Unknown gap policy {policy}")
+        self.policy = policy
+        self.max_hours = max_hours
+        self.rows = 0
+        self.buckets = 0
+        self.gaps = 0
+        self.overlaps = 0
+        self.in_order = True
+        self.spills = 0
+        # hour prefix -> [timestamp, month, hour, consumption, gross, generation]
+        self._hours: Dict[str, List[Any]] = {}
+        self._last_key = ""
+        self._runs: List[Any] = []
+        # meter -> (start, end) seconds of its last run of readings
+        self._meters: Dict[Optional[str], Tuple[float, float]] = {}
+        self._hour_starts: Dict[str, float] = {}
+        self._with_gross = False
+
+    def _start_seconds(self, ts: str) -> float:
+        """Wall clock seconds since the epoch at which a reading starts."""
+        hour_start = self._hour_starts.get(ts[:13])
+        if hour_start is None:
+            try:
+                hour_start = (datetime.fromisoformat(ts[:13] + ":00:00") - EPOCH).total_seconds()
+            except ValueError:
+                return _wall_seconds(ts)
+            if len(self._hour_starts) > 1 << 16:
+                self._hour_starts.clear()
+            self._hour_starts[ts[:13]] = hour_start
+        into_hour = _SECONDS_INTO_HOUR.get(ts[14:19])
+        if into_hour is None:
+            return _wall_seconds(ts)
+        return hour_start + into_hour
+
+    def _check(self, meter: Optional[str], ts: str, duration: float) -> None:
+        start = self._start_seconds(ts)
+        previous = self._meters.get(meter)
+        self._meters[meter] = (start, start + duration)
+        if previous is None or start < previous[0]:
+            return
+        delta = start - previous[1]
+        if delta > CONTINUITY_TOLERANCE:
+            self.gaps += 1
+            if self.policy == "reject":
+                raise UsageDataError(f"Gap in readings before {ts}")
+        elif delta < -CONTINUITY_TOLERANCE:
+            self.overlaps += 1
+            if self.policy == "reject":
+                raise UsageDataError(f"Overlapping readings at {ts}")
+
+    def feed(self, batch: UsageBatch) -> None:
+        """Add a batch of readings."""
+        n = len(batch)
+        self._with_gross = batch.gross is not None
+        if not n:
+            return
+        self.rows += n
+        keys = list(map(_HOUR_PREFIX, batch.timestamps))
+        if " " in "".join(keys):
+            # "2023-01-01 05" and "2023-01-01T05" are the same hour
+            keys = [key[:10] + "T" + key[11:] if len(key) > 10 else key for key in keys]
+        meters = batch.meters
+        durations = batch.durations if self.policy != "ignore" else None
+        # first row of every run of readings sharing hour and meter
+        changed = map(ne, keys, keys[1:])
+        if meters is not None:
+            changed = map(or_, changed, map(ne, meters, meters[1:]))
+        firsts = [0, *compress(counter(1), changed)]
+
+        hours = self._hours
+        gross = batch.gross
+        for first, last in zip(firsts, firsts[1:] + [n]):
+            key = keys[first]
+            if durations is not None:
+                meter = meters[first] if meters is not None else None
+                self._check(meter, batch.timestamps[first], sum(durations[first:last]))
+            bucket = hours.get(key)
+            if bucket is None:
+                if key < self._last_key:
+                    self.in_order = False
+                self._last_key = key
+                if len(hours) >= self.max_hours:
+                    self._spill()
+                    hours = self._hours
+                bucket = hours[key] = [batch.timestamps[first], batch.months[first], batch.hours[first], 0.0, 0.0, 0.0]
+            elif key != self._last_key:
+                self.in_order = False
+            bucket[3] += _charged_sum(batch.consumption[first:last])
+            if gross is not None:
+                bucket[4] += _charged_sum(gross[first:last])
+                bucket[5] += sum(batch.generation[first:last])
+
+    def _spill(self) -> None:
+        """Write the hours held in memory to a temporary file as one sorted run."""
+        run = tempfile.TemporaryFile()
+        items = sorted(self._hours.items())
+        for start in range(0, len(items), OUTPUT_BATCH_HOURS):
+            pickle.dump(items[start:start + OUTPUT_BATCH_HOURS], run, pickle.HIGHEST_PROTOCOL)
+        run.seek(0)
+        self._runs.append(run)
+        self._hours = {}
+        self._last_key = ""
+        self.in_order = False
+        self.spills += 1
+
+    def finish(self) -> Iterator[UsageBatch]:
+        """Yield the merged hours in time order."""
+        if self._runs:
+            merged = _merge_hours([_read_run(run) for run in self._runs] + [iter(sorted(self._hours.items()))])
+        elif self.in_order:
+            merged = iter(self._hours.items())
+        else:
+            merged = iter(sorted(self._hours.items()))
+        self._hours = {}
+        try:
+            out = self._new_batch()
+            for _, bucket in merged:
+                out.timestamps.append(bucket[0])
+                out.months.append(bucket[1])
+                out.hours.append(bucket[2])
+                out.consumption.append(bucket[3])
+                if out.gross is not None:
+                    out.gross.append(bucket[4])
+                    out.generation.append(bucket[5])
+                self.buckets += 1
+                if len(out) >= OUTPUT_BATCH_HOURS:
+                    yield out
+                    out = self._new_batch()
+            if len(out):
+                yield out
+        finally:
+            for run in self._runs:
+                run.close()
+            self._runs = []
+
+    def _new_batch(self) -> UsageBatch:
+        if self._with_gross:
+            return UsageBatch([], [], [], [], [], generation=[])
+        return UsageBatch([], [], [], [])
+
+
+def _read_run(run) -> Iterator[Tuple[str, List[Any]]]:
+    while True:
+        try:
+            items = pickle.load(run)
+        except EOFError:
+            return
+        yield from items
+
+
+def _merge_hours(runs: List[Iterator[Tuple[str, List[Any]]]]) -> Iterator[Tuple[str, List[Any]]]:
+    """Merge sorted runs of hours, summing an hour that was spilled more than once."""
+    for key, group in groupby(heapq.merge(*runs, key=itemgetter(0)), key=itemgetter(0)):
+        _, bucket = next(group)
+        for _, other in group:
+            bucket[3] += other[3]
+            bucket[4] += other[4]
+            bucket[5] += other[5]
+        yield key, bucket
+
+
+def iter_hourly_batches(
+    file_obj, consider_generation: bool, chunk_size: int = CHUNK_SIZE, keep_gross: bool = False
+) -> Iterator[UsageBatch]:
+    """Parse an upload and merge readings per clock hour, in time order, before charging.
+
+    Rows may come in any order and from several meters. Gaps and overlaps
+    between readings are handled per USAGE_GAP_POLICY.
+    """
+    return aggregate_hourly(iter_usage_batches(file_obj, consider_generation, chunk_size, keep_gross))
+
+
+def aggregate_hourly(batches: Iterator[UsageBatch]) -> Iterator[UsageBatch]:
+    """iter_hourly_batches for batches already parsed, e.g. filtered by the caller."""
+    if not HOURLY_AGGREGATION:
+        rows = 0
+        for batch in batches:
+            rows += len(batch)
+            yield batch
+        count("rows", rows)
+        return
+
+    aggregator = HourlyAggregator(USAGE_GAP_POLICY, USAGE_SORT_BUFFER_HOURS)
+    for batch in batches:
+        aggregator.feed(batch)
+    yield from aggregator.finish()
+    count("rows", aggregator.rows)
+    count("hourly_rows", aggregator.buckets)
+    if aggregator.spills:
+        count("spills", aggregator.spills)
+    if aggregator.gaps or aggregator.overlaps:
+        count("gaps", aggregator.gaps)
+        count("overlaps", aggregator.overlaps)
+        logger.warning(
+            "Usage upload has %d gaps and %d overlaps between readings",
+            aggregator.gaps,
+            aggregator.overlaps,
+        )
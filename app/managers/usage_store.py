@@ -0,0 +1,147 @@
+import json
+import sqlite3
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS customers (
+    customer_id TEXT NOT NULL,
+    consider_generation INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL,
+    last_timestamp TEXT,
+    open_state TEXT,
+    PRIMARY KEY (customer_id, consider_generation)
+);
+CREATE TABLE IF NOT EXISTS months (
+    customer_id TEXT NOT NULL,
+    consider_generation INTEGER NOT NULL,
+    month TEXT NOT NULL,
+    plans TEXT NOT NULL,
+    PRIMARY KEY (customer_id, consider_generation, month)
+);
+"""
+
+
+class StoredUsage:
+    """Everything kept for one customer and generation setting."""
+
+    def __init__(
+        self,
+        months: Dict[str, Dict[str, Any]],
+        last_timestamp: Optional[str],
+        open_state: Optional[Dict[str, Any]],
+    ):
+        # month -> plan -> {"cost", "usage", "breakdown"}
+        self.months = months
+        self.last_timestamp = last_timestamp
+        self.open_state = open_state
+
+
+class UsageStore:
+    """SQLite store of finalized monthly plan results per customer.
+
+    The month that was still open at the end of the last upload is kept as
+    accumulator state so the next upload can continue it. Rows are tied to
+    the tariff fingerprint they were computed with and dropped when it changes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Open a connection and run the block in one transaction."""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def transaction(self) -> Iterator["UsageTransaction"]:
+        """Run a load and the save that follows it under the database write lock.
+
+        BEGIN IMMEDIATE takes the lock up front, so two uploads for the same
+        customer cannot both read the old history and overwrite each other.
+        """
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            yield UsageTransaction(conn)
+
+    def load(self, customer_id: str, consider_generation: bool, fingerprint: str) -> Optional[StoredUsage]:
+        with self.transaction() as tx:
+            return tx.load(customer_id, consider_generation, fingerprint)
+
+    def save(
+        self,
+        customer_id: str,
+        consider_generation: bool,
+        fingerprint: str,
+        finalized: Dict[str, Dict[str, Any]],
+        last_timestamp: Optional[str],
+        open_state: Optional[Dict[str, Any]],
+    ) -> None:
+        with self.transaction() as tx:
+            tx.save(customer_id, consider_generation, fingerprint, finalized, last_timestamp, open_state)
+
+    def delete(self, customer_id: str) -> None:
+        with self._connect() as conn:
+            for flag in (0, 1):
+                _delete(conn, (customer_id, flag))
+
+
+class UsageTransaction:
+    """Loads and saves customer rows on a connection that holds the write lock."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def load(self, customer_id: str, consider_generation: bool, fingerprint: str) -> Optional[StoredUsage]:
+        key = (customer_id, int(consider_generation))
+        row = self.conn.execute(
+            "SELECT fingerprint, last_timestamp, open_state FROM customers "
+            "WHERE customer_id = ? AND consider_generation = ?",
+            key,
+        ).fetchone()
+        if row is None:
+            return None
+        if row[0] != fingerprint:
+            _delete(self.conn, key)
+            return None
+        months = {
+            month: json.loads(plans)
+            for month, plans in self.conn.execute(
+                "SELECT month, plans FROM months WHERE customer_id = ? AND consider_generation = ? "
+                "ORDER BY month",
+                key,
+            )
+        }
+        return StoredUsage(months, row[1], json.loads(row[2]) if row[2] else None)
+
+    def save(
+        self,
+        customer_id: str,
+        consider_generation: bool,
+        fingerprint: str,
+        finalized: Dict[str, Dict[str, Any]],
+        last_timestamp: Optional[str],
+        open_state: Optional[Dict[str, Any]],
+    ) -> None:
+        key = (customer_id, int(consider_generation))
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO months VALUES (?, ?, ?, ?)",
+            [(*key, month, json.dumps(plans)) for month, plans in finalized.items()],
+        )
+        self.conn.execute(
+            "INSERT OR REPLACE INTO customers VALUES (?, ?, ?, ?, ?)",
+            (*key, fingerprint, last_timestamp, json.dumps(open_state) if open_state else None),
+        )
+
+
+def _delete(conn: sqlite3.Connection, key) -> None:
+    conn.execute("DELETE FROM months WHERE customer_id = ? AND consider_generation = ?", key)
+    conn.execute("DELETE FROM customers WHERE customer_id = ? AND consider_generation = ?", key)
@@ -0,0 +1,258 @@
+from itertools import groupby
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.configs.tariffs import CompiledPlan
+from app.managers.instrumentation import count, stage
+from app.managers.metrics_table import MetricsTable, component_layout
+from app.managers.usage_parser import UsageBatch, UsageDataError, iter_hourly_batches
+
+
+class UsageColumns:
+    """Columnar view of an upload: one entry per row plus the month run it belongs to."""
+
+    __slots__ = ("months", "run_ids", "hours", "consumption", "gross")
+
+    def __init__(
+        self,
+        months: List[str],
+        run_ids: np.ndarray,
+        hours: np.ndarray,
+        consumption: np.ndarray,
+        gross: Optional[np.ndarray] = None,
+    ):
+        self.months = months
+        self.run_ids = run_ids
+        self.hours = hours
+        self.consumption = consumption
+        self.gross = gross
+
+    def with_consumption(self, consumption: np.ndarray) -> "UsageColumns":
+        """Return the same rows with another consumption column."""
+        return UsageColumns(self.months, self.run_ids, self.hours, consumption)
+
+    def select_runs(self, start: int, stop: int) -> "UsageColumns":
+        """The rows of runs start to stop, with runs numbered from 0."""
+        first, last = np.searchsorted(self.run_ids, [start, stop])
+        return UsageColumns(
+            self.months[start:stop],
+            self.run_ids[first:last] - start,
+            self.hours[first:last],
+            self.consumption[first:last],
+        )
+
+    def rows(self) -> Iterable[Tuple[str, int, float]]:
+        """Yield (month, hour, consumption_kwh) per row, as UsageBatch.rows does."""
+        months = (self.months[run] for run in self.run_ids.tolist())
+        return zip(months, self.hours.tolist(), self.consumption.tolist())
+
+
+def load_columns(file_obj, consider_generation: bool, keep_gross: bool = False) -> UsageColumns:
+    """Parse an upload into columns, numbering consecutive months as runs."""
+    batches = iter_hourly_batches(file_obj, consider_generation, keep_gross=keep_gross)
+    return columns_from_batches(batches, keep_gross)
+
+
+def columns_from_batches(batches: Iterable[UsageBatch], keep_gross: bool = False) -> UsageColumns:
+    """load_columns for batches already parsed and merged per hour."""
+    months: List[str] = []
+    run_lengths: List[int] = []
+    hours: List[np.ndarray] = []
+    consumption: List[np.ndarray] = []
+    gross: List[np.ndarray] = []
+    for batch in batches:
+        for month, run in groupby(batch.months):
+            count = sum(1 for _ in run)
+            if months and months[-1] == month:
+                run_lengths[-1] += count
+            elif month in months:
+                raise UsageDataError(f"Usage rows are not sorted by time, {month} appears twice")
+            else:
+                months.append(month)
+                run_lengths.append(count)
+        hours.append(np.asarray(batch.hours, dtype=np.int64))
+        consumption.append(np.asarray(batch.consumption, dtype=np.float64))
+        if keep_gross:
+            gross.append(np.asarray(batch.gross, dtype=np.float64))
+
+    return UsageColumns(
+        months,
+        np.repeat(np.arange(len(months), dtype=np.int64), run_lengths),
+        np.concatenate(hours) if hours else np.zeros(0, dtype=np.int64),
+        np.concatenate(consumption) if consumption else np.zeros(0),
+        (np.concatenate(gross) if gross else np.zeros(0)) if keep_gross else None,
+    )
+
+
+def plan_segments(plan: CompiledPlan) -> Tuple[np.ndarray, ...]:
+    """Return (lo, hi, rate, component, covered) usage segments per hour.
+
+    Segment s of hour h bills usage in [lo[h, s], hi[h, s]) at rate[h, s].
+    Usage below the lowest threshold is billed by the highest tier, matching
+    select_config. Unused slots are empty ranges. The arrays are kept on the
+    plan, so they go away with its catalog.
+    """
+    if plan.segments is None:
+        plan.segments = build_segments(plan)
+    return plan.segments
+
+
+def build_segments(plan: CompiledPlan) -> Tuple[np.ndarray, ...]:
+    width = max(1, max(len(t) + (1 if t and t[0][0] > 0 else 0) for t in plan.hours))
+    lo = np.zeros((24, width))
+    hi = np.zeros((24, width))
+    rate = np.zeros((24, width))
+    component = np.zeros((24, width), dtype=np.int64)
+    covered = np.zeros(24, dtype=bool)
+    for hour, tiers in enumerate(plan.hours):
+        if not tiers:
+            continue
+        covered[hour] = True
+        segments = []
+        if tiers[0][0] > 0:
+            segments.append((-np.inf, tiers[0][0], tiers[-1][1], tiers[-1][2]))
+        for i, (threshold, cost, cid) in enumerate(tiers):
+            upper = tiers[i + 1][0] if i + 1 < len(tiers) else np.inf
+            segments.append((threshold, upper, cost, cid))
+        for s, (seg_lo, seg_hi, seg_rate, cid) in enumerate(segments):
+            lo[hour, s] = seg_lo
+            hi[hour, s] = seg_hi
+            rate[hour, s] = seg_rate
+            component[hour, s] = cid
+    return lo, hi, rate, component, covered
+
+
+def cumulative_usage(columns: UsageColumns) -> Tuple[np.ndarray, np.ndarray]:
+    """Return month-to-date usage before and after every row."""
+    cons = np.maximum(columns.consumption, 0.0)
+    after = np.empty_like(cons)
+    starts = np.searchsorted(columns.run_ids, np.arange(len(columns.months) + 1))
+    for run in range(len(columns.months)):
+        np.cumsum(cons[starts[run]:starts[run + 1]], out=after[starts[run]:starts[run + 1]])
+    return after - cons, after
+
+
+def price_plan(
+    plan: CompiledPlan,
+    columns: UsageColumns,
+    before: np.ndarray,
+    after: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Return per-run (usage, cost) matrices of shape (runs, components)."""
+    lo, hi, rate, component, covered = plan_segments(plan)
+    hours = columns.hours
+    n_runs = len(columns.months)
+    n_comp = max(1, len(plan.keys))
+    if not covered[hours][after > before].all():
+        raise ValueError("No tariff config applies to hour")
+
+    overlap = np.minimum(after[:, None], hi[hours]) - np.maximum(before[:, None], lo[hours])
+    np.maximum(overlap, 0.0, out=overlap)
+    bins = (columns.run_ids[:, None] * n_comp + component[hours]).ravel()
+    usage = np.bincount(bins, weights=overlap.ravel(), minlength=n_runs * n_comp)
+    cost = np.bincount(bins, weights=(overlap * rate[hours]).ravel(), minlength=n_runs * n_comp)
+    return usage.reshape(n_runs, n_comp), cost.reshape(n_runs, n_comp)
+
+
+def calculate_usage_table_vectorized(
+    file_obj, consider_generation: bool, plans: List[CompiledPlan]
+) -> MetricsTable:
+    """Vectorized equivalent of calculate_usage_table."""
+    with stage("parse"):
+        columns = load_columns(file_obj, consider_generation)
+    with stage("charge"):
+        table = table_from_columns(columns, plans)
+    count("months", len(table.months))
+    count("plans", len(plans))
+    return table
+
+
+def calculate_usage_metrics_vectorized(
+    file_obj, consider_generation: bool, plans: List[CompiledPlan]
+) -> Tuple[Dict[str, Any], List[str]]:
+    """Vectorized equivalent of calculate_usage_metrics."""
+    table = calculate_usage_table_vectorized(file_obj, consider_generation, plans)
+    return table.to_metrics(), table.months
+
+
+def calculate_usage_table_variants_vectorized(
+    file_obj, plans: List[CompiledPlan]
+) -> Dict[bool, MetricsTable]:
+    """Vectorized equivalent of calculate_usage_table_variants."""
+    columns = load_columns(file_obj, True, keep_gross=True)
+    return {
+        True: table_from_columns(columns, plans),
+        False: table_from_columns(columns.with_consumption(columns.gross), plans),
+    }
+
+
+def charge_accumulator(accumulator: Any, batches: Iterable[UsageBatch]) -> None:
+    """Charge batches to a MetricsAccumulator, pricing whole months as one vectorized table.
+
+    The accumulator's open month and the last month of the input are charged
+    row by row, so the accumulator can continue and snapshot them as usual.
+    """
+    with stage("parse"):
+        columns = columns_from_batches(batches)
+    n_runs = len(columns.months)
+    first = 1 if n_runs and columns.months[0] == accumulator.current_month else 0
+    last = max(first, n_runs - 1)
+    with stage("charge"):
+        accumulator.add_rows(columns.select_runs(0, first).rows())
+        if last > first:
+            accumulator.add_table(table_from_columns(columns.select_runs(first, last), accumulator.plan_list))
+        accumulator.add_rows(columns.select_runs(last, n_runs).rows())
+
+
+def table_from_columns(columns: UsageColumns, plans: List[CompiledPlan]) -> MetricsTable:
+    """Price every plan over parsed columns, one table row per run.
+
+    Order independent plans are priced from per-month hour-of-day sums; only
+    sequential plans go through the per-row segment overlap.
+    """
+    from app.managers.tariff_manager import charge_histogram
+
+    n_runs = len(columns.months)
+    offsets, keys, descriptions = component_layout(plans)
+    usage = np.zeros((n_runs, len(keys)))
+    cost = np.zeros((n_runs, len(keys)))
+    plan_usage = np.zeros((n_runs, len(plans)))
+    plan_cost = np.zeros((n_runs, len(plans)))
+
+    before, after = cumulative_usage(columns)
+    run_usage = np.bincount(columns.run_ids, weights=after - before, minlength=n_runs)
+    hist = np.bincount(
+        columns.run_ids * 24 + columns.hours, weights=after - before, minlength=n_runs * 24
+    ).reshape(n_runs, 24).tolist()
+
+    for p, plan in enumerate(plans):
+        components = slice(offsets[p], offsets[p + 1])
+        if plan.pricing == "sequential":
+            usage[:, components], cost[:, components] = price_plan(plan, columns, before, after)
+            plan_usage[:, p] = run_usage
+            plan_cost[:, p] = cost[:, components].sum(axis=1) + plan.base_fee
+            continue
+        width = offsets[p + 1] - offsets[p]
+        for run in range(n_runs):
+            run_usage_by_component = [0.0] * width
+            run_cost_by_component = [0.0] * width
+            month_usage, month_cost = charge_histogram(
+                hist[run], plan, run_usage_by_component, run_cost_by_component
+            )
+            usage[run, components] = run_usage_by_component
+            cost[run, components] = run_cost_by_component
+            plan_usage[run, p] = month_usage
+            plan_cost[run, p] = month_cost + plan.base_fee
+    return MetricsTable(
+        [p.name for p in plans], offsets, keys, descriptions, list(columns.months),
+        usage, cost, plan_usage, plan_cost,
+    )
+
+
+def metrics_from_columns(
+    columns: UsageColumns, plans: List[CompiledPlan]
+) -> Tuple[Dict[str, Any], List[str]]:
+    """Price every plan over parsed columns and build the public metrics shape."""
+    table = table_from_columns(columns, plans)
+    return table.to_metrics(), table.months
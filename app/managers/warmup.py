@@ -0,0 +1,51 @@
+import time
+from typing import Awaitable, Callable, Dict, List
+
+from app.configs.tariffs import TARIFF_REGISTRY
+from app.managers.instrumentation import METRICS
+from app.managers.llm_client import LLM_CLIENT
+from app.managers.tariff_manager import explain_system_prompt, worker_ready
+from app.managers.worker_pool import WORKER_POOL
+
+
+async def warm_tariffs() -> None:
+    """Load, validate and compile the tariff catalog."""
+    TARIFF_REGISTRY.current()
+
+
+async def warm_pool() -> None:
+    """Start the worker processes and load the tariff catalog in them."""
+    await WORKER_POOL.warm_up(worker_ready, TARIFF_REGISTRY.current().version)
+
+
+async def warm_llm() -> None:
+    """Import the OpenAI SDK, create the client and build the /explain system prompt."""
+    LLM_CLIENT.client
+    explain_system_prompt(TARIFF_REGISTRY.current())
+
+
+WARMUP_STEPS: Dict[str, Callable[[], Awaitable[None]]] = {
+    "tariffs": warm_tariffs,
+    "pool": warm_pool,
+    "llm": warm_llm,
+}
+
+
+def parse_steps(value: str) -> List[str]:
+    """Split a STARTUP_WARMUP value, rejecting unknown steps."""
+    steps = [step.strip() for step in value.split(",") if step.strip()]
+    for step in steps:
+        if step not in WARMUP_STEPS:
+            raise ValueError(f"Unknown warm-up step {step}, expected some of {', '.join(WARMUP_STEPS)}")
+    return steps
+
+
+async def warm_up(steps: List[str]) -> Dict[str, float]:
+    """Run warm-up steps in order, recording how long each took as a startup metric."""
+    durations: Dict[str, float] = {}
+    for step in steps:
+        started = time.perf_counter()
+        await WARMUP_STEPS[step]()
+        durations[step] = time.perf_counter() - started
+        METRICS.record_startup(f"warmup_{step}", durations[step])
+    return durations
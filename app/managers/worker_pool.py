@@ -0,0 +1,167 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Optional
+
+from app.configs.settings import (
+    STREAM_BUFFER_CHUNKS,
+    STREAM_WORKERS,
+    WORKER_POOL_SIZE,
+    WORKER_QUEUE_SIZE,
+    WORKER_TIMEOUT,
+)
+from app.managers.instrumentation import current_timings, run_instrumented, stage
+from app.managers.upload_stream import ChunkChannel
+
+
+class PoolSaturatedError(Exception):
+    """Raised when the worker pool already has its maximum number of jobs."""
+
+
+class WorkerPool:
+    """Bounded executor for CPU-bound jobs submitted from the event loop.
+
+    Jobs run in a process pool so they neither block the event loop nor
+    contend for the GIL. At most ``max_pending`` jobs are queued or running;
+    further submissions fail fast with PoolSaturatedError. A job that exceeds
+    ``timeout`` raises TimeoutError to the caller, but keeps its slot until
+    the worker actually finishes so the bound reflects real load.
+    """
+
+    def __init__(self, workers: int, max_pending: int, timeout: float):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pending = 0
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.workers > 0:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=1)
+        return self._executor
+
+    def _release(self, future: "asyncio.Future[Any]") -> None:
+        self.pending -= 1
+        if not future.cancelled():
+            # mark the outcome retrieved when the caller already timed out
+            future.exception()
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run fn(*args) in the pool and return its result.
+
+        Inside an instrumented request the job's own stage timings are
+        collected in the worker and merged into the request's.
+        """
+        timings = current_timings()
+        if timings is None:
+            return await self._submit(fn, *args)
+        with stage("pool"):
+            result, stages, counts, samples = await self._submit(
+                run_instrumented, fn, args, timings.profile
+            )
+        timings.merge(stages, counts, samples)
+        return result
+
+    async def _submit(self, fn: Callable[..., Any], *args: Any) -> Any:
+        if self.pending >= self.max_pending:
+            raise PoolSaturatedError("Worker pool is saturated")
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._get_executor(), fn, *args)
+        self.pending += 1
+        future.add_done_callback(self._release)
+        return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+
+    async def warm_up(self, fn: Callable[..., Any], *args: Any) -> None:
+        """Start the pool by running fn(*args) once per worker, so the first request does not pay for it.
+
+        The jobs skip the pending limit, which may be smaller than the pool.
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        jobs = [loop.run_in_executor(executor, fn, *args) for _ in range(max(1, self.workers))]
+        await asyncio.wait_for(asyncio.gather(*jobs), self.timeout)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class StreamRunner:
+    """Runs jobs that consume an upload while the request body is still arriving.
+
+    Each job gets a thread of its own and reads the body from a bounded
+    ChunkChannel, so receiving and parsing overlap without holding the
+    whole upload. Streams have to run in this process, not in the worker
+    pool, so their parsing competes with the event loop for the GIL; that
+    is why STREAM_WORKERS defaults to 1. At most ``workers`` jobs run at
+    once; further submissions fail fast with PoolSaturatedError.
+    ``timeout`` counts from the end of the upload, so slow clients are not
+    cut off.
+    """
+
+    def __init__(self, workers: int, buffer_chunks: int, timeout: float):
+        self.workers = workers
+        self.buffer_chunks = buffer_chunks
+        self.timeout = timeout
+        self.active = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _release(self, future: "asyncio.Future[Any]") -> None:
+        self.active -= 1
+        if not future.cancelled():
+            future.exception()
+
+    async def run(self, chunks: AsyncIterator[bytes], fn: Callable[..., Any], *args: Any) -> Any:
+        """Run fn(channel, *args) in a thread while feeding it chunks, and return its result."""
+        if self.active >= self.workers:
+            raise PoolSaturatedError("Too many streamed uploads in progress")
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="stream")
+        loop = asyncio.get_running_loop()
+        channel = ChunkChannel(loop, self.buffer_chunks)
+        timings = current_timings()
+        profile = timings.profile if timings is not None else None
+        job = loop.run_in_executor(self._executor, _consume, fn, channel, args, profile)
+        self.active += 1
+        job.add_done_callback(self._release)
+        with stage("stream"):
+            try:
+                async for chunk in chunks:
+                    if not await channel.put(chunk):
+                        # the job stopped reading, its error is raised below
+                        break
+            except BaseException as e:
+                channel.close(e)
+                raise
+            channel.close()
+            result = await asyncio.wait_for(asyncio.shield(job), self.timeout)
+        if timings is None:
+            return result
+        result, stages, counts, samples = result
+        timings.merge(stages, counts, samples)
+        return result
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def _consume(fn: Callable[..., Any], channel: ChunkChannel, args: Any, profile: Optional[bool]) -> Any:
+    try:
+        if profile is None:
+            return fn(channel, *args)
+        return run_instrumented(fn, (channel, *args), profile)
+    finally:
+        channel.stop()
+
+
+WORKER_POOL = WorkerPool(WORKER_POOL_SIZE, WORKER_QUEUE_SIZE, WORKER_TIMEOUT)
+STREAM_RUNNER = StreamRunner(STREAM_WORKERS, STREAM_BUFFER_CHUNKS, WORKER_TIMEOUT)
@@ -0,0 +1,89 @@
+import random
+
+import pytest
+
+from app.configs.tariffs import compile_tariffs
+from benchmarks.synthetic import synthetic_catalog
+
+CSV_HEADER = "datetime,duration,unit,consumption,generation\n"
+
+# one plan of every pricing kind: flat, time of use, tiered and tiered per hour
+MIXED_PLANS = [
+    {"name": "Flat", "baseFee": 3, "hourlyConfigs": [{"cost": 14}]},
+    {
+        "name": "Night",
+        "baseFee": 5,
+        "hourlyConfigs": [
+            {"startHour": 0, "endHour": 6, "cost": 5},
+            {"startHour": 6, "endHour": 24, "cost": 20},
+        ],
+    },
+    {
+        "name": "Tiered",
+        "hourlyConfigs": [{"cost": 10}, {"billedAfterUsage": 40, "cost": 15}],
+    },
+    {
+        "name": "Mixed",
+        "baseFee": 2,
+        "hourlyConfigs": [
+            {"startHour": 0, "endHour": 7, "billedAfterUsage": 30, "cost": 4},
+            {"cost": 12},
+            {"billedAfterUsage": 25, "cost": 18},
+            {"startHour": 17, "endHour": 21, "billedAfterUsage": 60, "cost": 30},
+        ],
+    },
+]
+
+# thresholds low enough to be crossed within a day of readings
+TIERED_PLANS = [
+    {"name": "Tiered", "hourlyConfigs": [{"cost": 10}, {"billedAfterUsage": 3.3, "cost": 15}]},
+    {
+        "name": "Peak",
+        "baseFee": 2,
+        "hourlyConfigs": [{"cost": 12}, {"startHour": 17, "endHour": 21, "billedAfterUsage": 1.7, "cost": 30}],
+    },
+]
+
+
+def make_random_csv(seed: int, rows: int = 600) -> str:
+    """Readings at random hours through 2023, mixing kWh and Wh."""
+    rng = random.Random(seed)
+    lines = [CSV_HEADER]
+    for i in range(rows):
+        month = 1 + i * 12 // rows
+        day = 1 + (i % 28)
+        hour = rng.randrange(24)
+        unit = rng.choice(["kWh", "Wh"])
+        scale = 1000 if unit == "Wh" else 1
+        cons = round(rng.uniform(0, 3), 3) * scale
+        gen = round(rng.uniform(0, 1), 3) * scale
+        lines.append(f"2023-{month:02d}-{day:02d}T{hour:02d}:00:00,3600,{unit},{cons},{gen}\n")
+    return "".join(lines)
+
+
+def make_market_catalog(seed: int, size: int = 120):
+    """A synthetic catalog plus repackaged offers: the same configs under another name and fee."""
+    plans = synthetic_catalog(size, seed)
+    for i in range(0, size, 5):
+        plans.append(dict(plans[i], name=f"{plans[i]['name']} bis", baseFee=plans[i]["baseFee"] + 1))
+    return compile_tariffs(plans)
+
+
+@pytest.fixture
+def mixed_plans():
+    return compile_tariffs(MIXED_PLANS)
+
+
+@pytest.fixture
+def tiered_plans():
+    return [dict(plan) for plan in TIERED_PLANS]
+
+
+@pytest.fixture
+def random_csv():
+    return make_random_csv
+
+
+@pytest.fixture
+def market_catalog():
+    return make_market_catalog
@@ -0,0 +1,60 @@
+import asyncio
+import json
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+class FakeOpenAI:
+    """Minimal OpenAI compatible chat completions server for tests.
+
+    Run it standalone with ``uvicorn app.tests.fake_openai:app --port 9000``
+    and point the service at it with ``OPENAI_BASE_URL=http://localhost:9000/v1``.
+    """
+
+    def __init__(self, reply: str = "Explanation of the recommended plan.", delay: float = 0.0):
+        self.reply = reply
+        self.delay = delay
+        self.failures = 0
+        self.calls = 0
+        self.app = FastAPI()
+        self.app.post("/v1/chat/completions")(self.completions)
+
+    async def completions(self, request: Request):
+        body = await request.json()
+        self.calls += 1
+        if self.failures:
+            self.failures -= 1
+            return JSONResponse({"error": {"message": "overloaded"}}, status_code=503)
+        await asyncio.sleep(self.delay)
+        words = [w + " " for w in self.reply.split(" ")]
+        words[-1] = words[-1].rstrip()
+        if not body.get("stream"):
+            return JSONResponse({
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": 0,
+                "model": body["model"],
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(words)},
+                    "finish_reason": "stop",
+                }],
+            })
+
+        async def events():
+            for word in words:
+                chunk = {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion.chunk",
+                    "created": 0,
+                    "model": body["model"],
+                    "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+
+app = FakeOpenAI().app
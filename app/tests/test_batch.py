@@ -0,0 +1,81 @@
+import gzip
+import json
+
+import pytest
+
+from app.batch import main
+from app.tests.conftest import CSV_HEADER
+
+
+def write_usage(directory, count):
+    for i in range(count):
+        rows = "".join(
+            f"2023-{month:02d}-01T{(i * 5) % 24:02d}:00:00,3600,kWh,{i + 1},0\n" for month in (1, 2)
+        )
+        (directory / f"customer{i}.csv").write_text(CSV_HEADER + rows)
+
+
+def read_results(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_batch_scores_directory(tmp_path, workers):
+    write_usage(tmp_path, 4)
+    output = tmp_path / "out.jsonl"
+    assert main([str(tmp_path), "-o", str(output), "-w", str(workers), "--no-switching"]) == 0
+    results = read_results(output)
+    assert sorted(r["id"] for r in results) == [f"customer{i}.csv" for i in range(4)]
+    assert all(r["rows"] == 2 and "plan" in r["result"] for r in results)
+    assert all("metrics" not in r["result"] for r in results)
+
+
+def test_batch_resumes_from_output(tmp_path):
+    write_usage(tmp_path, 3)
+    output = tmp_path / "out.jsonl"
+    first = {"id": "customer0.csv", "path": "x", "rows": 0, "result": {}}
+    output.write_text(json.dumps(first) + "\n" + '{"id": "customer1.cs')
+    main([str(tmp_path), "-o", str(output), "-w", "0"])
+    results = read_results(output)
+    assert results[0] == first
+    assert sorted(r["id"] for r in results[1:]) == ["customer1.csv", "customer2.csv"]
+
+
+def test_batch_manifest_with_overrides(tmp_path):
+    write_usage(tmp_path, 2)
+    manifest = tmp_path / "manifest.jsonl"
+    manifest.write_text(
+        json.dumps({"id": "a", "path": "customer0.csv", "mode": "projected"}) + "\n"
+        + json.dumps({"id": "b", "path": "missing.csv"}) + "\n"
+    )
+    output = tmp_path / "out.jsonl"
+    assert main([str(manifest), "-o", str(output), "-w", "0"]) == 1
+    results = {r["id"]: r for r in read_results(output)}
+    assert set(results["a"]["result"]["months"]) == {"01", "02"}
+    assert "error" in results["b"]
+
+
+def test_batch_retries_failed_files_on_resume(tmp_path):
+    write_usage(tmp_path, 2)
+    output = tmp_path / "out.jsonl"
+    failed = {"id": "customer1.csv", "path": "x", "error": "Worker crashed"}
+    output.write_text(json.dumps(failed) + "\n")
+    assert main([str(tmp_path), "-o", str(output), "-w", "0"]) == 0
+    results = read_results(output)
+    assert results[0] == failed
+    assert sorted(r["id"] for r in results[1:]) == ["customer0.csv", "customer1.csv"]
+    assert all("result" in r for r in results[1:])
+
+
+def test_batch_counts_readings_of_compressed_files(tmp_path):
+    write_usage(tmp_path, 2)
+    plain = tmp_path / "customer1.csv"
+    (tmp_path / "customer1.csv.gz").write_bytes(gzip.compress(plain.read_bytes()))
+    plain.unlink()
+    (tmp_path / "notes.txt").write_text("not usage data")
+    output = tmp_path / "out.jsonl"
+    assert main([str(tmp_path), "-o", str(output), "-w", "0"]) == 0
+    results = {r["id"]: r for r in read_results(output)}
+    assert set(results) == {"customer0.csv", "customer1.csv.gz"}
+    assert results["customer1.csv.gz"]["rows"] == results["customer0.csv"]["rows"] == 2
+    assert set(results["customer1.csv.gz"]["result"]["months"]) == {"2023-01", "2023-02"}
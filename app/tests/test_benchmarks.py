@@ -0,0 +1,36 @@
+import io
+
+from app.configs.tariffs import compile_tariffs, validate_tariffs
+from app.managers.tariff_manager import calculate_usage_metrics
+from benchmarks.run import compare, percentile
+from benchmarks.synthetic import synthetic_catalog, usage_csv
+
+
+def test_generator_covers_requested_period():
+    data = usage_csv(years=7 / 365, interval_minutes=15, seed=1)
+    lines = data.splitlines()
+    assert lines[0] == "datetime,duration,unit,consumption,generation"
+    assert len(lines) - 1 == 7 * 24 * 4
+    assert lines[1].startswith("2023-01-01T00:00:00,900,")
+    assert {line.split(",")[2] for line in lines[1:]} == {"kWh", "Wh"}
+    assert any(float(line.split(",")[4]) > 0 for line in lines[1:])
+
+
+def test_synthetic_catalog_prices_generated_usage():
+    catalog = synthetic_catalog(12, seed=2)
+    assert validate_tariffs(catalog) is catalog
+    data = usage_csv(years=60 / 365, interval_minutes=60, seed=2, wh_share=0)
+    metrics, months = calculate_usage_metrics(io.StringIO(data), True, "python", compile_tariffs(catalog))
+    assert months == ["2023-01", "2023-02", "2023-03"]
+    assert all(plan["total_cost"] > 0 for plan in metrics.values())
+
+
+def test_compare_flags_slowdowns_over_threshold():
+    baseline = {"benchmarks": {"a": {"p50": 1.0}, "b": {"p50": 1.0}, "gone": {"p50": 1.0}}}
+    results = {"benchmarks": {"a": {"p50": 1.2}, "b": {"p50": 1.3}, "new": {"p50": 9.0}}}
+    regressions = compare(results, baseline, 0.25)
+    assert len(regressions) == 1 and regressions[0].startswith("b:")
+    tiny = {"benchmarks": {"a": {"p50": 0.0001}}}
+    assert compare({"benchmarks": {"a": {"p50": 0.0003}}}, tiny, 0.25) == []
+    assert percentile([3, 1, 2, 4], 50) == 2
+    assert percentile([3, 1, 2, 4], 99) == 4
@@ -0,0 +1,129 @@
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.main as main
+from app.controllers import admin
+from app.managers import instrumentation, tariff_manager, warmup
+from app.managers.instrumentation import collect_timings, count, current_timings, stage
+from app.managers.result_cache import MetricsCache
+from app.managers.worker_pool import WorkerPool
+
+CSV = (
+    "datetime,duration,unit,consumption,generation\n"
+    "2023-01-01T01:00:00,3600,kWh,1,0\n"
+    "2023-02-01T18:00:00,3600,kWh,2,0\n"
+)
+
+
+@pytest.fixture(autouse=True)
+def in_thread_pool(monkeypatch):
+    monkeypatch.setattr(tariff_manager, "METRICS_CACHE", MetricsCache(max_bytes=0))
+    monkeypatch.setattr(tariff_manager, "WORKER_POOL", WorkerPool(workers=0, max_pending=4, timeout=10))
+
+
+def server_timing(response):
+    entries = [part.strip().split(";dur=") for part in response.headers["Server-Timing"].split(",")]
+    return {name: float(value) for name, value in entries}
+
+
+def test_stages_are_noops_outside_requests():
+    assert current_timings() is None
+    with stage("parse"):
+        count("rows", 10)
+    with collect_timings() as timings:
+        with stage("parse"):
+            count("rows", 10)
+    assert set(timings.stages) == {"parse"} and timings.counts == {"rows": 10}
+
+
+def test_recommend_reports_stages():
+    client = TestClient(main.app)
+    response = client.post("/recommend", files={"usageData": ("u.csv", CSV, "text/csv")})
+    assert response.status_code == 200
+    stages = server_timing(response)
+    for name in ("upload", "cache", "pool", "parse", "charge", "finalize", "recommend", "serialize", "total"):
+        assert name in stages
+    assert stages["total"] >= stages["pool"]
+
+    text = client.get("/metrics").text
+    assert 'http_request_duration_seconds_count{route="/recommend"}' in text
+    assert 'stage_duration_seconds_bucket{stage="parse",le="+Inf"}' in text
+    assert 'stage_items_sum{item="rows"}' in text
+
+
+def test_profiling_is_opt_in(tmp_path, monkeypatch):
+    client = TestClient(main.app)
+    files = {"usageData": ("u.csv", CSV, "text/csv")}
+    assert "X-Profile" not in client.post("/v2/recommend", files=files, headers={"X-Profile": "1"}).headers
+
+    monkeypatch.setattr(main, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(instrumentation, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "PROFILE_INTERVAL", 0.001)
+    # profiling also needs the admin token
+    assert "X-Profile" not in client.post("/v2/recommend", files=files, headers={"X-Profile": "1"}).headers
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "secret")
+    response = client.post("/v2/recommend", files=files, headers={"X-Profile": "1", "X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert os.path.exists(tmp_path / response.headers["X-Profile"])
+
+
+def test_profiler_samples_only_its_own_thread():
+    stop = threading.Event()
+
+    def busy_elsewhere():
+        while not stop.is_set():
+            sum(range(1000))
+
+    other = threading.Thread(target=busy_elsewhere)
+    other.start()
+    try:
+        with instrumentation.SamplingProfiler(0.001) as profiler:
+            deadline = time.perf_counter() + 0.1
+            while time.perf_counter() < deadline:
+                sum(range(1000))
+    finally:
+        stop.set()
+        other.join()
+    assert profiler.samples
+    assert not any("busy_elsewhere" in stack for stack in profiler.samples)
+    assert all("test_profiler_samples_only_its_own_thread" in stack for stack in profiler.samples)
+
+
+def test_import_does_not_need_openai():
+    env = {k: v for k, v in os.environ.items() if k != "OPENAI_API_KEY"}
+    code = "import sys, app.main; assert 'openai' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], env=env, check=True)
+
+
+def test_first_response_is_recorded_without_timing():
+    env = dict(os.environ, TIMING_ENABLED="0")
+    code = (
+        "from fastapi.testclient import TestClient\n"
+        "from app.main import app\n"
+        "from app.managers.instrumentation import METRICS\n"
+        "response = TestClient(app).get('/cache/stats')\n"
+        "assert 'Server-Timing' not in response.headers\n"
+        "assert 'first_response' in METRICS.startup\n"
+    )
+    subprocess.run([sys.executable, "-c", code], env=env, check=True)
+
+
+def test_warm_up_records_startup_phases(monkeypatch):
+    monkeypatch.setattr(warmup, "WORKER_POOL", WorkerPool(workers=0, max_pending=4, timeout=10))
+    with pytest.raises(ValueError):
+        warmup.parse_steps("tariffs, gpu")
+    durations = asyncio.run(warmup.warm_up(warmup.parse_steps(" tariffs,pool ,")))
+    assert list(durations) == ["tariffs", "pool"]
+
+    client = TestClient(main.app)
+    client.get("/cache/stats")
+    text = client.get("/metrics").text
+    for phase in ("import", "warmup_tariffs", "warmup_pool", "first_response"):
+        assert f'app_startup_seconds{{phase="{phase}"}}' in text
@@ -0,0 +1,132 @@
+import csv
+import io
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.configs.tariffs import TARIFF_REGISTRY, compile_tariffs
+from app.main import app
+from app.managers import live_sessions
+from app.managers.live_sessions import LiveSession, SessionLimitError, SessionRegistry
+from app.managers.tariff_manager import calculate_usage_metrics
+from benchmarks.synthetic import usage_csv
+
+DATA = usage_csv(years=50 / 365, interval_minutes=60, seed=9, generation=True)
+
+
+@pytest.fixture
+def all_plans(mixed_plans, tiered_plans):
+    return mixed_plans + compile_tariffs(tiered_plans)
+
+
+def readings():
+    return list(csv.DictReader(io.StringIO(DATA)))
+
+
+def test_running_costs_match_batch_metrics(all_plans):
+    session = LiveSession("s", all_plans, True, "v")
+    closed = {}
+    for reading in readings():
+        update = session.apply(reading)
+        if "closed" in update:
+            closed[update["closed"]["month"]] = update["closed"]["costs"]
+
+    metrics, months = calculate_usage_metrics(io.StringIO(DATA), True, "python", all_plans)
+    assert list(closed) == months[:-1]
+    for name, data in metrics.items():
+        for month in months[:-1]:
+            assert closed[month][name] == pytest.approx(data["months"][month]["cost"])
+        assert session.current()["costs"][name] == pytest.approx(data["months"][months[-1]]["cost"])
+    assert list(session.summary()["closed"]) == months[:-1]
+
+
+def test_readings_must_not_go_back_a_month(all_plans):
+    session = LiveSession("s", all_plans, False, "v")
+    session.apply({"datetime": "2023-02-01T00:00:00", "unit": "kWh", "consumption": 1})
+    with pytest.raises(ValueError):
+        session.apply({"datetime": "2023-01-31T23:00:00", "unit": "kWh", "consumption": 1})
+    with pytest.raises(ValueError):
+        session.apply({"datetime": "2023-02-01T01:00:00", "unit": "MWh", "consumption": 1})
+    assert session.readings == 1
+
+
+@pytest.mark.parametrize(
+    "reading",
+    [
+        {"datetime": "2023-02-01T00:00:00", "unit": 5, "consumption": 1},
+        {"datetime": "2023-02-01T00:00:00", "unit": "kWh", "consumption": "nan"},
+        {"datetime": "2023-02-01T00:00:00", "unit": "kWh", "consumption": float("inf")},
+        {"datetime": "2023-02-01T00:00:00", "unit": "kWh", "consumption": 1, "generation": "-inf"},
+    ],
+)
+def test_malformed_readings_are_rejected(all_plans, reading):
+    session = LiveSession("s", all_plans, True, "v")
+    with pytest.raises(ValueError):
+        session.apply(reading)
+    assert session.readings == 0
+
+
+def test_registry_caps_and_evicts_idle_sessions():
+    registry = SessionRegistry(max_sessions=2, idle_seconds=60)
+    first = registry.create(True)
+    second = registry.create(True)
+    with pytest.raises(SessionLimitError):
+        registry.create(True)
+
+    queue = first.subscribe()
+    first.last_seen -= 120
+    assert registry.evict_idle() == 1
+    assert registry.get(first.id) is None and registry.get(second.id) is second
+    assert queue.get_nowait() is None
+    registry.create(True)
+    assert len(registry) == 2
+
+
+def test_slow_subscribers_are_dropped(monkeypatch, all_plans):
+    monkeypatch.setattr(live_sessions, "LIVE_SUBSCRIBER_BUFFER", 2)
+    session = LiveSession("s", all_plans, True, "v")
+    queue = session.subscribe()
+    for reading in readings()[:3]:
+        session.apply(reading)
+    assert not session.subscribers
+    assert queue.get_nowait() is None
+
+
+def test_endpoints(monkeypatch):
+    monkeypatch.setattr("app.controllers.live.LIVE_SESSIONS", SessionRegistry(max_sessions=1, idle_seconds=60))
+    client = TestClient(app)
+    session_id = client.post("/live/sessions?considerGeneration=false").json()["session"]
+    assert client.post("/live/sessions").status_code == 503
+
+    body = "\n".join(json.dumps(reading) for reading in readings()[:30]) + "\nnot json\n"
+    response = client.post(f"/live/sessions/{session_id}/readings", content=body)
+    assert response.headers["content-type"] == "application/x-ndjson"
+    updates = [json.loads(line) for line in response.text.splitlines()]
+    assert len(updates) == 31 and updates[-1]["line"] == 31
+    last = updates[-2]
+    assert last["month"] == readings()[29]["datetime"][:7]
+    assert list(last["costs"]) == [p.name for p in TARIFF_REGISTRY.current().plans]
+    assert last["best"] == min(last["costs"], key=last["costs"].get)
+
+    summary = client.get(f"/live/sessions/{session_id}").json()
+    assert summary["readings"] == 30 and summary["current"]["costs"] == last["costs"]
+    assert client.delete(f"/live/sessions/{session_id}").status_code == 200
+    assert client.get(f"/live/sessions/{session_id}").status_code == 404
+
+
+def test_readings_per_request_are_capped(monkeypatch):
+    monkeypatch.setattr("app.controllers.live.LIVE_SESSIONS", SessionRegistry(max_sessions=1, idle_seconds=60))
+    monkeypatch.setattr("app.controllers.live.LIVE_MAX_READINGS_PER_REQUEST", 5)
+    client = TestClient(app)
+    session_id = client.post("/live/sessions").json()["session"]
+    url = f"/live/sessions/{session_id}/readings"
+
+    lines = [json.dumps(reading) for reading in readings()[:6]]
+    assert client.post(url, content="\n".join(lines)).status_code == 413
+    assert client.post(url, content="x" * 6 * 1024).status_code == 413
+    assert client.get(f"/live/sessions/{session_id}").json()["readings"] == 0
+
+    response = client.post(url, content="\n".join(lines[:4] + ['{"datetime": "2023-01-01T00:00:00", "unit": 5}']))
+    assert response.status_code == 200
+    assert json.loads(response.text.splitlines()[-1])["line"] == 5
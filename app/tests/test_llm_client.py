@@ -0,0 +1,112 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from openai import AsyncOpenAI
+
+from app.main import app
+from app.managers import tariff_manager
+from app.managers.llm_client import LLMBusyError, LLMClient
+from app.managers.result_cache import MetricsCache
+from app.managers.worker_pool import WorkerPool
+from app.tests.fake_openai import FakeOpenAI
+
+MESSAGES = [{"role": "user", "content": "Explain"}]
+CSV = (
+    "datetime,duration,unit,consumption,generation\n"
+    "2023-01-01T01:00:00,3600,kWh,1,0\n"
+)
+
+
+def make_client(fake: FakeOpenAI, **kwargs) -> LLMClient:
+    options = {"max_concurrency": 4, "timeout": 5, "max_retries": 2, "backoff": 0.01}
+    options.update(kwargs)
+    openai_client = AsyncOpenAI(
+        api_key="test",
+        base_url="http://fake/v1",
+        max_retries=0,
+        http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=fake.app)),
+    )
+    return LLMClient(openai_client, "gpt-4o", **options)
+
+
+def test_stream_yields_tokens():
+    fake = FakeOpenAI(reply="one two three")
+    client = make_client(fake)
+
+    async def scenario():
+        return [chunk async for chunk in client.stream(MESSAGES)]
+
+    assert asyncio.run(scenario()) == ["one ", "two ", "three"]
+
+
+def test_identical_requests_are_coalesced():
+    fake = FakeOpenAI(delay=0.05)
+    client = make_client(fake)
+
+    async def scenario():
+        return await asyncio.gather(*(client.complete(MESSAGES) for _ in range(5)))
+
+    results = asyncio.run(scenario())
+    assert len(set(results)) == 1
+    assert fake.calls == 1
+
+
+def test_retries_with_backoff():
+    fake = FakeOpenAI()
+    fake.failures = 2
+    client = make_client(fake)
+    assert asyncio.run(client.complete(MESSAGES)) == fake.reply
+    assert fake.calls == 3
+
+
+def test_busy_when_no_slot_frees_up():
+    fake = FakeOpenAI(delay=0.3)
+    client = make_client(fake, max_concurrency=1, timeout=0.05)
+
+    async def scenario():
+        first = asyncio.ensure_future(client.complete(MESSAGES))
+        await asyncio.sleep(0.01)
+        with pytest.raises(LLMBusyError):
+            await client.complete([{"role": "user", "content": "Other"}])
+        first.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_explain_streams_email(monkeypatch):
+    fake = FakeOpenAI(reply="Night rates suit you.")
+    monkeypatch.setattr(tariff_manager, "LLM_CLIENT", make_client(fake))
+    monkeypatch.setattr(tariff_manager, "METRICS_CACHE", MetricsCache(max_bytes=0))
+    monkeypatch.setattr(tariff_manager, "WORKER_POOL", WorkerPool(0, 4, 60))
+    files = {"usageData": ("usage.csv", CSV, "text/csv")}
+    with TestClient(app) as client:
+        streamed = client.post("/explain?stream=true", files=files)
+        full = client.post("/explain", files=files)
+    assert streamed.status_code == 200
+    assert streamed.text.startswith("Dear Customer")
+    assert "Night rates suit you." in streamed.text
+    assert streamed.text == full.json()["email"]
+
+
+def test_streamed_explain_reports_busy_before_responding(monkeypatch):
+    fake = FakeOpenAI(delay=0.3)
+    llm = make_client(fake, max_concurrency=1, timeout=0.05)
+    monkeypatch.setattr(tariff_manager, "LLM_CLIENT", llm)
+    monkeypatch.setattr(tariff_manager, "METRICS_CACHE", MetricsCache(max_bytes=0))
+    monkeypatch.setattr(tariff_manager, "WORKER_POOL", WorkerPool(0, 4, 60))
+
+    async def scenario():
+        blocker = asyncio.ensure_future(llm.complete(MESSAGES))
+        await asyncio.sleep(0.01)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post(
+                "/explain?stream=true", files={"usageData": ("usage.csv", CSV, "text/csv")}
+            )
+        await blocker
+        return response
+
+    response = asyncio.run(scenario())
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
@@ -0,0 +1,109 @@
+import io
+
+import pytest
+
+from app.configs.tariffs import compile_tariffs
+from app.managers.metrics_table import MetricsTable
+from app.managers.tariff_manager import (
+    MetricsAccumulator,
+    calculate_usage_table,
+    recommend_from_metrics,
+    recommend_from_table,
+)
+from app.managers.usage_parser import iter_hourly_batches
+from benchmarks.synthetic import usage_csv
+
+DATA = usage_csv(years=1.2, interval_minutes=60, seed=8)
+
+
+@pytest.fixture
+def plans(tiered_plans):
+    return compile_tariffs(tiered_plans + [{"name": "Flat", "baseFee": 1, "hourlyConfigs": [{"cost": 12}]}])
+
+
+def reference_average(metrics):
+    """Per calendar month averages computed directly on the nested dicts."""
+    averaged = {}
+    for plan, data in metrics.items():
+        grouped = {}
+        for month, values in data["months"].items():
+            grouped.setdefault(month[5:], []).append(values)
+        averaged[plan] = {"months": {}, "total_cost": 0.0}
+        for mm, vals in grouped.items():
+            breakdown = {}
+            for v in vals:
+                for key, entry in v["breakdown"].items():
+                    bd = breakdown.setdefault(key, {"usage": 0.0, "cost": 0.0, "description": entry["description"]})
+                    bd["usage"] += entry["usage"]
+                    bd["cost"] += entry["cost"]
+            for bd in breakdown.values():
+                bd["usage"] /= len(vals)
+                bd["cost"] /= len(vals)
+            cost = sum(v["cost"] for v in vals) / len(vals)
+            usage = sum(v["usage"] for v in vals) / len(vals)
+            averaged[plan]["months"][mm] = {"cost": cost, "usage": usage, "breakdown": breakdown}
+            averaged[plan]["total_cost"] += cost
+    return averaged
+
+
+@pytest.mark.parametrize("engine", ["python", "numpy"])
+def test_table_round_trips_through_public_shape(engine, plans):
+    table = calculate_usage_table(io.StringIO(DATA), True, engine, plans)
+    metrics = table.to_metrics()
+    assert list(metrics) == ["Tiered", "Peak", "Flat"]
+    assert list(metrics["Flat"]["months"]) == table.months
+    assert MetricsTable.from_metrics(metrics).to_metrics() == metrics
+
+
+def test_average_matches_dict_average(plans):
+    table = calculate_usage_table(io.StringIO(DATA), True, "python", plans)
+    averaged = table.average()
+    assert len(table.months) == 15 and len(averaged.months) == 12
+    assert averaged.to_metrics() == reference_average(table.to_metrics())
+
+
+@pytest.mark.parametrize("allow_switch", [True, False])
+def test_recommend_from_table_matches_metrics(allow_switch, plans):
+    table = calculate_usage_table(io.StringIO(DATA), True, "python", plans)
+    expected = recommend_from_metrics(table.to_metrics(), table.months, allow_switch)
+    assert recommend_from_table(table, allow_switch) == expected
+
+
+def test_snapshot_restore_continues_open_month(plans):
+    rows = [row for batch in iter_hourly_batches(io.StringIO(DATA), True) for row in batch.rows()]
+    whole = MetricsAccumulator(plans)
+    whole.add_rows(rows)
+
+    first = MetricsAccumulator(plans)
+    first.add_rows(rows[:1000])
+    second = MetricsAccumulator(plans)
+    second.restore(first.snapshot())
+    second.add_rows(rows[1000:])
+    resumed = second.finish_table()
+
+    expected = whole.finish_table().select(len(first.months_order), len(rows))
+    assert resumed.months == expected.months
+    assert resumed.plan_cost == pytest.approx(expected.plan_cost)
+    assert resumed.cost == pytest.approx(expected.cost)
+
+
+def test_format_1_snapshot_keeps_usage_charged_before_it(plans):
+    rows = [row for batch in iter_hourly_batches(io.StringIO(DATA), True) for row in batch.rows()]
+    whole = MetricsAccumulator(plans)
+    whole.add_rows(rows)
+
+    # format 1 snapshots came from charging every plan per reading and had no hourly sums
+    first = MetricsAccumulator(plans, incremental=True)
+    first.add_rows(rows[:1000])
+    legacy = first.snapshot()
+    legacy.pop("format", None)
+    del legacy["hist"]
+    second = MetricsAccumulator(plans)
+    second.restore(legacy)
+    second.add_rows(rows[1000:])
+    resumed = second.finish_table()
+
+    expected = whole.finish_table().select(len(first.months_order), len(rows))
+    assert resumed.months == expected.months
+    assert resumed.plan_cost == pytest.approx(expected.plan_cost)
+    assert resumed.cost == pytest.approx(expected.cost)
@@ -0,0 +1,63 @@
+import io
+
+import pytest
+
+from app.configs.tariffs import compile_tariffs
+from app.managers import usage_parser
+from app.managers.plan_search import dedupe_plans, load_usage, top_k_plans
+from app.managers.tariff_manager import calculate_usage_metrics
+
+
+def expected_top(data, consider_generation, plans, k):
+    metrics, _ = calculate_usage_metrics(io.StringIO(data), consider_generation, "python", plans)
+    ranked = sorted(metrics.items(), key=lambda kv: kv[1]["total_cost"])[:k]
+    return [(name, data["total_cost"]) for name, data in ranked]
+
+
+@pytest.mark.parametrize("seed", [1, 2])
+@pytest.mark.parametrize("engine", ["python", "numpy"])
+@pytest.mark.parametrize("k", [1, 5])
+def test_top_k_matches_exhaustive_ranking(seed, engine, k, market_catalog, random_csv):
+    plans = market_catalog(seed)
+    # enough usage to cross the tier thresholds of the catalog
+    data = random_csv(seed, rows=6000)
+    result = top_k_plans(io.StringIO(data), True, k, engine, plans)
+    expected = expected_top(data, True, plans, k)
+    assert [t["cost"] for t in result["top"]] == pytest.approx([c for _, c in expected])
+    assert result["plan"] == result["top"][0]["plan"]
+    assert result["stats"]["unique"] < result["stats"]["plans"]
+    assert result["stats"]["priced"] < result["stats"]["unique"]
+    assert "metrics" not in result
+
+
+def test_full_metrics_on_request(market_catalog, random_csv):
+    plans = market_catalog(3, size=20)
+    data = random_csv(3)
+    result = top_k_plans(io.StringIO(data), False, 3, "python", plans, include_metrics=True)
+    expected, _ = calculate_usage_metrics(io.StringIO(data), False, "python", plans)
+    assert list(result["metrics"]) == list(expected)
+    for name, values in expected.items():
+        assert result["metrics"][name]["total_cost"] == pytest.approx(values["total_cost"])
+    assert result["stats"]["priced"] == result["stats"]["unique"]
+
+
+def test_dedupe_ignores_name_and_fee():
+    plans = compile_tariffs([
+        {"name": "A", "baseFee": 1, "hourlyConfigs": [{"cost": 10}]},
+        {"name": "B", "baseFee": 4, "hourlyConfigs": [{"cost": 10}]},
+        {"name": "C", "baseFee": 1, "hourlyConfigs": [{"cost": 11}]},
+    ])
+    assert [[p.name for p in g] for g in dedupe_plans(plans)] == [["A", "B"], ["C"]]
+
+
+def test_months_are_counted_once(monkeypatch):
+    monkeypatch.setattr(usage_parser, "HOURLY_AGGREGATION", False)
+    data = (
+        "datetime,duration,unit,consumption,generation\n"
+        "2023-01-01T00:00:00,3600,kWh,1,0\n"
+        "2023-02-01T00:00:00,3600,kWh,2,0\n"
+        "2023-01-02T05:00:00,3600,kWh,4,0\n"
+    )
+    _, hourly, months = load_usage(io.StringIO(data), True, "python")
+    assert months == 2
+    assert hourly[0] == 3 and hourly[5] == 4
@@ -0,0 +1,73 @@
+import io
+import json
+
+from app.managers.prompt_summary import compact_analysis, estimate_tokens
+from app.managers.tariff_manager import (
+    calculate_usage_metrics,
+    explain_prompt_sizes,
+    project_from_metrics,
+)
+from app.tests.conftest import CSV_HEADER
+
+ROWS = "".join(
+    f"{year}-{month:02d}-01T{hour:02d}:00:00,3600,kWh,{(month * hour) % 7 + 30},0\n"
+    for year in (2022, 2023)
+    for month in range(1, 13)
+    for hour in (2, 9, 19)
+)
+
+
+def analysis(allow_switch: bool):
+    metrics, _ = calculate_usage_metrics(io.StringIO(CSV_HEADER + ROWS), True)
+    return project_from_metrics(metrics, allow_switch)
+
+
+def test_compact_switching_keeps_decisions():
+    full = analysis(True)
+    compact = compact_analysis(full)
+    assert compact["months"].keys() == full["months"].keys()
+    for month, decision in compact["months"].items():
+        assert decision["best"]["plan"] == full["months"][month]["plan"]
+        assert decision["best"]["cost"] == round(full["months"][month]["cost"], 2)
+        assert decision["delta"] >= 0
+        for ref, _, _ in decision["best"]["drivers"]:
+            assert ref in compact["legend"]
+
+
+def test_compact_no_switch_overall():
+    full = analysis(False)
+    compact = compact_analysis(full)
+    assert compact["overall"]["best"]["plan"] == full["plan"]
+    assert compact["overall"]["runnerUp"]["plan"] != full["plan"]
+    assert len(set(compact["legend"].values())) == len(compact["legend"])
+
+
+def test_token_budget_trims_drivers():
+    full = analysis(True)
+    unlimited = json.dumps(compact_analysis(full), separators=(",", ":"))
+    budget = estimate_tokens(unlimited) * 3 // 4
+    trimmed = compact_analysis(full, budget)
+    assert estimate_tokens(json.dumps(trimmed, separators=(",", ":"))) <= budget
+    assert all(len(d["best"].get("drivers", [])) < 3 for d in trimmed["months"].values())
+
+
+def test_budget_below_zero_drivers_cuts_runner_ups_then_months():
+    full = analysis(True)
+    unlimited = json.dumps(compact_analysis(full), separators=(",", ":"))
+    budget = estimate_tokens(unlimited) // 4
+    trimmed = compact_analysis(full, budget)
+    assert estimate_tokens(json.dumps(trimmed, separators=(",", ":"))) <= budget
+    assert trimmed["omittedMonths"]
+    assert list(trimmed["months"]) + trimmed["omittedMonths"] == list(full["months"])
+    assert all(set(d["runnerUp"]) == {"plan"} for d in trimmed["months"].values())
+
+
+def test_unreachable_budget_is_logged(caplog):
+    trimmed = compact_analysis(analysis(False), 1)
+    assert "overall" in trimmed
+    assert "exceeds the budget" in caplog.text
+
+
+def test_prompt_is_smaller_than_full_analysis():
+    sizes = explain_prompt_sizes(analysis(True))
+    assert sizes["compact"]["tokens"] < sizes["full"]["tokens"] / 2
@@ -0,0 +1,66 @@
+import io
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.compression import choose_encoding
+from app.main import app
+from app.managers import tariff_manager
+from app.managers.result_cache import MetricsCache
+from app.managers.tariff_manager import calculate_usage_metrics, recommend_from_metrics, shape_result
+from app.managers.worker_pool import WorkerPool
+
+
+@pytest.fixture(autouse=True)
+def in_thread_pool(monkeypatch):
+    monkeypatch.setattr(tariff_manager, "METRICS_CACHE", MetricsCache(max_bytes=0))
+    monkeypatch.setattr(tariff_manager, "WORKER_POOL", WorkerPool(workers=0, max_pending=4, timeout=10))
+
+
+@pytest.fixture
+def result(mixed_plans, random_csv):
+    metrics, months_order = calculate_usage_metrics(io.StringIO(random_csv(4)), True, "python", mixed_plans)
+    return recommend_from_metrics(metrics, months_order, True)
+
+
+def test_summary_drops_metrics(result):
+    shaped = shape_result(result, "summary")
+    assert "metrics" not in shaped and shaped["months"] == result["months"]
+    assert shape_result(result, "full") is result
+
+
+def test_recommended_keeps_picked_plans_with_legend(result):
+    shaped = shape_result(result, "recommended")
+    picked = {m["plan"] for m in result["months"].values()}
+    assert set(shaped["metrics"]) == picked
+    for name in picked:
+        full = result["metrics"][name]
+        lean = shaped["metrics"][name]
+        assert lean["total_cost"] == full["total_cost"]
+        for month, values in full["months"].items():
+            for key, entry in values["breakdown"].items():
+                assert lean["months"][month]["breakdown"][key] == {"usage": entry["usage"], "cost": entry["cost"]}
+                assert shaped["legend"][key] == entry["description"]
+    assert len(json.dumps(shaped)) < len(json.dumps(result)) / 2
+
+
+def test_endpoint_detail_and_compression(random_csv):
+    client = TestClient(app)
+    files = {"usageData": ("u.csv", random_csv(5), "text/csv")}
+    full = client.post("/recommend", files=files, headers={"Accept-Encoding": "gzip"})
+    assert full.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in full.headers["vary"]
+    lean = client.post("/recommend?detail=recommended", files=files, headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in lean.headers
+    assert set(lean.json()) == {"months", "metrics", "legend"}
+    assert lean.json()["months"] == full.json()["months"]
+    summary = client.post("/v2/recommend?detail=summary&allowPlanSwitching=false", files=files)
+    assert set(summary.json()) == {"plan", "cost"}
+    assert client.post("/recommend?detail=everything", files=files).status_code == 422
+
+
+def test_choose_encoding():
+    assert choose_encoding("gzip, deflate") == "gzip"
+    assert choose_encoding("gzip;q=0, deflate") is None
+    assert choose_encoding("") is None
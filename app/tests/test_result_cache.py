@@ -0,0 +1,107 @@
+import asyncio
+import os
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.managers import result_cache, tariff_manager
+from app.managers.result_cache import MetricsCache, metrics_cache_key
+from app.managers.worker_pool import WorkerPool
+
+CSV = (
+    "datetime,duration,unit,consumption,generation\n"
+    "2023-01-01T01:00:00,3600,kWh,1,0\n"
+    "2023-02-01T12:00:00,3600,kWh,1,0\n"
+)
+
+
+def test_cache_key_depends_on_inputs():
+    key = metrics_cache_key(b"data", True, "abc")
+    assert key == metrics_cache_key(b"data", True, "abc")
+    assert key != metrics_cache_key(b"data", False, "abc")
+    assert key != metrics_cache_key(b"data", True, "def")
+    assert key != metrics_cache_key(b"other", True, "abc")
+
+
+def test_cache_key_changes_with_the_cache_format(monkeypatch):
+    key = metrics_cache_key(b"data", True, "abc")
+    monkeypatch.setattr(result_cache, "CACHE_FORMAT", result_cache.CACHE_FORMAT + 1)
+    assert metrics_cache_key(b"data", True, "abc") != key
+
+
+def test_lru_evicts_by_size():
+    cache = MetricsCache(max_bytes=200)
+    cache.put("a", "x" * 60)
+    cache.put("b", "y" * 60)
+    assert cache.get("a") == "x" * 60
+    cache.put("c", "z" * 60)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.size <= 200
+
+
+def test_disk_tier_shared_between_instances(tmp_path):
+    first = MetricsCache(max_bytes=1024, directory=str(tmp_path), disk_max_bytes=4096)
+    first.put("key", ({"plan": {"months": {}}}, ["2023-01"]))
+    second = MetricsCache(max_bytes=1024, directory=str(tmp_path), disk_max_bytes=4096)
+    assert second.get("key") == ({"plan": {"months": {}}}, ["2023-01"])
+    assert second.stats()["disk_hits"] == 1
+
+
+def test_corrupt_disk_entry_is_a_miss_and_removed(tmp_path):
+    cache = MetricsCache(max_bytes=1024, directory=str(tmp_path), disk_max_bytes=4096)
+    cache.put("key", [1, 2, 3])
+    with open(tmp_path / "key.pickle", "r+b") as f:
+        f.truncate(5)
+    fresh = MetricsCache(max_bytes=1024, directory=str(tmp_path), disk_max_bytes=4096)
+    assert asyncio.run(fresh.get_async("key")) is None
+    assert fresh.misses == 1 and not (tmp_path / "key.pickle").exists()
+
+
+def test_disk_tier_is_listed_only_when_over_its_cap(tmp_path, monkeypatch):
+    cache = MetricsCache(max_bytes=0, directory=str(tmp_path), disk_max_bytes=300)
+    listings = []
+    scandir = os.scandir
+    monkeypatch.setattr(os, "scandir", lambda path: listings.append(path) or scandir(path))
+    asyncio.run(cache.put_async("a", "x" * 100))
+    asyncio.run(cache.put_async("b", "y" * 100))
+    assert listings == [] and cache.disk_size > 200
+    cache.put("c", "z" * 100)
+    assert len(listings) == 1 and cache.disk_size <= 300
+    assert sorted(os.listdir(tmp_path)) == ["b.pickle", "c.pickle"]
+    assert asyncio.run(cache.get_async("c")) == "z" * 100
+
+
+def test_endpoints_share_cached_metrics(monkeypatch):
+    cache = MetricsCache(max_bytes=1 << 20)
+    pool = WorkerPool(workers=0, max_pending=4, timeout=60)
+    monkeypatch.setattr(tariff_manager, "METRICS_CACHE", cache)
+    monkeypatch.setattr(tariff_manager, "WORKER_POOL", pool)
+    monkeypatch.setattr("app.controllers.admin.METRICS_CACHE", cache)
+    files = {"usageData": ("usage.csv", CSV, "text/csv")}
+    with TestClient(app) as client:
+        switching = client.post("/recommend", files=files).json()
+        fixed = client.post("/recommend?allowPlanSwitching=false", files=files).json()
+        projected = client.post("/v2/recommend", files=files).json()
+        stats = client.get("/cache/stats").json()
+    pool.shutdown()
+    assert switching["months"]["2023-02"]["plan"] == "Tiered"
+    assert fixed["plan"] == "Tiered"
+    assert projected["months"]["02"]["plan"] == "Tiered"
+    assert stats["misses"] == 1
+    assert stats["hits"] == 2
+
+
+def test_variants_endpoint_fills_cache_for_both_flags(monkeypatch):
+    cache = MetricsCache(max_bytes=1 << 20)
+    pool = WorkerPool(workers=0, max_pending=4, timeout=60)
+    monkeypatch.setattr(tariff_manager, "METRICS_CACHE", cache)
+    monkeypatch.setattr(tariff_manager, "WORKER_POOL", pool)
+    files = {"usageData": ("usage.csv", CSV, "text/csv")}
+    with TestClient(app) as client:
+        variants = client.post("/recommend/variants", files=files).json()
+        client.post("/recommend?considerGeneration=false", files=files)
+    pool.shutdown()
+    assert variants["withoutGeneration"]["switching"]["months"]["2023-02"]["plan"] == "Tiered"
+    assert variants["withGeneration"]["fixed"]["plan"] == "Tiered"
+    assert cache.hits == 1
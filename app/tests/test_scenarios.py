@@ -0,0 +1,109 @@
+import io
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.managers import scenarios as scenarios_module
+from app.managers.scenarios import scenario_metrics, validate_scenarios
+from app.managers.tariff_manager import calculate_usage_metrics
+from app.managers.worker_pool import WorkerPool
+from benchmarks.synthetic import usage_csv
+
+HOURLY = usage_csv(years=60 / 365, interval_minutes=60, seed=4, generation=True)
+
+
+def total(metrics, name):
+    return metrics[name]["total_cost"]
+
+
+@pytest.mark.parametrize("consider_generation", [True, False])
+def test_baseline_matches_regular_metrics_for_hourly_data(consider_generation, mixed_plans):
+    results = scenario_metrics(io.StringIO(HOURLY), [{"name": "same", "transforms": []}], consider_generation, mixed_plans)
+    expected, months = calculate_usage_metrics(io.StringIO(HOURLY), consider_generation, "numpy", mixed_plans)
+    for name in ("baseline", "same"):
+        metrics, order = results[name].to_metrics(), results[name].months
+        assert order == months
+        for plan, data in expected.items():
+            assert metrics[plan]["total_cost"] == pytest.approx(data["total_cost"])
+            for month, values in data["months"].items():
+                assert metrics[plan]["months"][month]["usage"] == pytest.approx(values["usage"])
+
+
+def test_baseline_matches_regular_metrics_with_sub_hourly_generation(mixed_plans):
+    data = usage_csv(years=30 / 365, interval_minutes=15, seed=5, generation=True)
+    results = scenario_metrics(io.StringIO(data), [{"name": "same", "transforms": []}], True, mixed_plans)
+    expected, _ = calculate_usage_metrics(io.StringIO(data), True, "python", mixed_plans)
+    for name in ("baseline", "same"):
+        metrics = results[name].to_metrics()
+        for plan, values in expected.items():
+            assert metrics[plan]["total_cost"] == pytest.approx(values["total_cost"])
+
+
+def test_transforms(mixed_plans):
+    scenarios = [
+        {"name": "growth", "transforms": [{"type": "scale", "factor": 1.1}]},
+        {
+            "name": "evening to night",
+            "transforms": [
+                {"type": "shift", "fraction": 0.5, "fromStartHour": 6, "fromEndHour": 24, "toStartHour": 0, "toEndHour": 6}
+            ],
+        },
+        {"name": "no solar", "transforms": [{"type": "generation", "factor": 0}]},
+        {"name": "ev", "transforms": [{"type": "add", "kwh": 2, "startHour": 0, "endHour": 4}]},
+    ]
+    results = {name: table.to_metrics() for name, table in scenario_metrics(io.StringIO(HOURLY), scenarios, False, mixed_plans).items()}
+    base = results["baseline"]
+    fees = 3 * len(next(iter(base.values()))["months"])
+
+    growth = results["growth"]
+    assert total(growth, "Flat") - fees == pytest.approx((total(base, "Flat") - fees) * 1.1)
+    shifted = results["evening to night"]
+    assert total(shifted, "Flat") == pytest.approx(total(base, "Flat"))
+    assert total(shifted, "Night") < total(base, "Night")
+    # without considerGeneration, generation changes nothing
+    assert total(results["no solar"], "Flat") == pytest.approx(total(base, "Flat"))
+    days = HOURLY.count("T00:00:00")
+    assert total(results["ev"], "Flat") == pytest.approx(total(base, "Flat") + days * 4 * 2 * 14)
+
+    with_generation = scenario_metrics(io.StringIO(HOURLY), scenarios[2:3], True, mixed_plans)
+    assert total(with_generation["no solar"].to_metrics(), "Flat") == pytest.approx(total(base, "Flat"))
+    assert total(with_generation["baseline"].to_metrics(), "Flat") < total(base, "Flat")
+
+
+@pytest.mark.parametrize(
+    "scenarios",
+    [
+        [],
+        [{"transforms": []}],
+        [{"name": "baseline"}],
+        [{"name": "a", "transforms": [{"type": "rotate"}]}],
+        [{"name": "a", "transforms": [{"type": "scale", "factor": -1}]}],
+        [{"name": "a", "transforms": [{"type": "shift", "fraction": 0.2, "fromStartHour": 21, "fromEndHour": 17}]}],
+        [{"name": "a", "transforms": [{"type": "add", "kwh": 1, "target": "battery"}]}],
+    ],
+)
+def test_invalid_scenarios(scenarios):
+    with pytest.raises(ValueError):
+        validate_scenarios(scenarios)
+
+
+def test_endpoint(monkeypatch):
+    monkeypatch.setattr(scenarios_module, "WORKER_POOL", WorkerPool(workers=0, max_pending=4, timeout=10))
+    client = TestClient(app)
+    files = {"usageData": ("u.csv", HOURLY, "text/csv")}
+    scenarios = [{"name": "growth", "transforms": [{"type": "scale", "factor": 1.2}]}]
+    response = client.post(
+        "/recommend/scenarios?allowPlanSwitching=false&detail=summary",
+        files=files,
+        data={"scenarios": json.dumps(scenarios)},
+    )
+    assert response.status_code == 200
+    body = response.json()
+    assert set(body) == {"baseline", "growth"}
+    assert body["growth"]["cost"] > body["baseline"]["cost"]
+    assert set(body["growth"]) == {"plan", "cost"}
+
+    bad = client.post("/recommend/scenarios", files=files, data={"scenarios": "[{"})
+    assert bad.status_code == 400
@@ -0,0 +1,93 @@
+import json
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.configs import tariffs as tariffs_module
+from app.configs.tariffs import TariffRegistry, load_tariffs, validate_tariffs
+from app.controllers import admin
+from app.main import app
+
+
+PLAN = {"name": "Flat", "baseFee": 5, "hourlyConfigs": [{"cost": 0.2}]}
+
+
+def write(path, tariffs, mtime=None):
+    path.write_text(json.dumps(tariffs))
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def test_registry_loads_repo_catalog():
+    registry = TariffRegistry("tariffs.json", 0)
+    catalog = registry.current()
+    assert len(catalog.plans) == len(load_tariffs())
+    assert registry.current() is catalog
+
+
+def test_registry_picks_up_file_change(tmp_path):
+    path = tmp_path / "tariffs.json"
+    write(path, [PLAN], mtime=1000)
+    registry = TariffRegistry(str(path), 0.001)
+    first = registry.current()
+    write(path, [PLAN, dict(PLAN, name="Other")], mtime=2000)
+    registry._checked_at = 0.0
+    second = registry.current()
+    assert second.version != first.version
+    assert [p.name for p in second.plans] == ["Flat", "Other"]
+    # snapshots taken earlier are left untouched
+    assert [p.name for p in first.plans] == ["Flat"]
+
+
+@pytest.mark.parametrize(
+    "tariffs",
+    [
+        {"name": "Flat"},
+        [PLAN, PLAN],
+        [{"name": "Bad", "hourlyConfigs": [{"cost": "x"}]}],
+        [{"name": "Bad", "hourlyConfigs": [{"cost": 1, "startHour": 20, "endHour": 6}]}],
+    ],
+)
+def test_invalid_catalog_keeps_snapshot(tmp_path, tariffs):
+    path = tmp_path / "tariffs.json"
+    write(path, [PLAN], mtime=1000)
+    registry = TariffRegistry(str(path), 0.001)
+    first = registry.current()
+    write(path, tariffs, mtime=2000)
+    with pytest.raises(ValueError):
+        registry.reload()
+    registry._checked_at = 0.0
+    assert registry.current() is first
+
+
+@pytest.mark.parametrize(
+    "tariffs",
+    [
+        [{"name": "Bad", "baseFee": True, "hourlyConfigs": [{"cost": 1}]}],
+        [{"name": "Bad", "hourlyConfigs": [{"cost": True}]}],
+        [{"name": "Bad", "hourlyConfigs": [{"cost": 1, "startHour": False, "endHour": 6}]}],
+        [{"name": "Bad", "hourlyConfigs": [{"cost": 1, "billedAfterUsage": True}]}],
+    ],
+)
+def test_booleans_are_not_numbers(tariffs):
+    with pytest.raises(ValueError):
+        validate_tariffs(tariffs)
+
+
+def test_module_aliases_follow_the_registry():
+    catalog = tariffs_module.TARIFF_REGISTRY.current()
+    assert tariffs_module.TARIFFS is catalog.tariffs
+    assert tariffs_module.COMPILED_PLANS is catalog.plans
+    assert tariffs_module.TARIFFS_FINGERPRINT == catalog.version
+
+
+def test_reload_needs_the_admin_token(monkeypatch):
+    client = TestClient(app)
+    assert client.post("/admin/tariffs/reload").status_code == 403
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "secret")
+    assert client.post("/admin/tariffs/reload").status_code == 401
+    assert client.post("/admin/tariffs/reload", headers={"X-Admin-Token": "wrong"}).status_code == 401
+    response = client.post("/admin/tariffs/reload", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert response.json()["version"] == tariffs_module.TARIFF_REGISTRY.current().version
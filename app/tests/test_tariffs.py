@@ -7,8 +7,7 @@ from app.managers.tariff_manager import (
     recommend_from_metrics,
 )
 import types
-
-CSV_HEADER = "datetime,duration,unit,consumption,generation\n"
+from app.tests.conftest import CSV_HEADER
 
 
 def make_file(rows: str):
@@ -198,3 +197,90 @@ def test_explain_average():
     assert analysis["plan"] == "NightSaver"
 
 
+def test_compiled_plan_matches_select_config():
+    from app.configs.tariffs import CompiledPlan, select_config
+
+    plan = CompiledPlan({
+        "name": "Mixed",
+        "hourlyConfigs": [
+            {"startHour": 0, "endHour": 6, "billedAfterUsage": 50, "cost": 8},
+            {"cost": 12},
+            {"billedAfterUsage": 20, "cost": 18},
+            {"startHour": 18, "endHour": 24, "cost": 25},
+        ],
+    })
+    for hour in range(24):
+        for usage in (0, 10, 20, 35, 50, 80):
+            idx, _ = plan.tier_at(hour, usage)
+            expected = select_config(plan.configs, hour, usage)
+            assert plan.hours[hour][idx][1] == expected.cost
+            assert plan.keys[plan.hours[hour][idx][2]] == expected.key
+
+
+def test_tiered_crossing_breakdown():
+    csv_file = make_file(
+        "2023-01-01T12:00:00,3600,kWh,80,0\n"
+        "2023-01-01T13:00:00,3600,kWh,40,0\n"
+    )
+    metrics, _ = calculate_usage_metrics(csv_file, True)
+    breakdown = metrics["Tiered"]["months"]["2023-01"]["breakdown"]
+    assert breakdown["hNone_None_t0.0"]["usage"] == 100
+    assert breakdown["hNone_None_t100"]["usage"] == 20
+    assert metrics["Tiered"]["total_cost"] == 1300
+
+
+def test_all_variants_from_single_pass():
+    from app.managers.tariff_manager import get_all_variants
+
+    rows = (
+        "2023-01-01T01:00:00,3600,kWh,1,0\n"
+        "2023-01-01T07:00:00,3600,kWh,1,1\n"
+        "2023-02-01T12:00:00,3600,Wh,1000,0\n"
+    )
+    for engine in ("python", "numpy"):
+        variants = get_all_variants(make_file(rows), engine=engine)
+        for consider_generation, key in ((True, "withGeneration"), (False, "withoutGeneration")):
+            for allow_switch, mode in ((True, "switching"), (False, "fixed")):
+                expected = calculate_from_csv(make_file(rows), consider_generation, allow_switch)
+                expected.pop("metrics")
+                assert variants[key][mode] == expected
+
+    projected = get_all_variants(make_file(rows), projected=True)
+    assert projected["withGeneration"]["switching"]["months"]["02"]["plan"] == "Tiered"
+
+
+def test_plan_pricing_classification():
+    from app.configs.tariffs import CompiledPlan, TARIFF_REGISTRY
+
+    pricing = {p.name: p.pricing for p in TARIFF_REGISTRY.current().plans}
+    assert pricing == {"FlatRate": "hourly", "NightSaver": "hourly", "Tiered": "total"}
+    mixed = CompiledPlan({
+        "name": "Mixed",
+        "hourlyConfigs": [
+            {"startHour": 0, "endHour": 6, "cost": 5},
+            {"startHour": 6, "endHour": 24, "cost": 20},
+            {"billedAfterUsage": 50, "cost": 30},
+        ],
+    })
+    assert mixed.pricing == "sequential"
+
+
+def test_histogram_pricing_matches_sequential_charging():
+    from app.configs.tariffs import CompiledPlan
+    from app.managers.tariff_manager import charge_histogram, charge_usage
+
+    tiered = CompiledPlan({
+        "name": "Tiered",
+        "hourlyConfigs": [{"cost": 10}, {"billedAfterUsage": 5, "cost": 15}, {"billedAfterUsage": 9, "cost": 25}],
+    })
+    readings = [(1, 2.0), (13, 4.0), (22, 3.5), (1, 1.5)]
+    hist = [0.0] * 24
+    usage, cost = 0.0, 0.0
+    component_usage, component_cost = [0.0] * 3, [0.0] * 3
+    for hour, kwh in readings:
+        hist[hour] += kwh
+        usage, added = charge_usage(kwh, hour, tiered, usage, component_usage, component_cost)
+        cost += added
+    hist_usage, hist_cost = [0.0] * 3, [0.0] * 3
+    assert charge_histogram(hist, tiered, hist_usage, hist_cost) == (usage, cost)
+    assert (hist_usage, hist_cost) == (component_usage, component_cost)
@@ -0,0 +1,176 @@
+import asyncio
+import hashlib
+import io
+import os
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.managers import tariff_manager
+from app.managers.result_cache import MetricsCache
+from app.managers.upload_stream import MultipartExtractor, UploadError, save_upload
+from app.managers.worker_pool import PoolSaturatedError, StreamRunner, WorkerPool
+from benchmarks.synthetic import usage_csv
+
+DATA = usage_csv(years=40 / 365, interval_minutes=60, seed=6)
+
+
+def multipart_body(boundary, parts):
+    body = b""
+    for name, content in parts:
+        body += (
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"; filename=\"u.csv\"\r\n"
+            "Content-Type: text/csv\r\n\r\n"
+        ).encode() + content + b"\r\n"
+    return body + f"--{boundary}--\r\n".encode()
+
+
+@pytest.mark.parametrize("step", [1, 7, 1 << 20])
+def test_multipart_extractor_returns_only_the_upload_field(step):
+    body = multipart_body("xyz", [("note", b"ignored"), ("usageData", DATA.encode())])
+    extractor = MultipartExtractor("multipart/form-data; boundary=xyz")
+    out = b"".join(b"".join(extractor.feed(body[i:i + step])) for i in range(0, len(body), step))
+    extractor.finish()
+    assert out == DATA.encode()
+
+    missing = MultipartExtractor("multipart/form-data; boundary=xyz")
+    missing.feed(multipart_body("xyz", [("note", b"x")]))
+    with pytest.raises(UploadError):
+        missing.finish()
+
+
+def test_parsing_overlaps_with_receiving():
+    seen = threading.Event()
+
+    def consume(channel):
+        chunks = []
+        for chunk in channel:
+            chunks.append(chunk)
+            seen.set()
+        return chunks
+
+    async def body():
+        yield b"first"
+        # only returns True when the thread read the first chunk before the body ended
+        yield b"second" if await asyncio.to_thread(seen.wait, 5) else b"buffered"
+
+    async def main():
+        return await StreamRunner(1, 2, 5).run(body(), consume)
+
+    assert asyncio.run(main()) == [b"first", b"second"]
+
+
+def test_buffer_is_bounded_and_failures_release_the_producer():
+    received = []
+
+    def consume(channel, limit):
+        for chunk in channel:
+            received.append(chunk)
+            if len(received) == limit:
+                raise ValueError("bad upload")
+
+    sent = []
+
+    async def body():
+        for i in range(100):
+            sent.append(i)
+            yield b"x"
+
+    async def main():
+        runner = StreamRunner(1, 4, 5)
+        with pytest.raises(ValueError):
+            await runner.run(body(), consume, 3)
+        return runner
+
+    runner = asyncio.run(main())
+    # the producer stops once the consumer failed, with at most the buffer read ahead
+    assert len(sent) <= 3 + 4 + 1
+    assert runner.active == 0
+
+
+def test_streams_are_limited():
+    release = threading.Event()
+
+    def consume(channel):
+        release.wait(5)
+        return sum(len(chunk) for chunk in channel)
+
+    async def body():
+        yield b"abc"
+
+    async def main():
+        runner = StreamRunner(1, 2, 5)
+        first = asyncio.ensure_future(runner.run(body(), consume))
+        await asyncio.sleep(0.05)
+        with pytest.raises(PoolSaturatedError):
+            await runner.run(body(), consume)
+        release.set()
+        return await first
+
+    assert asyncio.run(main()) == 3
+
+
+def test_stream_endpoints_match_uploads(monkeypatch):
+    monkeypatch.setattr(tariff_manager, "METRICS_CACHE", MetricsCache(max_bytes=0))
+    monkeypatch.setattr(tariff_manager, "WORKER_POOL", WorkerPool(workers=0, max_pending=4, timeout=10))
+    client = TestClient(app)
+    files = {"usageData": ("u.csv", DATA, "text/csv")}
+    for path in ("/recommend", "/v2/recommend"):
+        expected = client.post(f"{path}?allowPlanSwitching=false", files=files).json()
+        streamed = client.post(f"{path}/stream?allowPlanSwitching=false", files=files)
+        raw = client.post(f"{path}/stream?allowPlanSwitching=false", content=DATA, headers={"content-type": "text/csv"})
+        assert streamed.status_code == raw.status_code == 200
+        assert streamed.json() == raw.json() == expected
+
+    assert client.post("/recommend/stream", files={"other": ("u.csv", DATA, "text/csv")}).status_code == 400
+    # failures while parsing in the stream thread are the client's too
+    bad_unit = DATA.replace("kWh", "MWh")
+    assert client.post("/recommend/stream", content=bad_unit, headers={"content-type": "text/csv"}).status_code == 400
+
+
+class ChunkedUpload:
+    """Stand-in for UploadFile recording the largest read."""
+
+    def __init__(self, data):
+        self.file = io.BytesIO(data)
+        self.largest = 0
+
+    async def read(self, size=-1):
+        chunk = self.file.read(size)
+        self.largest = max(self.largest, len(chunk))
+        return chunk
+
+
+def test_saved_upload_is_copied_in_chunks_and_hashed():
+    data = DATA.encode()
+    source = ChunkedUpload(data)
+    upload = asyncio.run(save_upload(source, chunk_size=4096))
+    try:
+        assert source.largest == 4096
+        assert upload.digest == hashlib.sha256(data).hexdigest() and upload.size == len(data)
+        with open(upload.path, "rb") as f:
+            assert f.read() == data
+    finally:
+        upload.remove()
+    assert not os.path.exists(upload.path)
+
+
+def test_pool_jobs_get_a_file_path_not_the_upload(monkeypatch):
+    pool = WorkerPool(workers=0, max_pending=4, timeout=60)
+    monkeypatch.setattr(tariff_manager, "WORKER_POOL", pool)
+    monkeypatch.setattr(tariff_manager, "METRICS_CACHE", MetricsCache(max_bytes=0))
+    submitted = []
+    run = pool.run
+
+    async def spy(fn, *args):
+        submitted.append(args[0])
+        assert os.path.exists(args[0])
+        return await run(fn, *args)
+
+    monkeypatch.setattr(pool, "run", spy)
+    response = TestClient(app).post("/recommend", files={"usageData": ("u.csv", DATA, "text/csv")})
+    pool.shutdown()
+    assert response.status_code == 200
+    assert isinstance(submitted[0], str) and not os.path.exists(submitted[0])
@@ -0,0 +1,406 @@
+import io
+import random
+
+import pytest
+
+from app.managers.tariff_manager import iterate_rows, prepare_consumption
+from app.managers.usage_parser import UsageDataError, UsageParser, iter_usage_batches, split_timestamp
+
+CSV = (
+    "datetime,duration,unit,consumption,generation\r\n"
+    "2023-01-01T01:00:00,3600,kWh,1.5,0.5\r\n"
+    "2023-01-31T23:15:00+02:00,900,Wh,250,300\r\n"
+    "\r\n"
+    "2023-02-01 07:00:00,3600,WH,1000,0\r\n"
+    '"2023-02-02T08:00:00",3600,"kWh","2",0\r\n'
+    "2023-03-05,86400,kWh,12,1\r\n"
+)
+
+
+def parsed(data, consider_generation, chunk_size):
+    rows = []
+    for batch in iter_usage_batches(io.BytesIO(data.encode()), consider_generation, chunk_size):
+        rows.extend(batch.rows())
+    return rows
+
+
+def reference(data, consider_generation):
+    rows = []
+    for raw in iterate_rows(io.StringIO(data)):
+        dt, cons = prepare_consumption(raw, consider_generation)
+        rows.append((dt.strftime("%Y-%m"), dt.hour, cons))
+    return rows
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1 << 20])
+@pytest.mark.parametrize("consider_generation", [True, False])
+def test_parser_matches_dict_reader(chunk_size, consider_generation):
+    assert parsed(CSV, consider_generation, chunk_size) == reference(CSV, consider_generation)
+
+
+def test_parser_accepts_text_and_reordered_columns():
+    data = "unit,consumption,datetime\nkWh,2,2023-04-01T05:00:00\n"
+    rows = [r for b in iter_usage_batches(io.StringIO(data), True) for r in b.rows()]
+    assert rows == [("2023-04", 5, 2.0)]
+
+
+def test_parser_rejects_unknown_unit():
+    parser = UsageParser(True)
+    with pytest.raises(ValueError):
+        parser.feed(b"datetime,unit,consumption\n2023-01-01T00:00:00,MWh,1\n")
+
+
+@pytest.mark.parametrize(
+    "ts",
+    [
+        "2023-13-01T05:00:00",
+        "2023-00-01T05:00:00",
+        "2023-02-01T25:00:00",
+        "2023-02-31T05:00:00",
+        "2023-02-29T05:00:00",
+        "2023-04-00T05:00:00",
+        "20x3-01-01T05:00:00",
+    ],
+)
+def test_out_of_range_timestamps_are_rejected(ts):
+    with pytest.raises(ValueError):
+        split_timestamp(ts)
+
+
+def test_timestamp_fast_path_matches_fromisoformat():
+    assert split_timestamp("2023-12-31T23:59:00") == ("2023-12", 23)
+    assert split_timestamp("2023-01-01 00:00:00+02:00") == ("2023-01", 0)
+    assert split_timestamp("2023-01-01") == ("2023-01", 0)
+    assert split_timestamp("2024-02-29T06:00:00") == ("2024-02", 6)
+    assert split_timestamp("2023-01-31 23:00:00") == ("2023-01", 23)
+
+
+@pytest.mark.parametrize("value", ["nan", "inf", "-inf", "NaN", "infinity"])
+@pytest.mark.parametrize("column", ["consumption", "generation", "duration"])
+def test_non_finite_values_are_rejected(value, column):
+    row = {"consumption": "1", "generation": "0", "duration": "3600", column: value}
+    data = (
+        "datetime,duration,unit,consumption,generation\n"
+        f"2023-01-01T00:00:00,{row['duration']},kWh,{row['consumption']},{row['generation']}\n"
+    )
+    with pytest.raises(UsageDataError, match=column):
+        UsageParser(False).feed(data)
+
+
+def test_parser_requires_columns():
+    with pytest.raises(ValueError):
+        UsageParser(True).feed("datetime,consumption\n")
+
+
+def batches_rows(data, consider_generation=True, chunk_size=1 << 20):
+    rows = []
+    for batch in iter_usage_batches(io.BytesIO(data), consider_generation, chunk_size):
+        rows.extend(batch.rows())
+    return rows
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 20])
+def test_gzip_upload_matches_csv(chunk_size):
+    import gzip
+
+    half = len(CSV) // 2
+    # concatenated members, as produced by appending to a .gz file
+    data = gzip.compress(CSV[:half].encode()) + gzip.compress(CSV[half:].encode())
+    assert batches_rows(data, chunk_size=chunk_size) == reference(CSV, True)
+
+
+def test_truncated_gzip_upload_is_rejected():
+    import gzip
+
+    with pytest.raises(ValueError):
+        batches_rows(gzip.compress(CSV.encode())[:-10])
+
+
+def test_compressed_output_is_bounded():
+    import gzip
+
+    from app.managers.usage_parser import CHUNK_SIZE, UsageDataError, decompress_chunks, gzip_decompressor
+
+    bomb = gzip.compress(b"0" * (20 * CHUNK_SIZE), 9)
+    pieces = decompress_chunks(iter([bomb]), gzip_decompressor, max_bytes=0)
+    sizes = [len(piece) for piece in pieces]
+    assert sum(sizes) == 20 * CHUNK_SIZE and max(sizes) <= CHUNK_SIZE
+    with pytest.raises(UsageDataError):
+        for _ in decompress_chunks(iter([bomb]), gzip_decompressor, max_bytes=5 * CHUNK_SIZE):
+            pass
+
+
+def test_zstd_output_is_bounded():
+    zstandard = pytest.importorskip("zstandard")
+
+    from app.managers.usage_parser import (
+        CHUNK_SIZE,
+        DECOMPRESS_INPUT_SLICE,
+        UsageDataError,
+        decompress_chunks,
+        zstd_decompressor,
+    )
+
+    data = b"0" * (80 * CHUNK_SIZE)
+    bomb = zstandard.ZstdCompressor(level=19).compress(data)
+    pieces = list(decompress_chunks(iter([bomb]), zstd_decompressor, max_bytes=0))
+    assert b"".join(pieces) == data
+    assert max(len(piece) for piece in pieces) <= 40000 * DECOMPRESS_INPUT_SLICE
+    with pytest.raises(UsageDataError):
+        for _ in decompress_chunks(iter([bomb]), zstd_decompressor, max_bytes=5 * CHUNK_SIZE):
+            pass
+
+
+def test_decompression_bomb_is_a_bad_request(monkeypatch):
+    import gzip
+
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+    from app.managers import tariff_manager, usage_parser
+    from app.managers.result_cache import MetricsCache
+    from app.managers.worker_pool import WorkerPool
+
+    monkeypatch.setattr(tariff_manager, "METRICS_CACHE", MetricsCache(max_bytes=0))
+    monkeypatch.setattr(tariff_manager, "WORKER_POOL", WorkerPool(workers=0, max_pending=4, timeout=10))
+    monkeypatch.setattr(usage_parser, "UPLOAD_MAX_DECOMPRESSED_BYTES", len(CSV) - 1)
+    files = {"usageData": ("u.csv.gz", gzip.compress(CSV.encode()), "application/gzip")}
+    response = TestClient(app).post("/recommend", files=files)
+    assert response.status_code == 400
+    assert "larger than" in response.json()["detail"]
+
+
+def test_zstd_upload_matches_csv():
+    zstandard = pytest.importorskip("zstandard")
+    data = zstandard.ZstdCompressor().compress(CSV.encode())
+    assert batches_rows(data, chunk_size=7) == reference(CSV, True)
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow", "arrow-stream"])
+def test_columnar_upload_matches_csv(fmt):
+    pa = pytest.importorskip("pyarrow")
+    from datetime import datetime
+
+    table = pa.table({
+        "datetime": pa.array(
+            [datetime(2023, 1, 1, 1), datetime(2023, 1, 31, 23, 15), datetime(2023, 2, 1, 7)],
+            pa.timestamp("s"),
+        ),
+        "duration": [3600, 900, 3600],
+        "unit": ["kWh", "Wh", "WH"],
+        "consumption": [1.5, 250.0, 1000.0],
+        "generation": [0.5, 300.0, 0.0],
+    })
+    sink = io.BytesIO()
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        pq.write_table(table, sink)
+    elif fmt == "arrow":
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    expected = [("2023-01", 1, 1.0), ("2023-01", 23, 0.0), ("2023-02", 7, 1.0)]
+    assert batches_rows(sink.getvalue()) == expected
+
+
+def aggregate(aggregator, data, chunk_size=4096):
+    for batch in iter_usage_batches(io.BytesIO(data) if isinstance(data, bytes) else io.StringIO(data), True, chunk_size):
+        aggregator.feed(batch)
+    return [row for batch in aggregator.finish() for row in batch.rows()]
+
+
+def assert_same_metrics(actual, expected):
+    assert actual.keys() == expected.keys()
+    for name, data in expected.items():
+        assert actual[name]["total_cost"] == pytest.approx(data["total_cost"])
+        assert actual[name]["months"].keys() == data["months"].keys()
+        for month, values in data["months"].items():
+            for key, entry in values["breakdown"].items():
+                assert actual[name]["months"][month]["breakdown"][key]["cost"] == pytest.approx(entry["cost"])
+
+
+def test_hourly_aggregation_keeps_costs_exact(tiered_plans):
+    from app.configs.tariffs import compile_tariffs
+    from app.managers.tariff_manager import MetricsAccumulator
+    from app.managers.usage_parser import HourlyAggregator
+    from benchmarks.synthetic import usage_csv
+
+    plans = compile_tariffs(tiered_plans)
+    data = usage_csv(years=10 / 365, interval_minutes=1, seed=3).encode()
+
+    raw = MetricsAccumulator(plans)
+    for batch in iter_usage_batches(io.BytesIO(data), True, 4096):
+        raw.add_rows(batch.rows())
+    aggregator = HourlyAggregator("reject")
+    merged = MetricsAccumulator(plans)
+    merged.add_rows(aggregate(aggregator, data))
+
+    assert aggregator.rows == 10 * 24 * 60 and aggregator.buckets == 10 * 24
+    assert_same_metrics(merged.finish()[0], raw.finish()[0])
+
+
+def test_unsorted_input_is_sorted_with_bounded_memory(tiered_plans):
+    from app.configs.tariffs import compile_tariffs
+    from app.managers.tariff_manager import MetricsAccumulator
+    from app.managers.usage_parser import HourlyAggregator
+    from benchmarks.synthetic import usage_csv
+
+    plans = compile_tariffs(tiered_plans)
+    header, *lines = usage_csv(years=40 / 365, interval_minutes=15, seed=5).splitlines()
+    random.Random(1).shuffle(lines)
+    shuffled = "\n".join([header, *lines]) + "\n"
+
+    expected = MetricsAccumulator(plans)
+    in_order = HourlyAggregator("ignore")
+    expected.add_rows(aggregate(in_order, "\n".join([header, *sorted(lines)]) + "\n"))
+    aggregator = HourlyAggregator("ignore", max_hours=100)
+    actual = MetricsAccumulator(plans)
+    actual.add_rows(aggregate(aggregator, shuffled))
+
+    assert not aggregator.in_order and aggregator.spills > 5
+    assert in_order.in_order and aggregator.buckets == in_order.buckets
+    assert_same_metrics(actual.finish()[0], expected.finish()[0])
+
+
+def test_meters_are_merged_and_checked_separately():
+    from app.managers.usage_parser import HourlyAggregator
+
+    starts = [f"2023-01-31T23:{m:02d}:00" for m in (0, 15, 30, 45)]
+    starts += [f"2023-02-01T00:{m:02d}:00" for m in (0, 15, 30, 45)]
+    data = "datetime,duration,unit,consumption,generation,meter\n"
+    for meter, kwh in (("a", 1), ("b", 2)):
+        data += "".join(f"{ts},900,kWh,{kwh},0,{meter}\n" for ts in starts)
+    aggregator = HourlyAggregator("reject")
+    assert aggregate(aggregator, data) == [("2023-01", 23, 12.0), ("2023-02", 0, 12.0)]
+    assert (aggregator.gaps, aggregator.overlaps) == (0, 0)
+
+
+def test_repeated_month_without_aggregation_is_rejected(tiered_plans):
+    from app.configs.tariffs import compile_tariffs
+    from app.managers.tariff_manager import MetricsAccumulator
+
+    accumulator = MetricsAccumulator(compile_tariffs(tiered_plans))
+    with pytest.raises(ValueError):
+        accumulator.add_rows([("2023-01", 0, 1.0), ("2023-02", 0, 1.0), ("2023-01", 1, 1.0)])
+
+
+def test_gaps_and_overlaps_are_detected():
+    from app.managers.usage_parser import HourlyAggregator
+
+    data = (
+        "datetime,duration,unit,consumption,generation\n"
+        "2023-01-01T00:00:00,900,kWh,1,0\n"
+        "2023-01-01T00:15:00,900,kWh,1,0\n"
+        "2023-01-01T00:45:00,900,kWh,1,0\n"  # 15 minutes missing
+        "2023-01-01T01:00:00,1800,kWh,1,0\n"
+        "2023-01-01T01:20:00,2400,kWh,1,0\n"  # starts before the previous reading ended
+        "2023-01-01T02:00:00,3600,kWh,1,0\n"
+    )
+    aggregator = HourlyAggregator("warn")
+    assert aggregate(aggregator, data) == [("2023-01", 0, 3.0), ("2023-01", 1, 2.0), ("2023-01", 2, 1.0)]
+    assert (aggregator.gaps, aggregator.overlaps) == (1, 1)
+
+    with pytest.raises(ValueError):
+        aggregate(HourlyAggregator("reject"), data)
+
+
+GAP = (
+    "datetime,duration,unit,consumption,generation\n"
+    "2023-01-01T00:00:00,900,kWh,1,0\n"
+    "2023-01-01T00:15:00,900,kWh,1,0\n"
+    "2023-01-01T01:00:00,3600,kWh,1,0\n"  # half an hour missing
+)
+UNSORTED = (
+    "datetime,duration,unit,consumption,generation\n"
+    "2023-01-01T00:00:00,3600,kWh,1,0\n"
+    "2023-02-01T00:00:00,3600,kWh,1,0\n"
+    "2023-01-02T00:00:00,3600,kWh,1,0\n"
+)
+
+
+@pytest.mark.parametrize(
+    "data, settings",
+    [
+        (GAP, {"USAGE_GAP_POLICY": "reject"}),
+        (UNSORTED, {"HOURLY_AGGREGATION": False}),
+        (CSV.replace("kWh", "MWh", 1), {}),
+        (CSV + "2023-03-01T00:00:00,3600,kWh,lots,0\n", {}),
+        (CSV + "2023-13-01T00:00:00,3600,kWh,1,0\n", {}),
+        (CSV + "2023-02-31T00:00:00,3600,kWh,1,0\n", {}),
+        (CSV + "2023-03-01T00:00:00,3600,kWh,inf,0\n", {}),
+        ("datetime,unit\n2023-01-01T00:00:00,kWh\n", {}),
+    ],
+)
+@pytest.mark.parametrize("path", ["/recommend", "/v2/recommend", "/recommend/stream"])
+def test_bad_usage_data_is_a_bad_request(monkeypatch, data, settings, path):
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+    from app.managers import tariff_manager, usage_parser
+    from app.managers.result_cache import MetricsCache
+    from app.managers.worker_pool import WorkerPool
+
+    monkeypatch.setattr(tariff_manager, "METRICS_CACHE", MetricsCache(max_bytes=0))
+    monkeypatch.setattr(tariff_manager, "WORKER_POOL", WorkerPool(workers=0, max_pending=4, timeout=10))
+    for name, value in settings.items():
+        monkeypatch.setattr(usage_parser, name, value)
+    response = TestClient(app).post(path, files={"usageData": ("u.csv", data, "text/csv")})
+    assert response.status_code == 400
+
+
+def test_usage_data_error_survives_the_worker_process():
+    import pickle
+
+    error = pickle.loads(pickle.dumps(UsageDataError("Gap in readings before 2023-01-01T00:45:00")))
+    assert isinstance(error, UsageDataError) and str(error) == "Gap in readings before 2023-01-01T00:45:00"
+
+
+def test_negative_readings_do_not_cancel_others_in_an_hour(monkeypatch, tiered_plans):
+    from app.configs.tariffs import compile_tariffs
+    from app.managers import usage_parser
+    from app.managers.tariff_manager import calculate_usage_metrics
+    from app.managers.usage_parser import HourlyAggregator
+
+    data = (
+        "datetime,duration,unit,consumption,generation\n"
+        "2023-01-01T02:00:00,1800,kWh,5,0\n"
+        "2023-01-01T02:30:00,1800,kWh,-3,0\n"
+    )
+    aggregator = HourlyAggregator("reject")
+    for batch in iter_usage_batches(io.StringIO(data), False, keep_gross=True):
+        aggregator.feed(batch)
+    (hour,) = aggregator.finish()
+    assert hour.consumption == [5.0] and hour.gross == [5.0]
+
+    plans = compile_tariffs(tiered_plans)
+    monkeypatch.setattr(usage_parser, "HOURLY_AGGREGATION", False)
+    per_reading, _ = calculate_usage_metrics(io.StringIO(data), False, "python", plans)
+    monkeypatch.setattr(usage_parser, "HOURLY_AGGREGATION", True)
+    for engine in ("python", "numpy"):
+        per_hour, _ = calculate_usage_metrics(io.StringIO(data), False, engine, plans)
+        assert_same_metrics(per_hour, per_reading)
+
+
+def test_impossible_dates_in_the_aggregator_are_usage_errors():
+    from app.managers.usage_parser import HourlyAggregator, UsageBatch
+
+    batch = UsageBatch(["2023-02-31T01:00:00"], ["2023-02"], [1], [1.0], durations=[3600.0])
+    with pytest.raises(UsageDataError, match="day is out of range"):
+        HourlyAggregator("warn").feed(batch)
+
+
+def test_date_time_separators_share_an_hour():
+    from app.managers.usage_parser import HourlyAggregator
+
+    data = (
+        "datetime,duration,unit,consumption,generation\n"
+        "2023-01-01T05:00:00,1800,kWh,1,0\n"
+        "2023-01-01 05:30:00,1800,kWh,2,0\n"
+        "2023-01-01 06:00:00,3600,kWh,4,0\n"
+    )
+    aggregator = HourlyAggregator("reject")
+    assert aggregate(aggregator, data) == [("2023-01", 5, 3.0), ("2023-01", 6, 4.0)]
+    assert aggregator.buckets == 2 and aggregator.in_order
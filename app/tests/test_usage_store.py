@@ -0,0 +1,134 @@
+import io
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.controllers import admin
+from app.controllers import tariffs as tariffs_controller
+from app.main import app
+from app.managers import tariff_manager
+from app.managers.tariff_manager import calculate_customer_metrics, calculate_usage_metrics
+from app.managers.usage_store import UsageStore
+from app.managers.worker_pool import WorkerPool
+from app.tests.conftest import CSV_HEADER
+
+HISTORY = [
+    f"2023-{month:02d}-{day:02d}T{hour:02d}:00:00,3600,kWh,{(day * hour) % 9 + 1},0\n"
+    for month in (1, 2, 3)
+    for day in (1, 10, 20)
+    for hour in (3, 12, 20)
+]
+
+
+def upload(rows):
+    return io.StringIO(CSV_HEADER + "".join(rows))
+
+
+def assert_same(actual, expected):
+    metrics, order = actual
+    expected_metrics, expected_order = expected
+    assert order == expected_order
+    for plan, data in expected_metrics.items():
+        assert metrics[plan]["total_cost"] == pytest.approx(data["total_cost"])
+        for month, values in data["months"].items():
+            assert metrics[plan]["months"][month]["cost"] == pytest.approx(values["cost"])
+            assert metrics[plan]["months"][month]["usage"] == pytest.approx(values["usage"])
+
+
+def test_delta_uploads_match_full_history(tmp_path):
+    store = UsageStore(str(tmp_path / "store.db"))
+    full = calculate_usage_metrics(upload(HISTORY), True)
+
+    # first upload ends in the middle of February
+    calculate_customer_metrics(upload(HISTORY[:13]), True, "c1", store)
+    # the next one overlaps the first and completes the history
+    result = calculate_customer_metrics(upload(HISTORY[9:]), True, "c1", store)
+    assert_same(result, full)
+
+    # uploading nothing new returns the stored history
+    assert_same(calculate_customer_metrics(upload(HISTORY[-2:]), True, "c1", store), full)
+
+
+@pytest.mark.parametrize("engine", ["python", "numpy"])
+def test_engines_continue_the_stored_month(tmp_path, engine):
+    store = UsageStore(str(tmp_path / "store.db"))
+    full = calculate_usage_metrics(upload(HISTORY), True)
+    calculate_customer_metrics(upload(HISTORY[:4]), True, "c1", store, engine=engine)
+    # continues January, prices February whole and leaves March open
+    assert_same(calculate_customer_metrics(upload(HISTORY[2:]), True, "c1", store, engine=engine), full)
+    assert store.load("c1", True, tariff_manager.TARIFF_REGISTRY.current().version).open_state["month"] == "2023-03"
+
+
+def test_unsorted_and_multi_meter_uploads_are_merged_per_hour(tmp_path):
+    store = UsageStore(str(tmp_path / "store.db"))
+    full = calculate_usage_metrics(upload(HISTORY), True)
+    header = CSV_HEADER.rstrip("\n") + ",meter\n"
+    # each reading split in half across two meters, newest first
+    halves = [
+        f"{ts},{duration},{unit},{float(cons) / 2},{gen},{meter}\n"
+        for row in reversed(HISTORY[:13])
+        for ts, duration, unit, cons, gen in [row.strip().split(",")]
+        for meter in ("a", "b")
+    ]
+    calculate_customer_metrics(io.StringIO(header + "".join(halves)), True, "c1", store)
+    assert_same(calculate_customer_metrics(upload(HISTORY[9:]), True, "c1", store), full)
+
+
+def test_customer_uploads_need_the_admin_token(tmp_path, monkeypatch):
+    path = str(tmp_path / "store.db")
+    monkeypatch.setattr(tariffs_controller, "USAGE_STORE_PATH", path)
+    monkeypatch.setattr(tariff_manager, "USAGE_STORE_PATH", path)
+    monkeypatch.setattr(tariff_manager, "WORKER_POOL", WorkerPool(workers=0, max_pending=4, timeout=10))
+    client = TestClient(app)
+
+    def post(headers=None):
+        files = {"usageData": ("u.csv", CSV_HEADER + "".join(HISTORY), "text/csv")}
+        return client.post("/recommend?customerId=c1", files=files, headers=headers or {})
+
+    assert post().status_code == 403
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "secret")
+    assert post().status_code == 401
+    assert post({"X-Admin-Token": "wrong"}).status_code == 401
+    assert UsageStore(path).load("c1", True, tariff_manager.TARIFF_REGISTRY.current().version) is None
+    assert post({"X-Admin-Token": "secret"}).status_code == 200
+    assert UsageStore(path).load("c1", True, tariff_manager.TARIFF_REGISTRY.current().version) is not None
+
+
+def test_store_invalidated_on_tariff_change(tmp_path):
+    store = UsageStore(str(tmp_path / "store.db"))
+    calculate_customer_metrics(upload(HISTORY[:9]), True, "c1", store, fingerprint="old")
+    assert store.load("c1", True, "old") is not None
+    assert store.load("c1", True, "new") is None
+    assert store.load("c1", True, "old") is None
+
+
+def test_generation_settings_stored_separately(tmp_path):
+    store = UsageStore(str(tmp_path / "store.db"))
+    calculate_customer_metrics(upload(HISTORY[:9]), True, "c1", store)
+    assert store.load("c1", False, "any") is None
+
+
+def test_rows_already_stored_are_skipped_anywhere_in_the_upload(tmp_path):
+    store = UsageStore(str(tmp_path / "store.db"))
+    full = calculate_usage_metrics(upload(HISTORY), True)
+    calculate_customer_metrics(upload(HISTORY[:13]), True, "c1", store)
+    # a newer reading first, then readings that were already stored
+    rows = HISTORY[13:14] + HISTORY[9:13] + HISTORY[14:]
+    assert_same(calculate_customer_metrics(upload(rows), True, "c1", store), full)
+
+
+def test_upload_waits_for_the_store_lock(tmp_path):
+    store = UsageStore(str(tmp_path / "store.db"))
+    full = calculate_usage_metrics(upload(HISTORY), True)
+    calculate_customer_metrics(upload(HISTORY[:13]), True, "c1", store)
+    results = []
+    worker = threading.Thread(
+        target=lambda: results.append(calculate_customer_metrics(upload(HISTORY[9:]), True, "c1", store))
+    )
+    with store.transaction():
+        worker.start()
+        worker.join(0.2)
+        assert worker.is_alive()
+    worker.join()
+    assert_same(results[0], full)
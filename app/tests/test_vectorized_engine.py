@@ -0,0 +1,63 @@
+import io
+import subprocess
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.configs.tariffs import compile_tariffs
+from app.main import app
+from app.managers.tariff_manager import calculate_from_csv, calculate_usage_metrics
+from app.managers.vectorized_engine import plan_segments
+from app.tests.conftest import CSV_HEADER
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+@pytest.mark.parametrize("consider_generation", [True, False])
+def test_numpy_engine_matches_python_engine(seed, consider_generation, mixed_plans, random_csv):
+    data = random_csv(seed)
+    expected, expected_order = calculate_usage_metrics(
+        io.StringIO(data), consider_generation, "python", mixed_plans
+    )
+    actual, actual_order = calculate_usage_metrics(
+        io.StringIO(data), consider_generation, "numpy", mixed_plans
+    )
+    assert actual_order == expected_order
+    for name, data_expected in expected.items():
+        assert actual[name]["total_cost"] == pytest.approx(data_expected["total_cost"])
+        for month, values in data_expected["months"].items():
+            got = actual[name]["months"][month]
+            assert got["cost"] == pytest.approx(values["cost"])
+            assert got["usage"] == pytest.approx(values["usage"])
+            assert got["breakdown"].keys() == values["breakdown"].keys()
+            for key, entry in values["breakdown"].items():
+                assert got["breakdown"][key]["cost"] == pytest.approx(entry["cost"])
+                assert got["breakdown"][key]["description"] == entry["description"]
+
+
+def test_numpy_engine_selectable_per_request():
+    csv_file = io.StringIO(CSV_HEADER + "2023-01-01T01:00:00,3600,kWh,120,0\n")
+    result = calculate_from_csv(csv_file, True, False, engine="numpy")
+    assert result["plan"] == "NightSaver"
+    assert result["cost"] == 605
+
+
+def test_unknown_engine():
+    with pytest.raises(ValueError):
+        calculate_usage_metrics(io.StringIO(CSV_HEADER), True, "fortran")
+    response = TestClient(app).post(
+        "/recommend?engine=fortran", files={"usageData": ("u.csv", CSV_HEADER, "text/csv")}
+    )
+    assert response.status_code == 422
+
+
+def test_segments_are_kept_on_the_plan():
+    plan = compile_tariffs([{"name": "Flat", "hourlyConfigs": [{"cost": 14}]}])[0]
+    assert plan.segments is None
+    segments = plan_segments(plan)
+    assert plan.segments is segments and plan_segments(plan) is segments
+
+
+def test_numpy_is_imported_on_first_use():
+    code = "import sys, app.main; assert 'numpy' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], check=True)
@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.controllers import tariffs as tariffs_controller
+from app.main import app
+from app.managers import tariff_manager
+from app.managers.result_cache import MetricsCache
+from app.managers.worker_pool import PoolSaturatedError, WorkerPool
+
+CSV = (
+    "datetime,duration,unit,consumption,generation\n"
+    "2023-01-01T01:00:00,3600,kWh,120,0\n"
+)
+
+
+@pytest.fixture(autouse=True)
+def no_cache(monkeypatch):
+    monkeypatch.setattr(tariff_manager, "METRICS_CACHE", MetricsCache(max_bytes=0))
+
+
+def test_pool_rejects_when_saturated():
+    pool = WorkerPool(workers=0, max_pending=1, timeout=5)
+
+    async def scenario():
+        slow = asyncio.ensure_future(pool.run(time.sleep, 0.2))
+        await asyncio.sleep(0)
+        with pytest.raises(PoolSaturatedError):
+            await pool.run(time.sleep, 0)
+        await slow
+        assert pool.pending == 0
+
+    asyncio.run(scenario())
+    pool.shutdown()
+
+
+def test_pool_timeout_keeps_slot_until_job_finishes():
+    pool = WorkerPool(workers=0, max_pending=2, timeout=0.05)
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await pool.run(time.sleep, 0.3)
+        assert pool.pending == 1
+        await asyncio.sleep(0.4)
+        assert pool.pending == 0
+
+    asyncio.run(scenario())
+    pool.shutdown()
+
+
+def test_warm_up_ignores_the_pending_limit():
+    pool = WorkerPool(workers=2, max_pending=1, timeout=60)
+    asyncio.run(pool.warm_up(abs, -1))
+    assert pool.pending == 0
+    pool.shutdown()
+
+
+@pytest.mark.parametrize("workers", [0, 1])
+def test_recommend_through_pool(monkeypatch, workers):
+    pool = WorkerPool(workers=workers, max_pending=4, timeout=60)
+    monkeypatch.setattr(tariff_manager, "WORKER_POOL", pool)
+    with TestClient(app) as client:
+        response = client.post(
+            "/recommend?allowPlanSwitching=false",
+            files={"usageData": ("usage.csv", CSV, "text/csv")},
+        )
+    pool.shutdown()
+    assert response.status_code == 200
+    assert response.json()["plan"] == "NightSaver"
+    assert response.json()["cost"] == 605
+
+
+def test_saturated_pool_returns_503(monkeypatch):
+    pool = WorkerPool(workers=0, max_pending=0, timeout=60)
+    monkeypatch.setattr(tariff_manager, "WORKER_POOL", pool)
+    with TestClient(app) as client:
+        response = client.post(
+            "/v2/recommend", files={"usageData": ("usage.csv", CSV, "text/csv")}
+        )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(tariffs_controller.WORKER_RETRY_AFTER)
@@ -0,0 +1,268 @@
+import argparse
+import asyncio
+import gc
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from benchmarks.synthetic import synthetic_catalog, usage_csv
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+# options that change the generated data; results are only comparable when these match
+DATA_OPTIONS = ("years", "interval", "plans", "seed")
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of samples."""
+    ordered = sorted(samples)
+    rank = max(1, min(len(ordered), round(pct / 100 * len(ordered) + 0.5)))
+    return ordered[rank - 1]
+
+
+def measure(fn: Callable[[], Any], rows: int, repeat: int) -> Dict[str, float]:
+    """Time `repeat` calls of fn, then run it once more under tracemalloc for peak memory.
+
+    rows is 0 for benchmarks whose work does not scale with the row count.
+    """
+    fn()  # warm-up: imports, compiled plan caches, worker start
+    samples = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    gc.collect()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    p50 = percentile(samples, 50)
+    return {
+        "p50": round(p50, 6),
+        "p99": round(percentile(samples, 99), 6),
+        "rows_per_s": round(rows / p50) if rows and p50 else 0,
+        "peak_mib": round(peak / 2**20, 2),
+    }
+
+
+def function_benchmarks(data: str, rows: int, plans) -> Dict[str, Tuple[Callable[[], Any], int]]:
+    """Manager level benchmarks as (zero argument callable, rows processed)."""
+    from app.managers.metrics_table import MetricsTable
+    from app.managers.tariff_manager import (
+        average_metrics,
+        calculate_usage_metrics,
+        iterate_rows,
+        prepare_consumption,
+        recommend_from_metrics,
+        recommend_from_table,
+    )
+
+    raw_rows = list(iterate_rows(io.StringIO(data)))
+    metrics, months_order = calculate_usage_metrics(io.StringIO(data), True, "python", plans)
+    table = MetricsTable.from_metrics(metrics, months_order)
+    return {
+        "iterate_rows": (lambda: sum(1 for _ in iterate_rows(io.StringIO(data))), rows),
+        "prepare_consumption": (lambda: [prepare_consumption(row, True) for row in raw_rows], rows),
+        "calculate_usage_metrics[python]": (
+            lambda: calculate_usage_metrics(io.StringIO(data), True, "python", plans),
+            rows,
+        ),
+        "calculate_usage_metrics[numpy]": (
+            lambda: calculate_usage_metrics(io.StringIO(data), True, "numpy", plans),
+            rows,
+        ),
+        "average_metrics": (lambda: average_metrics(metrics), 0),
+        "recommend_from_metrics[switching]": (lambda: recommend_from_metrics(metrics, months_order, True), 0),
+        "recommend_from_metrics[fixed]": (lambda: recommend_from_metrics(metrics, months_order, False), 0),
+        "MetricsTable.average": (lambda: table.average(), 0),
+        "recommend_from_table[switching]": (lambda: recommend_from_table(table, True), 0),
+    }
+
+
+def endpoint_benchmarks(data: str, rows: int) -> Dict[str, Tuple[Callable[[], Any], int]]:
+    """/recommend, /v2/recommend and /explain through an in-process ASGI client.
+
+    The metrics cache is disabled and /explain talks to the fake OpenAI
+    server, so timings cover parsing, pricing and prompt building only.
+    """
+    import httpx
+    from openai import AsyncOpenAI
+
+    from app.main import app
+    from app.managers import tariff_manager
+    from app.managers.llm_client import LLMClient
+    from app.managers.result_cache import MetricsCache
+    from app.tests.fake_openai import FakeOpenAI
+
+    tariff_manager.METRICS_CACHE = MetricsCache(max_bytes=0)
+    fake = FakeOpenAI()
+    tariff_manager.LLM_CLIENT = LLMClient(
+        AsyncOpenAI(
+            api_key="benchmark",
+            base_url="http://fake/v1",
+            max_retries=0,
+            http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=fake.app)),
+        ),
+        "gpt-4o",
+        max_concurrency=4,
+        timeout=30,
+        max_retries=0,
+        backoff=0,
+    )
+    loop = asyncio.new_event_loop()
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+    body = data.encode()
+
+    def post(path: str) -> Callable[[], Any]:
+        def call():
+            response = loop.run_until_complete(
+                client.post(path, files={"usageData": ("usage.csv", body, "text/csv")})
+            )
+            response.raise_for_status()
+
+        return call
+
+    return {
+        "POST /recommend": (post("/recommend"), rows),
+        "POST /v2/recommend": (post("/v2/recommend"), rows),
+        "POST /explain": (post("/explain"), rows),
+    }
+
+
+def compare(
+    results: Dict[str, Any], baseline: Dict[str, Any], threshold: float, min_delta: float = 0.002
+) -> List[str]:
+    """Return a message per benchmark whose p50 is more than `threshold` slower than baseline.
+
+    Slowdowns under min_delta seconds are timer noise and never count.
+    """
+    regressions = []
+    for name, current in results["benchmarks"].items():
+        reference = baseline["benchmarks"].get(name)
+        if reference is None or not reference["p50"]:
+            continue
+        ratio = current["p50"] / reference["p50"]
+        if ratio > 1 + threshold and current["p50"] - reference["p50"] > min_delta:
+            regressions.append(
+                f"{name}: p50 {current['p50'] * 1000:.1f}ms vs {reference['p50'] * 1000:.1f}ms ({ratio:.2f}x)"
+            )
+    return regressions
+
+
+def run(options: Dict[str, Any], only: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Generate the data set described by options and run the selected benchmarks."""
+    data = usage_csv(
+        years=options["years"],
+        interval_minutes=options["interval"],
+        seed=options["seed"],
+        generation=True,
+    )
+    rows = data.count("\n") - 1
+
+    from app.configs.tariffs import TARIFF_REGISTRY
+
+    plans = TARIFF_REGISTRY.current().plans
+    benchmarks = function_benchmarks(data, rows, plans)
+    if not options["skip_endpoints"]:
+        benchmarks.update(endpoint_benchmarks(data, rows))
+
+    results: Dict[str, Any] = {"options": options, "rows": rows, "plans": len(plans), "benchmarks": {}}
+    for name, (fn, fn_rows) in benchmarks.items():
+        if only and not any(part in name for part in only):
+            continue
+        results["benchmarks"][name] = measure(fn, fn_rows, options["repeat"])
+        print(format_result(name, results["benchmarks"][name]), flush=True)
+    from benchmarks.startup import PHASES, startup_benchmarks
+
+    if not options["skip_startup"] and (not only or any(part in name for name in PHASES.values() for part in only)):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as usage:
+            usage.write(data)
+            usage.flush()
+            for name, result in startup_benchmarks(usage.name, options["repeat"]).items():
+                results["benchmarks"][name] = result
+                print(format_result(name, result), flush=True)
+    return results
+
+
+def format_result(name: str, result: Dict[str, float]) -> str:
+    throughput = f"{result['rows_per_s']:>11,} rows/s" if result["rows_per_s"] else f"{'-':>11} rows/s"
+    return (
+        f"{name:<36} p50 {result['p50'] * 1000:9.1f}ms  p99 {result['p99'] * 1000:9.1f}ms  "
+        f"{throughput}  peak {result['peak_mib']:8.2f} MiB"
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark usage parsing, pricing and endpoints.")
+    parser.add_argument("--years", type=float, default=1.0)
+    parser.add_argument("--interval", type=int, choices=[1, 15, 60], default=15, help="minutes between readings")
+    parser.add_argument("--plans", type=int, default=0, help="synthetic catalog size, 0 uses tariffs.json")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", nargs="*", help="run benchmarks whose name contains one of these")
+    parser.add_argument("--skip-endpoints", action="store_true")
+    parser.add_argument("--skip-startup", action="store_true", help="skip the cold start runs in fresh processes")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed p50 slowdown, 0.25 is 25%%")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("-o", "--output", help="also write the results as JSON here")
+    args = parser.parse_args(argv)
+
+    options = {
+        "years": args.years,
+        "interval": args.interval,
+        "plans": args.plans,
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "skip_endpoints": args.skip_endpoints,
+        "skip_startup": args.skip_startup,
+    }
+    if args.plans:
+        # set before the app is imported so the registry and spawned workers load it
+        catalog = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False)
+        json.dump(synthetic_catalog(args.plans, args.seed), catalog)
+        catalog.close()
+        os.environ["TARIFFS_PATH"] = catalog.name
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+    try:
+        results = run(options, args.only)
+    finally:
+        from app.managers.worker_pool import WORKER_POOL
+
+        WORKER_POOL.shutdown()
+        if args.plans:
+            os.unlink(os.environ["TARIFFS_PATH"])
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare against, run with --save-baseline first")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    recorded = {key: baseline["options"].get(key) for key in DATA_OPTIONS}
+    if recorded != {key: options[key] for key in DATA_OPTIONS}:
+        print(f"Baseline was recorded on other data ({recorded}), not comparing")
+        return 0
+    regressions = compare(results, baseline, args.threshold)
+    for message in regressions:
+        print(f"REGRESSION {message}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
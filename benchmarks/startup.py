@@ -0,0 +1,94 @@
+"""Cold start benchmark: every sample is a fresh interpreter.
+
+Run as ``python -m benchmarks.startup usage.csv`` it is the probe itself:
+it imports the app, runs the lifespan warm-up and posts the file to
+/recommend once, then prints the durations of the three phases as JSON.
+"""
+import time
+
+STARTED = time.perf_counter()
+
+import json
+import os
+import subprocess
+import sys
+from typing import Any, Dict, List
+
+PHASES = {
+    "import": "startup: import app.main",
+    "warmup": "startup: lifespan warm-up",
+    "first_response": "startup: first POST /recommend",
+}
+
+
+def probe(path: str) -> Dict[str, float]:
+    import app.main
+
+    imported = time.perf_counter()
+
+    import asyncio
+
+    import httpx
+
+    async def first_response() -> Dict[str, float]:
+        with open(path, "rb") as f:
+            body = f.read()
+        async with app.main.app.router.lifespan_context(app.main.app):
+            ready = time.perf_counter()
+            async with httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=app.main.app), base_url="http://bench"
+            ) as client:
+                response = await client.post("/recommend", files={"usageData": ("usage.csv", body, "text/csv")})
+                response.raise_for_status()
+            done = time.perf_counter()
+        return {
+            "import": imported - STARTED,
+            "warmup": ready - warmup_started,
+            "first_response": done - ready,
+        }
+
+    warmup_started = time.perf_counter()
+    return asyncio.run(first_response())
+
+
+def startup_benchmarks(path: str, repeat: int) -> Dict[str, Dict[str, Any]]:
+    """Run the probe `repeat` times in fresh processes, one result per phase.
+
+    The environment is inherited, so TARIFFS_PATH and STARTUP_WARMUP apply.
+    peak_mib is the largest resident set of a probe process.
+    """
+    from benchmarks.run import percentile
+
+    samples: Dict[str, List[float]] = {phase: [] for phase in PHASES}
+    peak = 0.0
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for _ in range(max(1, repeat)):
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.startup", path],
+            cwd=root,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        result = json.loads(output.splitlines()[-1])
+        for phase in PHASES:
+            samples[phase].append(result[phase])
+        peak = max(peak, result["max_rss_mib"])
+    return {
+        name: {
+            "p50": round(percentile(samples[phase], 50), 6),
+            "p99": round(percentile(samples[phase], 99), 6),
+            "rows_per_s": 0,
+            "peak_mib": round(peak, 2),
+        }
+        for phase, name in PHASES.items()
+    }
+
+
+if __name__ == "__main__":
+    import resource
+
+    durations: Dict[str, float] = probe(sys.argv[1])
+    # ru_maxrss is in KiB on Linux
+    durations["max_rss_mib"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps(durations))
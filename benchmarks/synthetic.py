@@ -0,0 +1,96 @@
+import math
+import random
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List
+
+CSV_HEADER = "datetime,duration,unit,consumption,generation\n"
+
+
+def household_load(hour: float, day_of_year: int) -> float:
+    """Average household demand in kW: night baseline, morning and evening peaks, more in winter."""
+    morning = 0.8 * math.exp(-((hour - 7.5) ** 2) / 2)
+    evening = 1.4 * math.exp(-((hour - 19) ** 2) / 4)
+    winter = 1 + 0.35 * math.cos(2 * math.pi * day_of_year / 365)
+    return (0.3 + morning + evening) * winter
+
+
+def solar_output(hour: float, day_of_year: int, capacity: float) -> float:
+    """Rooftop PV output in kW: a bell curve around noon, longer and stronger in summer."""
+    daylight = 6 + 3 * -math.cos(2 * math.pi * (day_of_year + 10) / 365)
+    offset = abs(hour - 12.5)
+    if offset >= daylight:
+        return 0.0
+    summer = 0.6 + 0.4 * -math.cos(2 * math.pi * (day_of_year + 10) / 365)
+    return capacity * summer * math.cos(math.pi / 2 * offset / daylight)
+
+
+def iter_usage_lines(
+    years: float = 1.0,
+    interval_minutes: int = 60,
+    seed: int = 0,
+    start: str = "2023-01-01",
+    generation: bool = True,
+    wh_share: float = 0.3,
+) -> Iterator[str]:
+    """Yield a usage CSV line by line, header first.
+
+    Readings cover `years` of data every `interval_minutes` (1, 15 or 60
+    make sense). A `wh_share` of the rows is reported in Wh instead of kWh
+    and, with `generation`, a solar array offsets part of the daytime load.
+    """
+    rng = random.Random(seed)
+    step = timedelta(minutes=interval_minutes)
+    fraction = interval_minutes / 60
+    moment = datetime.fromisoformat(start)
+    end = moment + timedelta(days=round(365 * years))
+    capacity = rng.uniform(2, 6) if generation else 0.0
+    yield CSV_HEADER
+    while moment < end:
+        day = moment.timetuple().tm_yday
+        hour = moment.hour + moment.minute / 60
+        cons = household_load(hour, day) * rng.lognormvariate(0, 0.35) * fraction
+        gen = solar_output(hour, day, capacity) * rng.uniform(0.5, 1.0) * fraction if capacity else 0.0
+        if rng.random() < wh_share:
+            unit, cons, gen = "Wh", round(cons * 1000, 1), round(gen * 1000, 1)
+        else:
+            unit, cons, gen = "kWh", round(cons, 4), round(gen, 4)
+        yield f"{moment.isoformat()},{interval_minutes * 60},{unit},{cons},{gen}\n"
+        moment += step
+
+
+def usage_csv(**kwargs: Any) -> str:
+    """Return a whole synthetic usage CSV, see iter_usage_lines for the options."""
+    return "".join(iter_usage_lines(**kwargs))
+
+
+def synthetic_catalog(size: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """Return `size` tariff plans mixing flat, time-of-use, tiered and peak-tiered shapes."""
+    rng = random.Random(seed)
+    plans: List[Dict[str, Any]] = []
+    for i in range(size):
+        kind = i % 4
+        if kind == 0:
+            configs = [{"cost": rng.randint(8, 30)}]
+        elif kind == 1:
+            split = rng.randint(5, 8)
+            configs = [
+                {"startHour": 0, "endHour": split, "cost": rng.randint(3, 12)},
+                {"startHour": split, "endHour": 24, "cost": rng.randint(12, 30)},
+            ]
+        elif kind == 2:
+            configs = [
+                {"cost": rng.randint(10, 20)},
+                {"billedAfterUsage": rng.randint(100, 600), "cost": rng.randint(12, 30)},
+            ]
+        else:
+            configs = [
+                {"cost": rng.randint(8, 18)},
+                {
+                    "startHour": 17,
+                    "endHour": 21,
+                    "billedAfterUsage": rng.randint(50, 300),
+                    "cost": rng.randint(20, 45),
+                },
+            ]
+        plans.append({"name": f"Synthetic {i}", "baseFee": rng.randint(0, 15), "hourlyConfigs": configs})
+    return plans